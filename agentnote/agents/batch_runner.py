@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import multiprocessing
+from datetime import datetime
+from typing import List, Dict, Any
+from ..core.config import config
+
+class BatchRunner:
+    """批量任务运行器 - 从JSONL读取任务，每个任务在独立进程中运行（独立的智能体、内核和notebook）"""
+
+    EXIT_GRACE = 5  # 子进程退出后等待结果的秒数
+
+    def __init__(self, tasks_file: str, api_key: str, results_file: str = None, workers: int = None,
+                 task_timeout: int = None, output_dir: str = None, retry_failed: bool = False):
+        self.tasks_file = tasks_file
+        self.api_key = api_key
+        self.results_file = results_file or config.batch.results_file
+        self.workers = workers or config.batch.workers
+        self.task_timeout = task_timeout or config.batch.task_timeout
+        self.output_dir = os.path.abspath(output_dir or config.batch.output_dir)
+        self.retry_failed = retry_failed
+        # 任务中的相对路径按启动批处理的目录解析
+        self.workdir = os.getcwd()
+
+    def load_tasks(self) -> List[Dict[str, Any]]:
+        """读取任务文件，每行一个JSON对象：{"id": 可选, "task": 任务描述}"""
+        tasks = []
+        seen = set()
+        with open(self.tasks_file, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    print(f"任务文件第 {line_no} 行格式错误，已跳过: {e}")
+                    continue
+                description = record.get('task') or record.get('description')
+                if not description:
+                    print(f"任务文件第 {line_no} 行缺少任务描述，已跳过")
+                    continue
+                task_id = str(record.get('id') or f"task-{line_no}")
+                if task_id in seen:
+                    print(f"任务ID重复，已跳过: {task_id}")
+                    continue
+                seen.add(task_id)
+                tasks.append({'id': task_id, 'task': description})
+        return tasks
+
+    def _finished_task_ids(self) -> set:
+        """读取已有结果，用于崩溃后继续运行"""
+        finished = set()
+        if not os.path.exists(self.results_file):
+            return finished
+        with open(self.results_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能留下不完整的最后一行
+                    continue
+                if result.get('status') == 'success' or not self.retry_failed:
+                    finished.add(result.get('id'))
+        return finished
+
+    def run(self) -> Dict[str, int]:
+        """运行所有未完成的任务，返回各状态的数量"""
+        tasks = self.load_tasks()
+        finished = self._finished_task_ids()
+        pending = [t for t in tasks if t['id'] not in finished]
+        print(f"共 {len(tasks)} 个任务，已完成 {len(tasks) - len(pending)} 个，待运行 {len(pending)} 个")
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        ctx = multiprocessing.get_context('spawn')
+        result_queue = ctx.Queue()
+        config_dict = config.to_dict()
+        running = {}  # task id -> (process, task, start time)
+        exited = {}  # task id -> 发现进程退出的时间
+        summary = {}
+
+        try:
+            while pending or running:
+                # 补充运行中的任务
+                while pending and len(running) < self.workers:
+                    task = pending.pop(0)
+                    process = ctx.Process(
+                        target=_run_single_task,
+                        args=(task, self._notebook_path(task), self.api_key, self.workdir,
+                              config_dict, result_queue),
+                        name=f"agentnote-{task['id']}",
+                        daemon=True
+                    )
+                    process.start()
+                    running[task['id']] = (process, task, time.time())
+                    print(f"▶ 开始任务 {task['id']}")
+
+                try:
+                    result = result_queue.get(timeout=1)
+                except queue.Empty:
+                    result = None
+
+                if result is not None and result['id'] in running:
+                    process, _, _ = running.pop(result['id'])
+                    process.join(timeout=30)
+                    self._record(result, summary)
+
+                # 检查超时和异常退出的进程
+                now = time.time()
+                for task_id, (process, task, started) in list(running.items()):
+                    if now - started > self.task_timeout:
+                        process.kill()
+                        process.join()
+                        del running[task_id]
+                        self._record(self._failure_result(task, started, 'timeout',
+                                                          f"任务超时 ({self.task_timeout}秒)"), summary)
+                    elif not process.is_alive():
+                        # 进程退出后结果可能还在队列中，等待一段时间再判定为崩溃
+                        exited_at = exited.setdefault(task_id, now)
+                        if now - exited_at > self.EXIT_GRACE:
+                            del running[task_id]
+                            self._record(self._failure_result(task, started, 'crashed',
+                                                              f"进程异常退出，退出码 {process.exitcode}"), summary)
+        except KeyboardInterrupt:
+            print("\n批处理被中断，正在终止运行中的任务...")
+            for process, _, _ in running.values():
+                process.kill()
+            raise
+
+        print(f"批处理完成: {summary}")
+        return summary
+
+    def _notebook_path(self, task: Dict[str, Any]) -> str:
+        safe_id = re.sub(r'[^\w.-]', '_', task['id'])
+        return os.path.join(self.output_dir, f"{safe_id}.ipynb")
+
+    def _record(self, result: Dict[str, Any], summary: Dict[str, int]):
+        """追加写入一行结果并落盘，保证崩溃后可以继续"""
+        with open(self.results_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+        mark = "✅" if result['status'] == 'success' else "❌"
+        print(f"{mark} 任务 {result['id']}: {result['status']} ({result['duration']:.1f}秒)")
+
+    def _failure_result(self, task: Dict[str, Any], started: float, status: str, error: str) -> Dict[str, Any]:
+        finished = time.time()
+        return {
+            'id': task['id'],
+            'task': task['task'],
+            'status': status,
+            'error': error,
+            'started_at': datetime.fromtimestamp(started).isoformat(),
+            'finished_at': datetime.fromtimestamp(finished).isoformat(),
+            'duration': finished - started,
+            'notebook': self._notebook_path(task),
+            'steps': None,
+            'usage': None
+        }
+
+
+def _run_single_task(task: Dict[str, Any], notebook_path: str, api_key: str, workdir: str,
+                     config_dict: Dict[str, Any], result_queue):
+    """子进程入口：创建独立的智能体运行一个任务，把结果放入队列"""
+    started = time.time()
+    log_path = os.path.splitext(notebook_path)[0] + ".log"
+    log_file = open(log_path, 'a', encoding='utf-8', buffering=1)
+    sys.stdout = sys.stderr = log_file
+
+    config.update_from_dict(config_dict)
+    agent = None
+    status, error = 'failed', None
+    try:
+        from .note_agent import NoteAgent
+        agent = NoteAgent(api_key, notebook_path=notebook_path, workdir=workdir)
+        status = 'success' if agent.run_task(task['task']) else 'failed'
+    except Exception as e:
+        status, error = 'error', f"{type(e).__name__}: {e}"
+        print(error)
+    finally:
+        if agent is not None:
+            agent.close()
+
+    finished = time.time()
+    agent_status = agent.get_status() if agent is not None else {}
+    if error is None and agent_status.get('usage', {}).get('aborted'):
+        error = agent_status['usage']['aborted']
+    result_queue.put({
+        'id': task['id'],
+        'task': task['task'],
+        'status': status,
+        'error': error,
+        'started_at': datetime.fromtimestamp(started).isoformat(),
+        'finished_at': datetime.fromtimestamp(finished).isoformat(),
+        'duration': finished - started,
+        'notebook': notebook_path,
+        'steps': {
+            'total': agent_status.get('total_steps'),
+            'completed': agent_status.get('current_step')
+        } if agent_status else None,
+        'usage': dict(agent.client.usage_totals) if agent is not None else None
+    })
+    log_file.flush()
@@ -1,3 +1,4 @@
 from .note_agent import NoteAgent
+from .batch_runner import BatchRunner
 
-__all__ = ['NoteAgent']
\ No newline at end of file
+__all__ = ['NoteAgent', 'BatchRunner']
\ No newline at end of file
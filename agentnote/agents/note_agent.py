@@ -1,24 +1,37 @@
 import time
+import re
 import yaml
 import os
+from concurrent.futures import ThreadPoolExecutor
 import nbformat as nbf
 from typing import List, Dict, Any, Optional
 from ..core.config import config
 from ..core.deepseek_client import DeepSeekClient
+from ..core.http_pool import get_http_pool
 from ..core.content_parser import ContentParser
+from ..core.notebook_generator import NotebookGenerator
 from ..core.notebook_manager import NotebookManager
 from ..core.executor import NotebookExecutor
 from ..core.notebook_exporter import NotebookExporter
+from ..core.preflight import PreflightAnalyzer, format_diagnostics
+from ..core.tracing import get_tracer, span, current_span, traced
+from ..core.metrics import get_metrics, BudgetExceededError
+from ..core.plan_dag import PlanDAG
+from ..core.plan_schema import parse_plan_json, supports_json_mode, PlanValidationError, JSON_RESPONSE_FORMAT
+from ..core.plan_store import PlanStore
 
 class NoteAgent:
     """NoteAgent智能体 - 自动化任务执行和Notebook生成"""
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, kernel_pool=None, notebook_path: str = None, workdir: str = None):
         # 初始化组件 - 先创建NotebookManager，再传递给Executor
-        self.manager = NotebookManager()
+        self.manager = NotebookManager(notebook_path)
         self.client = DeepSeekClient(api_key)
         self.parser = ContentParser()
-        self.executor = NotebookExecutor(self.manager)
+        self.executor = NotebookExecutor(self.manager, workdir)
         self.exporter = NotebookExporter()
+        self.preflight = PreflightAnalyzer() if config.agent.preflight_checks else None
+        self.plan_store = PlanStore() if config.agent.plan_cache else None
+        self.kernel_pool = kernel_pool  # 可选的预热内核池，每个任务分配一个内核
         
         # 加载提示词
         self.prompts = self._load_prompts()
@@ -29,6 +42,17 @@ class NoteAgent:
         self.current_step = 0
         self.execution_history = []
         self.last_error = None
+        self.plan_source = None  # 复用缓存规划时的匹配方式
+        self._plan_key = None  # 复用的缓存规划的键
+        self.step_code = {}  # 每个步骤最终执行成功的代码，任务成功后存入规划缓存
+        self._cached_code = {}  # 复用的规划中尚未使用的步骤代码
+        
+        # 推测执行：当前步骤执行时预先生成下一步骤的代码
+        self._speculation = None
+        self._speculation_active = False
+        self._speculation_pool = None
+        self._speculation_future = None  # 最近提交的推测生成，作废后可能仍在运行
+        self.speculation_stats = {'issued': 0, 'hits': 0, 'misses': 0, 'discarded': 0, 'skipped': 0}
         
         # 初始化notebook
         self.nb = self.manager.initialize_notebook()
@@ -59,41 +83,87 @@ class NoteAgent:
         for i, step in enumerate(steps, 1):
             markdown += f"#### 🔹 步骤 {i}: {step.get('name', '未命名步骤')}\n"
             markdown += f"- **描述**: {step.get('description', '无描述')}\n"
-            markdown += f"- **预期输出**: {step.get('expected_output', '无预期输出')}\n\n"
+            markdown += f"- **预期输出**: {step.get('expected_output', '无预期输出')}\n"
+            if step.get('depends_on') is not None:
+                deps = "、".join(f"步骤 {d + 1}" for d in step['depends_on']) or "无"
+                markdown += f"- **依赖**: {deps}\n"
+            if step.get('estimated_cost'):
+                markdown += f"- **预估开销**: {step['estimated_cost']}\n"
+            markdown += "\n"
         
         markdown += f"**总计**: {len(steps)} 个步骤\n"
-        markdown += f"**规划时间**: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        markdown += NotebookGenerator.timestamp_line('**规划时间**') + "\n"
         
         return markdown
     
+    @traced('plan_task')
     def plan_task(self, task_description: str) -> List[Dict[str, str]]:
         """任务规划"""
         print(f"开始规划任务: {task_description}")
         
-        system_prompt = self._get_prompt('system_prompts', 'planner')
-        user_prompt = self._get_prompt('task_prompts', 'planning', 
-                                     task_description=task_description)
-        
-        plan_content = self.client.generate_with_retry(system_prompt, user_prompt)
-        if not plan_content:
-            print("任务规划失败")
-            return []
-        
-        # 解析规划步骤
-        steps = self._parse_planning_steps(plan_content)
+        # 重复的任务直接复用之前成功的规划
+        match = self.plan_store.lookup(task_description) if self.plan_store is not None else None
+        self.plan_source = match.kind if match is not None else None
+        self._plan_key = match.key if match is not None else None
+        self._cached_code = {i: code for i, code in enumerate(match.codes or []) if code} if match else {}
+        if match is not None:
+            steps = match.steps
+            current_span().set(plan_cache=match.kind)
+            print(f"复用缓存的规划 ({match.kind}, 相似度 {match.similarity:.2f}): {match.task}")
+        else:
+            user_prompt = self._get_prompt('task_prompts', 'planning', 
+                                         task_description=task_description)
+            
+            with get_metrics().step('plan'):
+                steps = self._plan_structured(user_prompt) if config.agent.structured_planning else None
+                if steps is None:
+                    system_prompt = self._get_prompt('system_prompts', 'planner')
+                    plan_content = self.client.generate_with_retry(system_prompt, user_prompt,
+                                                                   model=get_metrics().enforce_budget())
+                    if not plan_content:
+                        print("任务规划失败")
+                        return []
+                    
+                    # 解析规划步骤
+                    steps = self._parse_planning_steps(plan_content)
         self.execution_plan = steps
         self.current_task = task_description
         self.current_step = 0
+        self.step_code = {}
         
         # 将规划结果添加到notebook中
         if steps:
             plan_markdown = self._format_plan_as_markdown(steps)
-            self.nb = self.manager.load_notebook()
+            if match is not None:
+                reused = "规划和代码" if self._cached_code else "规划"
+                plan_markdown += f"**规划来源**: 复用任务「{match.task}」的{reused}\n"
             self.manager.add_markdown_cell(self.nb, plan_markdown)
         
         print(f"任务规划完成，共 {len(steps)} 个步骤")
         return steps
     
+    def _plan_structured(self, user_prompt: str) -> Optional[List[Dict[str, Any]]]:
+        """请求JSON格式的规划并校验；失败时返回None，由调用方改用Markdown规划"""
+        model = get_metrics().enforce_budget() or config.deepseek.model
+        system_prompt = self._get_prompt('system_prompts', 'planner_json')
+        response_format = JSON_RESPONSE_FORMAT if supports_json_mode(model) else None
+        plan_content = self.client.generate_with_retry(system_prompt, user_prompt, model=model,
+                                                       response_format=response_format)
+        if not plan_content:
+            print("结构化规划请求失败，改用Markdown规划")
+            return None
+        
+        with span('parse_plan', chars=len(plan_content)):
+            try:
+                return parse_plan_json(plan_content)
+            except PlanValidationError as e:
+                # 模型没有按要求输出JSON时，回答本身可能就是Markdown规划，不必再请求一次
+                steps = self._parse_planning_steps(plan_content)
+                if steps:
+                    return steps
+                print(f"结构化规划结果无效 ({e})，改用Markdown规划")
+                return None
+    
     def _print_formatted_steps(self, steps: List[Dict[str, str]]):
         """格式化打印任务步骤"""
         print("\n" + "="*80)
@@ -104,6 +174,8 @@ class NoteAgent:
             print(f"\n🔹 步骤 {i}: {step.get('name', '未命名步骤')}")
             print(f"   📝 描述: {step.get('description', '无描述')}")
             print(f"   ✅ 预期输出: {step.get('expected_output', '无预期输出')}")
+            if step.get('estimated_cost'):
+                print(f"   ⏱️ 预估开销: {step['estimated_cost']}")
             
             # 添加分隔线，除了最后一步
             if i < len(steps):
@@ -136,40 +208,60 @@ class NoteAgent:
                 current_step['description'] = line.replace('- **描述**:', '').strip()
             elif line.startswith('- **预期输出**:') and current_step:
                 current_step['expected_output'] = line.replace('- **预期输出**:', '').strip()
+            elif line.startswith('- **依赖**:') and current_step:
+                # 步骤编号从1开始，内部使用从0开始的索引
+                current_step['depends_on'] = [int(n) - 1 for n in re.findall(r'\d+', line)]
         
         if current_step:
             steps.append(current_step)
         
         return steps
     
-    def execute_step(self, step_index: int) -> bool:
-        """执行单个步骤"""
+    @traced('execute_step')
+    def execute_step(self, step_index: int, context: str = None, generated: tuple = None) -> bool:
+        """
+        执行单个步骤
+        
+        Args:
+            context: 预先构建的上下文（并行生成时使用），默认在此构建
+            generated: 预先生成的代码，即 _generate_code 的返回值，用作第一次尝试
+        """
         if step_index >= len(self.execution_plan):
             print("步骤索引超出范围")
             return False
         
         step = self.execution_plan[step_index]
         print(f"执行步骤 {step_index + 1}: {step['name']}")
+        current_span().set(step=step_index + 1)
+        # 超出耗时预算时不再开始新的步骤
+        get_metrics().enforce_budget()
         
-        # 确保使用当前的notebook实例
+        # 确保使用当前的notebook实例（文件未被外部修改时不会读磁盘）
         self.nb = self.manager.load_notebook()
         
         # 添加上下文信息
-        context = self._build_context(step_index)
+        if context is None:
+            context = self._build_context(step_index)
         
         # 生成步骤说明
         self._add_step_description(step, step_index)
         
+        # 使用缓存规划中的代码或推测生成的代码（如果有效）
+        if generated is None:
+            generated = self._take_cached_code(step_index)
+        if generated is None:
+            generated = self._take_speculation(step_index)
+        
         # 生成和执行代码
-        success = self._generate_and_execute_code(step, context, step_index)
+        success = self._generate_and_execute_code(step, context, step_index, generated)
         
         if success:
-            self.current_step = step_index + 1
             self.execution_history.append({
                 'step': step_index,
                 'name': step['name'],
                 'status': 'success'
             })
+            self.current_step = len({h['step'] for h in self.execution_history if h['status'] == 'success'})
         else:
             self.execution_history.append({
                 'step': step_index,
@@ -177,17 +269,27 @@ class NoteAgent:
                 'status': 'failed'
             })
         
+        # 检查点：步骤结束
+        self.manager.flush()
+        if config.notebook.export_json and self.manager.nb is not None:
+            # 只追加本步骤新完成的cell，不再重新导出整本notebook
+            with span('export_cells') as export_span:
+                export_span.set(cells=self.exporter.export_new_cells(self.manager.nb, self.manager.notebook_path,
+                                                                     self.manager.take_changed_cells()))
+        current_span().set(success=success)
         return success
     
-    def _build_context(self, step_index: int) -> str:
+    @traced('build_context')
+    def _build_context(self, step_index: int, completed: List[int] = None) -> str:
         """构建上下文信息"""
         context = f"任务: {self.current_task}\n"
         context += f"当前步骤: {step_index + 1}/{len(self.execution_plan)}\n"
         context += f"步骤名称: {self.execution_plan[step_index]['name']}\n"
         
-        if step_index > 0:
+        completed = range(step_index) if completed is None else completed
+        if completed:
             context += "已完成步骤:\n"
-            for i in range(step_index):
+            for i in completed:
                 context += f"- {self.execution_plan[i]['name']}\n"
         
         # 添加notebook上下文
@@ -201,23 +303,31 @@ class NoteAgent:
         markdown_content = f"## 步骤 {step_index + 1}: {step['name']}\n\n"
         markdown_content += f"**描述**: {step['description']}\n\n"
         markdown_content += f"**预期输出**: {step['expected_output']}\n\n"
-        markdown_content += f"**执行时间**: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        markdown_content += NotebookGenerator.timestamp_line('**执行时间**') + "\n"
         
         self.manager.add_markdown_cell(self.nb, markdown_content)
     
-    def _generate_and_execute_code(self, step: Dict[str, str], context: str, step_index: int) -> bool:
+    def _generate_and_execute_code(self, step: Dict[str, str], context: str, step_index: int,
+                                   generated: tuple = None) -> bool:
         """生成和执行代码 - 修改：即使执行失败也保留代码cell"""
         max_retries = config.agent.max_retries
         
         for attempt in range(max_retries):
             print(f"生成代码 (尝试 {attempt + 1}/{max_retries})...")
             
-            # 生成代码
-            code_success, markdown_content, python_code = self._generate_code(step, context, attempt)
+            # 生成代码，第一次尝试可以直接使用预先生成的结果
+            if attempt == 0 and generated is not None:
+                code_success, markdown_content, python_code = generated
+            else:
+                code_success, markdown_content, python_code = self._generate_code(step, step_index, context, attempt)
             if not code_success:
                 print("代码生成失败，继续重试...")
                 continue
             
+            # 执行前检查：确定会失败的代码不执行，直接带着问题说明重新生成
+            if python_code and not self._preflight_check(python_code):
+                continue
+            
             # 添加生成的代码到notebook
             if markdown_content:
                 self.manager.add_markdown_cell(self.nb, markdown_content)
@@ -226,21 +336,113 @@ class NoteAgent:
                 # 总是添加代码cell到notebook，即使执行失败也要保留
                 code_cell = self.manager.add_code_cell(self.nb, python_code)
                 
+                # 执行期间预先生成下一步骤的代码
+                self._start_speculation(step_index, code_cell)
+                
                 # 执行代码
                 if config.agent.enable_execution:
                     execution_success = self._execute_and_verify(step_index, attempt)
                     if execution_success:
+                        self.step_code[step_index] = python_code
                         return True
                     else:
                         # 执行失败时，保留代码cell作为上下文
                         print(f"代码执行失败，准备重试... (剩余重试次数: {max_retries - attempt - 1})")
                 else:
+                    self.step_code[step_index] = python_code
                     return True  # 如果不执行代码，直接返回成功
         
         print(f"步骤 {step_index + 1} 执行失败，已达到最大重试次数")
         return False
     
-    def _generate_code(self, step: Dict[str, str], context: str, attempt: int) -> tuple:
+    def _preflight_check(self, python_code: str) -> bool:
+        if self.preflight is None or not config.agent.enable_execution:
+            return True
+        start = time.time()
+        previous_cells = [cell.source for cell in self.nb.cells if cell.cell_type == 'code']
+        with span('preflight') as preflight_span:
+            diagnostics = self.preflight.analyze(python_code, previous_cells, self.executor.kernel_cwd())
+            preflight_span.set(diagnostics=len(diagnostics))
+        if not diagnostics:
+            return True
+        report = format_diagnostics(diagnostics)
+        print(f"❌ 执行前检查未通过 ({(time.time() - start) * 1000:.1f}ms):")
+        print(report)
+        # 未通过的代码不会加入notebook，重试时附上带行号的原代码，问题说明中的行号才有对照
+        numbered = '\n'.join(f"{number:>4} | {line}" for number, line in enumerate(python_code.splitlines(), 1))
+        self.last_error = f"{report}\n未执行的代码:\n```python\n{numbered}\n```"
+        return False
+    
+    def _take_cached_code(self, step_index: int):
+        """取出复用的规划中该步骤的代码，只用作第一次尝试，执行失败后照常重新生成"""
+        code = self._cached_code.pop(step_index, None)
+        if code is None:
+            return None
+        print(f"步骤 {step_index + 1} 复用缓存的代码")
+        return True, "复用之前成功运行的相同任务中该步骤的代码。", code
+    
+    def _start_speculation(self, step_index: int, basis_cell):
+        """以当前步骤的代码（尚无输出）为上下文，在后台生成下一步骤的代码"""
+        next_index = step_index + 1
+        if (not self._speculation_active or next_index >= len(self.execution_plan)
+                or next_index in self._cached_code):
+            return
+        # 之前基于失败尝试的推测作废
+        self._discard_speculation()
+        # 已经开始的生成无法取消；这时不再排队新的推测，否则它要等作废的生成结束，下一步骤反而更慢
+        if self._speculation_future is not None and not self._speculation_future.done():
+            self.speculation_stats['skipped'] += 1
+            return
+        
+        context = self._build_context(next_index)
+        if self._speculation_pool is None:
+            self._speculation_pool = ThreadPoolExecutor(max_workers=1)
+        future = self._speculation_pool.submit(self._generate_code, self.execution_plan[next_index], next_index,
+                                               context, 0)
+        self._speculation_future = future
+        self._speculation = {'step': next_index, 'future': future, 'basis': basis_cell}
+        self.speculation_stats['issued'] += 1
+    
+    def _take_speculation(self, step_index: int):
+        """取出推测结果；前一步骤失败或被重新生成时推测作废，返回None"""
+        speculation = self._speculation
+        self._speculation = None
+        if speculation is None:
+            return None
+        
+        basis = speculation['basis']
+        last_code_cell = next((c for c in reversed(self.nb.cells) if c.cell_type == 'code'), None)
+        valid = (
+            speculation['step'] == step_index
+            and last_code_cell is basis
+            and not any(o.output_type == 'error' for o in basis.get('outputs', []))
+        )
+        if valid:
+            try:
+                generated = speculation['future'].result()
+                valid = generated[0]
+            except Exception as e:
+                print(f"推测生成失败: {e}")
+                valid = False
+        
+        if not valid:
+            speculation['future'].cancel()
+            self.speculation_stats['misses'] += 1
+            print(f"步骤 {step_index + 1} 的推测生成结果已失效，重新生成")
+            return None
+        
+        self.speculation_stats['hits'] += 1
+        print(f"步骤 {step_index + 1} 使用推测生成的代码")
+        return generated
+    
+    def _discard_speculation(self):
+        if self._speculation is not None:
+            self._speculation['future'].cancel()
+            self._speculation = None
+            self.speculation_stats['discarded'] += 1
+    
+    @traced('generate_code')
+    def _generate_code(self, step: Dict[str, str], step_index: int, context: str, attempt: int) -> tuple:
         system_prompt = self._get_prompt('system_prompts', 'code_generator')
         
         # 增强用户提示词，明确说明要参考前面的内容
@@ -255,15 +457,20 @@ class NoteAgent:
         if attempt > 0 and hasattr(self, 'last_error') and self.last_error:
             enhanced_user_prompt += f"\n\n之前的执行错误: {self.last_error}\n请修复这个错误。"
         
-        content = self.client.generate_with_retry(system_prompt, enhanced_user_prompt)
+        # 重试时不复用缓存中的回答，它已经被证明无法正确执行；超出预算时降级模型或中止
+        metrics = get_metrics()
+        with metrics.step(step_index + 1):
+            content = self.client.generate_with_retry(system_prompt, enhanced_user_prompt, bypass_cache=attempt > 0,
+                                                      model=metrics.enforce_budget())
         if not content:
             return False, "", ""
         
         # 解析内容
-        python_code, markdown_content = self.parser.extract_python_code(content)
+        with span('parse_content', chars=len(content)):
+            python_code, markdown_content = self.parser.extract_python_code(content)
         
-        # 验证代码语法
-        if python_code:
+        # 验证代码语法（启用执行前检查时由其报告语法错误，错误信息会提供给重试）
+        if python_code and self.preflight is None:
             is_valid, validation_msg = self.parser.validate_python_code(python_code)
             print(f"代码验证: {validation_msg}")
             if not is_valid:
@@ -272,6 +479,7 @@ class NoteAgent:
         
         return True, markdown_content, python_code
 
+    @traced('execute_and_verify')
     def _execute_and_verify(self, step_index: int, attempt: int) -> bool:
         """执行代码并验证结果"""
         print("执行代码...")
@@ -288,15 +496,15 @@ class NoteAgent:
         
         code_to_execute = last_cell.source
         
+        # 检查点：执行前落盘，内核崩溃时已生成的代码不会丢失
+        self.manager.flush()
+        
         # 执行代码
-        execution_result = self.manager.execute_cell_safely(self.executor, code_to_execute, len(self.nb.cells)-1)
+        execution_result = self.manager.execute_cell_safely(self.executor, code_to_execute, len(self.nb.cells)-1, nb=self.nb)
         
         if execution_result.get('success'):
             print("✅ 代码执行成功")
             
-            # 重新加载notebook以获取最新的执行结果
-            self.nb = self.manager.load_notebook()
-            
             # 清除错误记录
             self.last_error = None
             return True
@@ -315,11 +523,33 @@ class NoteAgent:
         
     def run_task(self, task_description: str) -> bool:
         """运行完整任务"""
+        # 开启追踪时，任务结束后打印各阶段的耗时统计
+        with get_tracer().task('run_task', task=task_description[:200]), get_metrics().task(task_description):
+            try:
+                if self.kernel_pool is None or self.executor.mode != 'kernel':
+                    return self._run_task(task_description)
+                
+                # 从内核池领取预热好的内核，任务结束后归还
+                with span('kernel_pool.acquire'):
+                    self.executor.attach_session(self.kernel_pool.acquire())
+                try:
+                    return self._run_task(task_description)
+                finally:
+                    self.kernel_pool.release(self.executor.detach_session())
+            except BudgetExceededError as e:
+                self._discard_speculation()
+                print(f"❌ 任务中止: {e}")
+                return False
+            finally:
+                # 检查点：任务结束
+                self.manager.flush()
+    
+    def _run_task(self, task_description: str) -> bool:
         print(f"开始执行任务: {task_description}")
         
         # 初始化notebook
         self.nb = self.manager.load_notebook()
-        self.manager.add_markdown_cell(self.nb, f"# 任务: {task_description}\n\n开始时间: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        self.manager.add_markdown_cell(self.nb, f"# 任务: {task_description}\n\n{NotebookGenerator.timestamp_line('开始时间')}")
         
         # 任务规划
         steps = self.plan_task(task_description)
@@ -330,37 +560,136 @@ class NoteAgent:
             print("任务规划失败")
             return False
 
-        # 按顺序执行步骤
-        for i in range(len(steps)):
-            success = self.execute_step(i)
-            if not success and config.agent.enable_auto_fix:
-                print(f"步骤 {i + 1} 执行失败，尝试自动修复...")
-                # 这里可以添加更复杂的修复逻辑
-                success = self.execute_step(i)  # 重试一次
-            
-            if not success:
-                print(f"任务在步骤 {i + 1} 失败")
-                return False
-            
-            # 清理旧cell
-            self.nb = self.manager.cleanup_old_cells(self.nb)
+        dag = PlanDAG(steps) if config.agent.parallel_steps else None
+        if dag is not None and dag.width > 1:
+            # 计划中有互不依赖的步骤，按层并行生成代码
+            success = self._run_steps_by_dag(dag)
+        else:
+            # 按顺序执行步骤
+            self._speculation_active = config.agent.speculative_prefetch
+            success = True
+            try:
+                for i in range(len(steps)):
+                    if not self._run_step_with_fix(i):
+                        success = False
+                        break
+                    
+                    # 等待间隔
+                    with span('sleep_interval'):
+                        time.sleep(config.notebook.sleep_interval)
+            finally:
+                self._speculation_active = False
+                self._discard_speculation()
             
-            # 等待间隔
-            time.sleep(config.notebook.sleep_interval)
+            if config.agent.speculative_prefetch:
+                stats = self.speculation_stats
+                print(f"推测生成: 发起 {stats['issued']} 次，命中 {stats['hits']} 次，"
+                      f"失效 {stats['misses']} 次，丢弃 {stats['discarded']} 次，"
+                      f"因作废的生成仍在运行而跳过 {stats['skipped']} 次")
+        
+        if not success:
+            if self._plan_key is not None:
+                # 复用的规划这次没有成功，删除被复用的那条（可能属于另一个相似任务），下次重新规划
+                self.plan_store.invalidate(self._plan_key)
+            return False
+        
+        if self.plan_store is not None:
+            usage = get_metrics().task_usage() or {}
+            self.plan_store.save(task_description, self.execution_plan,
+                                 [self.step_code.get(i) for i in range(len(self.execution_plan))], {
+                                     'success': True,
+                                     'steps': len(self.execution_plan),
+                                     'duration': usage.get('elapsed'),
+                                     'llm_requests': usage.get('requests'),
+                                     'tokens': usage.get('tokens'),
+                                     'plan_source': self.plan_source
+                                 })
         
         # 添加任务完成标记
-        self.nb = self.manager.load_notebook()
-        self.manager.add_markdown_cell(self.nb, f"## 任务完成\n\n完成时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n所有步骤执行完毕!")
+        self.manager.add_markdown_cell(self.nb, f"## 任务完成\n\n{NotebookGenerator.timestamp_line('完成时间')}\n\n所有步骤执行完毕!")
         
         print("任务执行完成!")
         return True
     
+    def _run_step_with_fix(self, step_index: int, context: str = None, generated: tuple = None) -> bool:
+        """执行步骤，失败时按配置自动修复一次"""
+        success = self.execute_step(step_index, context, generated)
+        if not success and config.agent.enable_auto_fix:
+            print(f"步骤 {step_index + 1} 执行失败，尝试自动修复...")
+            # 这里可以添加更复杂的修复逻辑
+            # 重试一次；沿用按已完成步骤构建的上下文，不能退回到包含所有前序步骤的默认上下文
+            success = self.execute_step(step_index, context)
+        
+        if not success:
+            print(f"任务在步骤 {step_index + 1} 失败")
+            return False
+        
+        # 清理旧cell
+        self.nb = self.manager.cleanup_old_cells(self.nb)
+        return True
+    
+    def _run_steps_by_dag(self, dag: PlanDAG) -> bool:
+        """按依赖图逐层执行：同一层的代码生成并发进行，写入notebook和执行按确定的拓扑顺序串行"""
+        print(f"计划包含 {len(dag.levels)} 层，最大并行度 {dag.width}")
+        completed = []
+        
+        for level in dag.levels:
+            self.nb = self.manager.load_notebook()
+            contexts = {i: self._build_context(i, completed) for i in level}
+            
+            generated = {}
+            # 有缓存代码的步骤不需要生成
+            pending = [i for i in level if i not in self._cached_code]
+            if len(pending) > 1:
+                workers = min(len(pending), config.agent.max_parallel_generations)
+                print(f"并行生成步骤 {', '.join(str(i + 1) for i in pending)} 的代码...")
+                with span('parallel_generation', steps=len(pending)), ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = {i: pool.submit(self._generate_code, self.execution_plan[i], i, contexts[i], 0)
+                               for i in pending}
+                generated = {i: future.result() for i, future in futures.items()}
+            
+            for i in level:
+                if not self._run_step_with_fix(i, contexts[i], generated.get(i)):
+                    return False
+                completed.append(i)
+            
+            # 等待间隔
+            with span('sleep_interval'):
+                time.sleep(config.notebook.sleep_interval)
+        
+        return True
+    
+    def close(self):
+        """写出未保存的修改并释放常驻内核等资源"""
+        self.manager.flush()
+        self.executor.shutdown()
+        if self._speculation_pool is not None:
+            self._speculation_pool.shutdown(wait=False, cancel_futures=True)
+            self._speculation_pool = None
+            self._speculation_future = None
+    
     def get_status(self) -> Dict[str, Any]:
         """获取当前状态"""
-        return {
+        status = {
             'current_task': self.current_task,
             'total_steps': len(self.execution_plan),
             'current_step': self.current_step,
             'execution_history': self.execution_history,
             'completion_percentage': (self.current_step / len(self.execution_plan)) * 100 if self.execution_plan else 0
-        }
\ No newline at end of file
+        }
+        if self.client.cache is not None:
+            status['llm_cache'] = self.client.cache.get_stats()
+        if self.executor.cache is not None:
+            status['execution_cache'] = self.executor.cache.get_stats()
+        if self.plan_store is not None:
+            status['plan_cache'] = dict(self.plan_store.get_stats(), source=self.plan_source)
+        metrics = get_metrics()
+        usage = metrics.task_usage()
+        if usage is not None:
+            status['usage'] = usage
+            status['usage_by_step'] = metrics.get_stats(usage['id'])
+        status['api_scheduler'] = self.client.scheduler.get_stats()
+        status['http_pool'] = get_http_pool().get_stats()
+        if config.agent.speculative_prefetch:
+            status['speculation'] = dict(self.speculation_stats)
+        return status
\ No newline at end of file
@@ -0,0 +1,214 @@
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import hashlib
+import threading
+from typing import Dict, Any, List
+from .config import config
+
+_STOP = object()
+
+class ApiCallLogger:
+    """API调用日志写入器 - 调用方只入队，由后台线程批量写入、按大小/时间轮转压缩"""
+
+    def __init__(self, log_file: str = None):
+        cfg = config.deepseek
+        self.log_file = log_file or cfg.log_file
+        self.batch_size = cfg.log_batch_size
+        self.flush_interval = cfg.log_flush_interval
+        self.rotate_max_bytes = cfg.log_rotate_mb * 1024 * 1024 if cfg.log_rotate_mb else 0
+        self.rotate_interval = cfg.log_rotate_interval
+        self.compression = cfg.log_compression
+        self.hash_prompts = cfg.log_hash_prompts
+        self.prompts_file = os.path.splitext(self.log_file)[0] + ".prompts.jsonl"
+
+        self._file = None
+        self._opened_at = None
+        self._known_prompts = None  # 已写入提示词存储的哈希
+        self._write_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = None
+        if cfg.log_async:
+            self._thread = threading.Thread(target=self._run, name="api-logger", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, entry: Dict[str, Any]):
+        """记录一条日志，异步模式下立即返回"""
+        if self._thread is None or self._closed:
+            with self._write_lock:
+                self._write_batch([entry])
+            return
+        self._queue.put(entry)
+
+    def flush(self, timeout: float = None):
+        """等待队列中已有的日志全部写入磁盘"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """写出剩余日志并停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _run(self):
+        while True:
+            batch = []
+            waiters = []
+            stop = False
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            # 尽量多取一些，合并为一次写入
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                with self._write_lock:
+                    try:
+                        self._write_batch(batch)
+                    except Exception as e:
+                        print(f"日志记录失败: {e}")
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write_batch(self, entries: List[Dict[str, Any]]):
+        lines = []
+        for entry in entries:
+            if self.hash_prompts:
+                entry = self._replace_prompts_with_hashes(entry)
+            lines.append(json.dumps(entry, ensure_ascii=False) + '\n')
+
+        if self._should_rotate():
+            self._rotate()
+        if self._file is None:
+            self._file = open(self.log_file, 'a', encoding='utf-8')
+            self._opened_at = time.time()
+        self._file.write(''.join(lines))
+        self._file.flush()
+
+    def _replace_prompts_with_hashes(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """把提示词替换为内容哈希，提示词正文在提示词存储中只写一次"""
+        request = entry.get('request')
+        if not request:
+            return entry
+        request = dict(request)
+        new_prompts = []
+        if self._known_prompts is None:
+            self._known_prompts = self._load_known_prompts()
+        for field in ('system_prompt', 'user_prompt'):
+            text = request.pop(field, None)
+            if text is None:
+                continue
+            digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            request[f'{field}_sha256'] = digest
+            if digest not in self._known_prompts:
+                self._known_prompts.add(digest)
+                new_prompts.append(json.dumps({'sha256': digest, 'text': text}, ensure_ascii=False) + '\n')
+        if new_prompts:
+            with open(self.prompts_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(new_prompts))
+        return dict(entry, request=request)
+
+    def _load_known_prompts(self) -> set:
+        known = set()
+        if not os.path.exists(self.prompts_file):
+            return known
+        with open(self.prompts_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    known.add(json.loads(line)['sha256'])
+                except (ValueError, KeyError):
+                    continue
+        return known
+
+    def _should_rotate(self) -> bool:
+        if self._file is None:
+            if not self.rotate_max_bytes or not os.path.exists(self.log_file):
+                return False
+            return os.path.getsize(self.log_file) >= self.rotate_max_bytes
+        if self.rotate_max_bytes and self._file.tell() >= self.rotate_max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _rotate(self):
+        """关闭当前日志文件，重命名并按配置压缩"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not os.path.exists(self.log_file) or os.path.getsize(self.log_file) == 0:
+            return
+
+        # 同一秒内可能轮转多次（按大小轮转），加序号避免覆盖之前的归档（含已压缩的）
+        base = f"{self.log_file}.{time.strftime('%Y%m%d_%H%M%S')}"
+        rotated, counter = base, 1
+        while any(os.path.exists(rotated + suffix) for suffix in ('', '.gz', '.zst')):
+            rotated = f"{base}_{counter}"
+            counter += 1
+        os.replace(self.log_file, rotated)
+        try:
+            _compress_file(rotated, self.compression)
+        except Exception as e:
+            print(f"压缩日志失败: {e}")
+
+
+def _compress_file(path: str, compression: str):
+    if compression == 'gzip':
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            print("未安装zstandard，改用gzip压缩日志")
+            return _compress_file(path, 'gzip')
+        with open(path, 'rb') as src, open(path + '.zst', 'wb') as dst:
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+    else:
+        return
+    os.remove(path)
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+def get_api_logger(log_file: str = None) -> ApiCallLogger:
+    """获取进程内共享的日志写入器，同一个日志文件只有一个写入线程"""
+    log_file = log_file or config.deepseek.log_file
+    with _loggers_lock:
+        logger = _loggers.get(log_file)
+        if logger is None or logger._closed:
+            logger = ApiCallLogger(log_file)
+            _loggers[log_file] = logger
+        return logger
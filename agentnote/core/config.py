@@ -1,6 +1,6 @@
 import os
-from dataclasses import dataclass
-from typing import Dict, Any
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Any, List
 
 @dataclass
 class NotebookConfig:
@@ -12,12 +12,23 @@ class NotebookConfig:
     sleep_interval: int = 1
     export_json: bool = True
     json_output_file: str = "agent_notebook_cells.json"
+    export_file: str = "agent_notebook_cells.jsonl"  # 每个步骤结束后增量追加新完成的cell
+    export_format: str = "jsonl"  # jsonl / msgpack（msgpack+zstd压缩，需要安装msgpack和zstandard）
 
     context_max_cells: int = 5
     include_code_in_context: bool = True
     include_markdown_in_context: bool = True
     include_outputs_in_context: bool = True
+    context_max_tokens: int = 6000  # 上下文的token预算（估算值）
+    context_max_output_chars: int = 2000  # 单个输出超过该长度时只保留首尾
+    context_traceback_frames: int = 3  # 错误追踪保留的最后几帧
+    context_summarize_old: bool = True  # 较早的cell以一行摘要的形式保留
+    print_context: bool = False  # 是否打印构建出的上下文
     add_timestamp: bool = True
+    write_behind: bool = True  # 合并写入，只在检查点（执行前/步骤结束/任务结束）落盘
+    durability: str = "fsync"  # none: 不同步; flush: 刷新到操作系统; fsync: 同步文件和目录到磁盘
+    offload_outputs: bool = False  # 把图片等大输出保存到 <notebook名>_outputs/ 目录，notebook中只保留引用
+    offload_threshold_bytes: int = 32768  # 超过该大小的输出才移出
 
 @dataclass
 class DeepSeekConfig:
@@ -26,6 +37,33 @@ class DeepSeekConfig:
     model: str = "deepseek-chat"
     temperature: float = 0.7
     max_tokens: int = 1000000
+    stream: bool = False  # 流式输出，在命令行实时显示生成进度
+    cache_enabled: bool = False  # 本地缓存相同请求的响应
+    cache_path: str = ".agentnote_cache/llm_responses.sqlite"
+    cache_max_mb: int = 256  # 超出后按LRU淘汰
+    cache_ttl: int = 604800  # 缓存有效期(秒)，0表示不过期
+    cache_ignore_timestamps: bool = True  # 计算缓存键时忽略提示词中的时间戳
+    log_file: str = "deepseek_api_log.jsonl"
+    log_async: bool = True  # 由后台线程批量写入日志
+    log_batch_size: int = 64
+    log_flush_interval: float = 1.0  # 后台线程最长等待时间(秒)
+    log_rotate_mb: int = 100  # 日志超过该大小时轮转，0表示不按大小轮转
+    log_rotate_interval: int = 0  # 按时间轮转的间隔(秒)，0表示不按时间轮转
+    log_compression: str = "gzip"  # 轮转后的压缩方式: gzip / zstd / none
+    log_hash_prompts: bool = False  # 日志中只记录提示词哈希，正文在提示词存储中只保存一次
+    retry_max_delay: float = 60.0  # 指数退避的最长等待(秒)，起始值为 agent.retry_delay
+    rate_limit_rpm: int = 0  # 进程内所有客户端共享的每分钟请求数上限，0表示不限制
+    rate_limit_tpm: int = 0  # 每分钟token数上限（按提示词预估，响应后按实际用量修正），0表示不限制
+    circuit_failure_threshold: int = 5  # 连续超时/服务端错误达到该次数后熔断
+    circuit_reset_timeout: float = 30.0  # 熔断后多久放行一个探测请求(秒)
+    http_max_connections: int = 100  # 进程内共享连接池的最大连接数
+    http_max_keepalive: int = 20  # 最多保留的空闲keep-alive连接数
+    http_keepalive_expiry: float = 60.0  # 空闲连接的保留时间(秒)
+    http2: bool = False  # 使用HTTP/2多路复用，需要安装h2
+    connect_timeout: float = 10.0  # 建立连接超时(秒)
+    read_timeout: float = 300.0  # 读取超时(秒)，流式输出时为两次数据之间的最长间隔
+    write_timeout: float = 30.0
+    pool_timeout: float = 30.0  # 等待空闲连接的超时(秒)
 
 @dataclass
 class AgentConfig:
@@ -33,12 +71,78 @@ class AgentConfig:
     retry_delay: int = 2
     enable_auto_fix: bool = True
     enable_execution: bool = True
+    parallel_steps: bool = False  # 按规划中声明的依赖并行生成互不依赖步骤的代码
+    max_parallel_generations: int = 4  # 同时进行的代码生成请求数
+    speculative_prefetch: bool = False  # 当前步骤执行时预先生成下一步骤的代码
+    preflight_checks: bool = True  # 执行前静态检查缺失的模块、未定义的名称和不存在的输入文件，有问题直接重新生成
+    preflight_index_file: str = ".agentnote_cache/module_index.json"  # 已安装模块索引的缓存
+    structured_planning: bool = True  # 要求规划以JSON输出并校验（推理模型不使用JSON模式），无效时回退到Markdown规划
+    plan_cache: bool = False  # 保存成功任务的规划和代码，相同或相似的任务直接复用，不再规划
+    plan_cache_path: str = ".agentnote_cache/plans.sqlite"
+    plan_cache_similarity: float = 0.85  # 相似任务复用规划的TF-IDF相似度阈值，0表示只复用相同和只有文件名等不同的任务
+    plan_cache_reuse_code: bool = True  # 相同和只有文件名等不同的任务同时复用每个步骤的代码
+    plan_cache_max_entries: int = 1000  # 超出后淘汰最久未使用的规划
+
+@dataclass
+class ExecutorConfig:
+    mode: str = "kernel"  # kernel: 常驻内核增量执行; replay: nbconvert全量重放
+    kernel_name: str = "python3"
+    timeout: int = 600
+    startup_timeout: int = 60
+    pool_size: int = 1  # 预热的空闲内核数量，0表示不使用内核池
+    idle_ttl: int = 600  # 空闲内核的最长保留时间(秒)
+    warm_imports: List[str] = field(default_factory=list)  # 预热时预先导入的模块
+    recycle: str = "reset"  # 任务结束后内核的处理方式: reset(清空命名空间后复用) / kill
+    max_kernel_uses: int = 20  # 单个内核最多被复用的次数
+    cache_enabled: bool = False  # 缓存cell执行结果，代码、前序cell和输入文件都未变化时不再执行（仅kernel模式）
+    cache_dir: str = ".agentnote_cache/executions"
+    cache_max_mb: int = 1024  # 超出后按LRU淘汰
+    cache_snapshots: bool = True  # 同时保存命名空间快照，命中后无需重放前序cell即可继续执行；执行缓存必须开启
+    cache_snapshot_max_mb: int = 256  # 超过该大小的快照不保存
+    checkpoints: bool = False  # 每个cell成功后保存命名空间检查点，失败后重试前回滚，无需重放
+    checkpoint_max_count: int = 5  # 最多保留的检查点数量
+    checkpoint_max_mb: int = 512  # 检查点总大小上限，超出时淘汰最旧的
+    cpu_time_limit: float = 0  # 单个cell的CPU时间上限(秒)，超出时中断，0表示不限制
+    memory_limit_mb: int = 0  # 内核（含子进程）RSS上限，超出时中断，仍不回落则关闭内核，0表示不限制
+    address_space_limit_mb: int = 0  # 内核进程的RLIMIT_AS上限，超出时分配内存抛出MemoryError（仅POSIX），0表示不限制
+    max_output_bytes: int = 1048576  # 单个cell保留的输出上限，超出部分丢弃，0表示不限制
+    monitor_interval: float = 0.2  # 资源采样间隔(秒)
+
+@dataclass
+class BatchConfig:
+    workers: int = 4  # 同时运行的任务进程数
+    task_timeout: int = 1800  # 单个任务超时(秒)
+    output_dir: str = "batch_runs"  # notebook和日志的输出目录
+    results_file: str = "batch_results.jsonl"
+
+@dataclass
+class TracingConfig:
+    enabled: bool = False  # 记录各阶段耗时的span，关闭时几乎没有开销
+    output_file: str = "agentnote_trace.jsonl"
+    format: str = "jsonl"  # jsonl / chrome（可在chrome://tracing或Perfetto中打开）
+    print_summary: bool = True  # 任务结束时打印各阶段耗时统计
+
+@dataclass
+class MetricsConfig:
+    task_token_budget: int = 0  # 单个任务的令牌预算（含推理令牌），0表示不限制
+    task_time_budget: float = 0  # 单个任务的耗时预算(秒)，0表示不限制
+    budget_action: str = "abort"  # 超出预算时: abort(中止任务) / downgrade(改用downgrade_model，超出两倍预算时中止)
+    downgrade_model: str = ""  # 降级使用的模型，空表示不降级，超出预算时中止
+    prices: Dict[str, List[float]] = field(default_factory=dict)  # 模型 -> [输入, 输出] 每百万令牌的单价，用于估算费用
+    latency_buckets: List[float] = field(default_factory=lambda: [0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300])
+    prometheus_file: str = ""  # 每个任务结束后写出Prometheus文本格式的指标，空表示不写
+    prometheus_port: int = 0  # 在 http://127.0.0.1:端口/metrics 提供指标，0表示不启动
+    max_tasks: int = 20  # 内存中保留按任务明细的最近任务数，导出的计数器不受影响
 
 class Config:
     def __init__(self):
         self.notebook = NotebookConfig()
         self.deepseek = DeepSeekConfig()
         self.agent = AgentConfig()
+        self.executor = ExecutorConfig()
+        self.batch = BatchConfig()
+        self.tracing = TracingConfig()
+        self.metrics = MetricsConfig()
     
     def update_from_dict(self, config_dict: Dict[str, Any]):
         """从字典更新配置"""
@@ -56,6 +160,38 @@ class Config:
             for key, value in config_dict['agent'].items():
                 if hasattr(self.agent, key):
                     setattr(self.agent, key, value)
+        
+        if 'executor' in config_dict:
+            for key, value in config_dict['executor'].items():
+                if hasattr(self.executor, key):
+                    setattr(self.executor, key, value)
+        
+        if 'batch' in config_dict:
+            for key, value in config_dict['batch'].items():
+                if hasattr(self.batch, key):
+                    setattr(self.batch, key, value)
+        
+        if 'tracing' in config_dict:
+            for key, value in config_dict['tracing'].items():
+                if hasattr(self.tracing, key):
+                    setattr(self.tracing, key, value)
+        
+        if 'metrics' in config_dict:
+            for key, value in config_dict['metrics'].items():
+                if hasattr(self.metrics, key):
+                    setattr(self.metrics, key, value)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为字典，可传给update_from_dict（如传递给子进程）"""
+        return {
+            'notebook': asdict(self.notebook),
+            'deepseek': asdict(self.deepseek),
+            'agent': asdict(self.agent),
+            'executor': asdict(self.executor),
+            'batch': asdict(self.batch),
+            'tracing': asdict(self.tracing),
+            'metrics': asdict(self.metrics),
+        }
 
 # 全局配置实例
 config = Config()
\ No newline at end of file
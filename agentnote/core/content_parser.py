@@ -1,10 +1,214 @@
 import re
 import ast
-from typing import Tuple, Optional
+from dataclasses import dataclass
+from typing import Callable, List, Tuple, Optional
+
+# 开始围栏：3个以上反引号或波浪号，以及可选的语言标记；围栏前可以有文字（模型有时写成 "说明 ```python"）
+_FENCE_OPEN = re.compile(r'^([^\n]*?)(`{3,}|~{3,})[ \t]*([^`\n]*?)[ \t]*\r?$', re.MULTILINE)
+# 可能的结束围栏：以围栏结尾的行（模型有时把结束围栏直接接在最后一行代码后面）
+_FENCE_CLOSE = re.compile(r'^([^\n]*?)(`{3,}|~{3,})[ \t]*\r?$', re.MULTILINE)
+_BLANK_LINES = re.compile(r'\n\s*\n')
+
+# 视为Python代码的语言标记，无标记的代码块也按Python处理（内容中有明确标记的Python代码块时除外）
+PYTHON_LANGUAGES = {'', 'python', 'python3', 'py', 'py3', 'ipython', 'ipython3', 'jupyter'}
+
+
+@dataclass
+class Segment:
+    """解析出的一段内容：kind为 'markdown' 或 'code'，start/end是在完整内容中的位置"""
+    kind: str
+    text: str
+    start: int
+    end: int
+    language: Optional[str] = None  # 代码块的语言标记（小写），Markdown为None
+    source: str = ""                # 代码块含围栏的原文
+    closed: bool = True             # 代码块是否有结束围栏（输出被截断时为False）
+
+    @property
+    def is_python(self) -> bool:
+        return self.kind == 'code' and self.language in PYTHON_LANGUAGES
+
+    @property
+    def is_tagged_python(self) -> bool:
+        """明确标记为Python的代码块"""
+        return self.is_python and self.language != ''
+
+
+class FenceTokenizer:
+    """
+    单遍扫描的围栏代码块分词器，可以一次解析完整内容，也可以随流式输出逐块feed
+
+    只扫描已经完整的行；每完成一个Python代码块（含无标记的）就通过on_python_block回调通知，不必等整个回答结束，
+    回调方可以用Segment.is_tagged_python区分
+    """
+
+    def __init__(self, on_python_block: Callable[[Segment], None] = None):
+        self.on_python_block = on_python_block
+        self.segments: List[Segment] = []
+        self._buffer = ""        # 尚未扫描的内容，只包含最后一个不完整的行
+        self._offset = 0         # _buffer在完整内容中的起始位置
+        self._parts = []         # 当前片段已扫描过的内容
+        self._segment_start = 0  # 当前片段的起始位置
+        self._fence = None       # 当前打开的围栏 (字符, 长度, 语言, 围栏行)
+
+    @property
+    def first_python_block(self) -> Optional[Segment]:
+        """要执行的代码块：第一个明确标记为Python的代码块，没有时才取第一个无标记的代码块"""
+        return select_python_blocks(self.segments)[0] if any(s.is_python for s in self.segments) else None
+
+    def feed(self, chunk: str) -> List[Segment]:
+        """追加一段内容，返回因此新完成的片段"""
+        if not chunk:
+            return []
+        self._buffer += chunk
+        return self._consume(self._buffer.rfind('\n') + 1)
+
+    def close(self) -> List[Segment]:
+        """内容结束：返回剩余的片段，没有结束围栏的代码块（输出被截断）也作为代码块返回"""
+        new = self._consume(len(self._buffer))
+        text = ''.join(self._parts)
+        if self._fence is not None:
+            _, _, language, opening = self._fence
+            new.append(self._emit(Segment('code', text, self._segment_start, self._offset,
+                                          language, opening + text, closed=False)))
+        elif text.strip():
+            new.append(self._emit(Segment('markdown', text, self._segment_start, self._offset)))
+        self._parts = []
+        self._fence = None
+        self._segment_start = self._offset
+        return new
+
+    def _consume(self, limit: int) -> List[Segment]:
+        """扫描缓冲区中limit之前的完整行，扫描过的内容移出缓冲区，每个字符只扫描一次"""
+        new = []
+        while True:
+            buffer = self._buffer
+            if self._fence is None:
+                match = self._find_open(buffer, limit)
+                if match is None:
+                    self._parts.append(buffer[:limit])
+                    self._advance(limit)
+                    return new
+                fence_start = match.start(2) if match.group(1).strip() else match.start()
+                self._parts.append(buffer[:fence_start])
+                text = ''.join(self._parts)
+                if text.strip():
+                    new.append(self._emit(Segment('markdown', text, self._segment_start,
+                                                  self._offset + fence_start)))
+                info = match.group(3).split(maxsplit=1)
+                line_end = min(match.end() + 1, limit)
+                self._fence = (match.group(2)[0], len(match.group(2)), info[0].lower() if info else '',
+                               buffer[fence_start:line_end])
+                self._parts = []
+                self._segment_start = self._offset + fence_start
+                self._advance(line_end)
+                limit -= line_end
+            else:
+                char, length, language, opening = self._fence
+                match = self._find_close(buffer, char, length, limit)
+                if match is None:
+                    self._parts.append(buffer[:limit])
+                    self._advance(limit)
+                    return new
+                # 围栏直接接在代码行尾时，该行围栏之前的部分仍属于代码
+                code_end = match.start(2) if match.group(1).strip() else match.start()
+                line_end = min(match.end() + 1, limit)
+                self._parts.append(buffer[:code_end])
+                code = ''.join(self._parts)
+                new.append(self._emit(Segment('code', code, self._segment_start, self._offset + line_end,
+                                              language, opening + code + buffer[code_end:line_end])))
+                self._fence = None
+                self._parts = []
+                self._segment_start = self._offset + line_end
+                self._advance(line_end)
+                limit -= line_end
+
+    def _advance(self, count: int):
+        self._buffer = self._buffer[count:]
+        self._offset += count
+
+    @staticmethod
+    def _find_open(buffer: str, limit: int):
+        for match in _FENCE_OPEN.finditer(buffer, 0, limit):
+            prefix = match.group(1)
+            # 单独成行的围栏（最多缩进3格）；跟在文字后面的反引号围栏只接受Python语言标记，避免把行内的```当作代码块
+            if not prefix.strip():
+                if len(prefix) <= 3:
+                    return match
+            elif match.group(2)[0] == '`':
+                info = match.group(3).split(maxsplit=1)
+                if info and info[0].lower() in PYTHON_LANGUAGES:
+                    return match
+        return None
+
+    @staticmethod
+    def _find_close(buffer: str, char: str, length: int, limit: int):
+        for match in _FENCE_CLOSE.finditer(buffer, 0, limit):
+            fence, prefix = match.group(2), match.group(1)
+            if fence[0] != char or len(fence) < length:
+                continue
+            # 单独成行的围栏（最多缩进3格），或反引号围栏直接跟在代码行尾
+            if (not prefix.strip() and len(prefix) <= 3) or (prefix.strip() and char == '`'):
+                return match
+        return None
+
+    def _emit(self, segment: Segment) -> Segment:
+        self.segments.append(segment)
+        if segment.is_python and self.on_python_block is not None:
+            self.on_python_block(segment)
+        return segment
+
+
+def select_python_blocks(segments: List[Segment]) -> List[Segment]:
+    """作为代码的Python代码块：有明确标记的Python代码块时，无标记的代码块（常是输出示例）不算代码"""
+    if any(segment.is_tagged_python for segment in segments):
+        return [segment for segment in segments if segment.is_tagged_python]
+    return [segment for segment in segments if segment.is_python]
+
 
 class ContentParser:
     """内容解析器 - 专门处理Python代码和Markdown的分离"""
     
+    @staticmethod
+    def parse_blocks(content: str) -> List[Segment]:
+        """把内容切分为按原顺序排列的Markdown和代码块片段，代码块带语言标记和位置"""
+        if not content:
+            return []
+        tokenizer = FenceTokenizer()
+        tokenizer.feed(content)
+        tokenizer.close()
+        return tokenizer.segments
+    
+    @staticmethod
+    def extract_cells(content: str) -> List[Tuple[str, str]]:
+        """
+        按原顺序拆分为notebook cell：[(cell_type, source), ...]，cell_type为 'markdown' 或 'code'
+
+        非Python的代码块（bash、json、输出示例等）保留在相邻的Markdown cell中；有明确标记的Python代码块时，
+        无标记的代码块也保留在Markdown中
+        """
+        return ContentParser._cells(ContentParser.parse_blocks(content))
+
+    @staticmethod
+    def _cells(segments: List[Segment], code_blocks: List[Segment] = None) -> List[Tuple[str, str]]:
+        """code_blocks中的代码块作为代码cell，其余片段按原文合并到Markdown cell"""
+        if code_blocks is None:
+            code_blocks = select_python_blocks(segments)
+        cells = []
+        for segment in segments:
+            if any(segment is block for block in code_blocks):
+                code = segment.text.strip()
+                if code:
+                    cells.append(('code', code))
+                continue
+            text = segment.source if segment.kind == 'code' else segment.text
+            if cells and cells[-1][0] == 'markdown':
+                cells[-1] = ('markdown', cells[-1][1] + '\n' + text)
+            else:
+                cells.append(('markdown', text))
+        return [(kind, _BLANK_LINES.sub('\n\n', source.strip()) if kind == 'markdown' else source)
+                for kind, source in cells if source.strip()]
+    
     @staticmethod
     def extract_python_code(content: str) -> Tuple[Optional[str], str]:
         """
@@ -15,30 +219,23 @@ class ContentParser:
             
         Returns:
             tuple: (python_code, markdown_content)
-                   python_code: 提取的Python代码，如果没有则为None
-                   markdown_content: 去除Python代码后的Markdown内容
+                   python_code: 第一个Python代码块（优先明确标记为Python的），如果没有则为None；
+                                其余Python代码块常是同一问题的不同写法，不一起执行
+                   markdown_content: 去除该代码块后的Markdown内容（其余代码块按原文保留）
         """
         if not content:
             return None, ""
         
-        # 定义Python代码块的正则表达式模式
-        code_block_pattern = r'```(?:python)?\s*(.*?)\s*```'
-        
-        # 查找所有代码块
-        code_blocks = re.findall(code_block_pattern, content, re.DOTALL)
-        
-        # 提取Python代码（只取第一个Python代码块）
+        segments = ContentParser.parse_blocks(content)
+        blocks = [block for block in select_python_blocks(segments) if block.text.strip()]
         python_code = None
-        if code_blocks:
-            python_code = code_blocks[0].strip()
-        
-        # 从原始内容中移除代码块，得到Markdown内容
-        markdown_content = re.sub(code_block_pattern, '', content, flags=re.DOTALL).strip()
-        
-        # 清理Markdown内容中的多余空行
-        markdown_content = re.sub(r'\n\s*\n', '\n\n', markdown_content)
-        
-        return python_code, markdown_content
+        markdown_parts = []
+        for kind, source in ContentParser._cells(segments, blocks[:1]):
+            if kind == 'code':
+                python_code = source
+            else:
+                markdown_parts.append(source)
+        return python_code, "\n\n".join(markdown_parts)
     
     @staticmethod
     def validate_python_code(code: str) -> Tuple[bool, str]:
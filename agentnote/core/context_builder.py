@@ -0,0 +1,154 @@
+import re
+import hashlib
+from typing import Dict, List, Tuple
+from .config import config
+
+_ANSI_PATTERN = re.compile(r'\x1b\[[0-9;?]*[ -/]*[@-~]')
+
+class NotebookContextBuilder:
+    """Notebook上下文构建器 - 按cell缓存渲染结果，在token预算内拼装提示词上下文"""
+
+    HEADER = "## 已生成的Notebook内容（包括执行成功和失败的代码）:\n\n"
+
+    def __init__(self):
+        # (cell key, 序号, 内容哈希) -> (完整片段, 摘要, 片段token数, 摘要token数)
+        self._fragments: Dict[Tuple, Tuple[str, str, int, int]] = {}
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """粗略估算token数：非ASCII字符（中文等）按1个token，ASCII按4个字符1个token"""
+        non_ascii = sum(1 for ch in text if ord(ch) > 127)
+        return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+    def build(self, nb) -> str:
+        """从最新的cell往前，在预算内拼装上下文；超出cell数量或预算的旧cell只保留一行摘要"""
+        if not nb.cells:
+            return "Notebook目前为空"
+
+        budget = config.notebook.context_max_tokens
+        max_full_cells = config.notebook.context_max_cells
+        summarize_old = config.notebook.context_summarize_old
+
+        used = self.estimate_tokens(self.HEADER)
+        full_parts = []
+        summary_parts = []
+        live_keys = set()
+
+        for index in range(len(nb.cells) - 1, -1, -1):
+            cell = nb.cells[index]
+            fragment, summary, fragment_tokens, summary_tokens = self._get_fragment(cell, index + 1, live_keys)
+            if not fragment:
+                continue
+
+            if len(full_parts) < max_full_cells and used + fragment_tokens <= budget:
+                full_parts.append(fragment)
+                used += fragment_tokens
+            elif summarize_old and used + summary_tokens <= budget:
+                summary_parts.append(summary)
+                used += summary_tokens
+            elif used >= budget:
+                break
+
+        # 清理已不在notebook中的cell的缓存
+        for key in list(self._fragments):
+            if key not in live_keys:
+                del self._fragments[key]
+
+        context = self.HEADER
+        if summary_parts:
+            context += "### 较早的Cell摘要:\n" + "".join(reversed(summary_parts)) + "\n"
+        context += "".join(reversed(full_parts))
+        return context
+
+    def _get_fragment(self, cell, number: int, live_keys: set):
+        key = (cell.get('id') or id(cell), number, self._content_hash(cell))
+        live_keys.add(key)
+        cached = self._fragments.get(key)
+        if cached is None:
+            fragment = self._render_cell(cell, number)
+            summary = self._summarize_cell(cell, number) if fragment else ""
+            cached = (fragment, summary, self.estimate_tokens(fragment), self.estimate_tokens(summary))
+            self._fragments[key] = cached
+        return cached
+
+    @staticmethod
+    def _content_hash(cell) -> str:
+        """只对会出现在上下文中的内容计算哈希，跳过图片等二进制输出；执行计数决定摘要中的执行状态"""
+        h = hashlib.sha1(cell.source.encode('utf-8'))
+        h.update(str(cell.get('execution_count')).encode())
+        for output in cell.get('outputs', []):
+            h.update(output.output_type.encode())
+            if output.output_type == 'stream':
+                h.update(output.text.encode('utf-8'))
+            elif output.output_type == 'execute_result':
+                h.update(str(output.data.get('text/plain', '')).encode('utf-8'))
+            elif output.output_type == 'error':
+                h.update(f"{output.ename}{output.evalue}{len(output.get('traceback', []))}".encode('utf-8'))
+        return h.hexdigest()
+
+    def _render_cell(self, cell, number: int) -> str:
+        if cell.cell_type == 'markdown' and config.notebook.include_markdown_in_context:
+            return f"### Markdown Cell {number}:\n{cell.source}\n\n"
+        if cell.cell_type != 'code' or not config.notebook.include_code_in_context:
+            return ""
+
+        parts = [f"### Code Cell {number}:\n```python\n{cell.source}\n```\n"]
+        outputs = cell.get('outputs', [])
+        if config.notebook.include_outputs_in_context and outputs:
+            parts.append("#### 执行结果:\n")
+            for output in outputs:
+                if output.output_type == 'stream':
+                    parts.append(f"输出: {self._truncate(output.text)}\n")
+                elif output.output_type == 'execute_result' and 'text/plain' in output.data:
+                    parts.append(f"结果: {self._truncate(str(output.data['text/plain']))}\n")
+                elif output.output_type == 'error':
+                    # 特别包含错误信息
+                    parts.append(f"❌ 执行错误: {output.ename}: {_strip_ansi(str(output.evalue))}\n")
+                    traceback = self._format_traceback(output.get('traceback', []))
+                    if traceback:
+                        parts.append(f"错误追踪:\n{traceback}\n")
+            parts.append("\n")
+        return "".join(parts)
+
+    @staticmethod
+    def _summarize_cell(cell, number: int) -> str:
+        first_line = next((line.strip() for line in cell.source.splitlines() if line.strip()), "")
+        if len(first_line) > 80:
+            first_line = first_line[:80] + "..."
+        if cell.cell_type == 'markdown':
+            return f"- Markdown Cell {number}: {first_line}\n"
+
+        status = "未执行"
+        for output in cell.get('outputs', []):
+            if output.output_type == 'error':
+                status = f"失败 ({output.ename})"
+                break
+        else:
+            if cell.get('execution_count') is not None:
+                status = "成功"
+        return f"- Code Cell {number} [{status}]: {first_line}\n"
+
+    @staticmethod
+    def _truncate(text: str) -> str:
+        """去掉ANSI控制符，过长时保留开头和结尾"""
+        text = _strip_ansi(text)
+        limit = config.notebook.context_max_output_chars
+        if len(text) <= limit:
+            return text
+        head = limit * 2 // 3
+        tail = limit - head
+        omitted = len(text) - head - tail
+        return f"{text[:head]}\n...(省略 {omitted} 个字符)...\n{text[-tail:]}"
+
+    @staticmethod
+    def _format_traceback(traceback: List[str]) -> str:
+        """只保留最后几帧，错误通常出现在最内层"""
+        frames = [_strip_ansi(frame).rstrip() for frame in traceback if frame.strip()]
+        keep = config.notebook.context_traceback_frames
+        if len(frames) > keep:
+            frames = [f"...(省略 {len(frames) - keep} 帧)"] + frames[-keep:]
+        return NotebookContextBuilder._truncate("\n".join(frames))
+
+
+def _strip_ansi(text: str) -> str:
+    return _ANSI_PATTERN.sub('', text)
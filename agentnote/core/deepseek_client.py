@@ -1,91 +1,443 @@
 import time
-from openai import OpenAI
+import asyncio
+import inspect
+import weakref
+from openai import OpenAI, AsyncOpenAI
 from .config import config
+from .llm_cache import LLMResponseCache
+from .api_logger import get_api_logger
+from .http_pool import get_http_pool
+from .context_builder import NotebookContextBuilder
+from .content_parser import FenceTokenizer
+from .request_scheduler import (get_request_scheduler, classify_error, EmptyResponseError,
+                                CircuitOpenError, FATAL)
+from .tracing import traced, current_span
+from .metrics import get_metrics
 from datetime import datetime
-import json
 
-class DeepSeekClient:
-    """DeepSeek API客户端"""
-    def __init__(self, api_key=None):
+class _DeepSeekClientBase:
+    """同步/异步客户端共用的请求构造和日志记录"""
+    def __init__(self, api_key=None, cache=None):
         self.api_key = api_key or config.deepseek.api_key
         if not self.api_key:
             raise ValueError("DeepSeek API密钥未提供")
+
+        # 可选的响应缓存，重放任务时相同请求不再访问网络
+        if cache is None and config.deepseek.cache_enabled:
+            cache = LLMResponseCache()
+        self.cache = cache
+
+        # 初始化日志 - 由后台线程写入，不阻塞请求
+        self.log_file = config.deepseek.log_file
+        self.logger = get_api_logger(self.log_file)
+
+        # 进程内共享的限流、退避和熔断
+        self.scheduler = get_request_scheduler(config.deepseek.base_url)
         
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=config.deepseek.base_url
-        )
-        
-        # 初始化日志
-        self.log_file = "deepseek_api_log.jsonl"
+        # 累计用量
+        self.usage_totals = {'requests': 0, 'failed_requests': 0, 'prompt_tokens': 0,
+                             'completion_tokens': 0, 'reasoning_tokens': 0, 'total_tokens': 0}
+        self.metrics = get_metrics()
 
-    def _log_api_call(self, request_data, response_data, error=None):
-        """记录API调用到日志文件"""
+    def _log_api_call(self, request_data, response_data, error=None, latency=None):
+        """记录API调用到日志文件和用量统计，latency为请求耗时(秒)"""
         log_entry = {
             "timestamp": datetime.now().isoformat(),
             "request": request_data,
             "response": response_data,
             "error": error
         }
+        self.logger.log(log_entry)
         
-        try:
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
-        except Exception as e:
-            print(f"日志记录失败: {e}")
+        self.usage_totals['requests'] += 1
+        if error is not None:
+            self.usage_totals['failed_requests'] += 1
+        usage = response_data.get('usage') if response_data else None
+        for key in ('prompt_tokens', 'completion_tokens', 'reasoning_tokens', 'total_tokens'):
+            if usage and usage.get(key):
+                self.usage_totals[key] += usage[key]
+        model = (response_data or {}).get('model') or request_data['model']
+        self.metrics.record_request(model, usage, latency, failed=error is not None)
+        if usage:
+            current_span().set(model=response_data.get('model'), prompt_tokens=usage['prompt_tokens'],
+                               completion_tokens=usage['completion_tokens'], tokens=usage['total_tokens'])
 
-    def generate_content(self, system_prompt, user_prompt, model=None, temperature=None):
-        """生成内容"""
-        model = model or config.deepseek.model
-        temperature = temperature or config.deepseek.temperature
-        
-        # 准备请求数据用于日志记录
+    @staticmethod
+    def _build_request(system_prompt, user_prompt, model, temperature, response_format=None):
+        """返回 (用于日志的请求数据, messages)"""
         request_data = {
             "model": model,
             "system_prompt": system_prompt,
             "user_prompt": user_prompt,
             "temperature": temperature,
         }
-        
+        if response_format is not None:
+            # 同时参与缓存键的计算
+            request_data["response_format"] = response_format
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        return request_data, messages
+
+    @staticmethod
+    def _request_options(request_data):
+        """请求中除messages以外的可选参数"""
+        if "response_format" in request_data:
+            return {"response_format": request_data["response_format"]}
+        return {}
+
+    def _cache_key(self, request_data):
+        if self.cache is None:
+            return None
+        return self.cache.make_key(**request_data)
+
+    def _cache_get(self, key, bypass_cache, model):
+        if key is None or bypass_cache:
+            return None
+        content = self.cache.get(key)
+        if content is not None:
+            current_span().set(cached=True)
+            self.metrics.record_cache_hit(model)
+        return content
+
+    def _cache_put(self, key, content, model):
+        if key is not None and content:
+            self.cache.put(key, content, model)
+
+    @staticmethod
+    def _estimate_tokens(request_data):
+        """预估请求的token数，用于TPM限流，收到响应后按实际用量修正"""
+        return NotebookContextBuilder.estimate_tokens(request_data["system_prompt"] + request_data["user_prompt"])
+
+    def _record_failure(self, request_data, error, latency=None):
+        """记录失败的API调用并通知调度器，返回 (错误类别, Retry-After)"""
+        self._log_api_call(request_data, None, error=str(error), latency=latency)
+        kind, retry_after = classify_error(error)
+        if not isinstance(error, CircuitOpenError):
+            self.scheduler.record_failure(kind, retry_after)
+        return kind, retry_after
+
+    def _retry_delay(self, error, kind, retry_after, attempt, max_attempts):
+        """返回重试前需要等待的秒数；不应重试时返回None"""
+        if kind == FATAL or attempt + 1 >= max_attempts:
+            print(f"DeepSeek API调用失败: {error}")
+            return None
+        delay = self.scheduler.backoff_delay(attempt, retry_after)
+        self.scheduler.note_retry()
+        print(f"DeepSeek API调用失败 ({kind}): {error}，{delay:.1f}秒后重试 ({attempt + 1}/{max_attempts - 1})...")
+        return delay
+
+    @staticmethod
+    def _usage_to_dict(usage):
+        if not usage:
+            return None
+        usage_dict = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens
+        }
+        # 推理模型的思考过程令牌，已包含在completion_tokens中
+        details = getattr(usage, 'completion_tokens_details', None)
+        reasoning_tokens = getattr(details, 'reasoning_tokens', None) if details else None
+        if reasoning_tokens:
+            usage_dict["reasoning_tokens"] = reasoning_tokens
+        return usage_dict
+
+
+class _StreamAccumulator:
+    """累积流式响应的分片，得到完整内容、模型名和用量"""
+    def __init__(self):
+        self.content_parts = []
+        self.reasoning_parts = []
+        self.model = None
+        self.usage = None
+
+    def feed(self, chunk):
+        """处理一个分片，返回其中的增量 [(kind, text), ...]，kind为 'reasoning' 或 'content'"""
+        deltas = []
+        self.model = chunk.model or self.model
+        if chunk.usage:
+            self.usage = chunk.usage
+        for choice in chunk.choices:
+            delta = choice.delta
+            reasoning = getattr(delta, 'reasoning_content', None)
+            if reasoning:
+                self.reasoning_parts.append(reasoning)
+                deltas.append(('reasoning', reasoning))
+            if delta.content:
+                self.content_parts.append(delta.content)
+                deltas.append(('content', delta.content))
+        return deltas
+
+    @property
+    def content(self):
+        return "".join(self.content_parts)
+
+
+class DeepSeekClient(_DeepSeekClientBase):
+    """DeepSeek API客户端"""
+    def __init__(self, api_key=None):
+        super().__init__(api_key)
+
+        # 重试由请求调度器统一处理，关闭SDK自带的重试；复用进程内共享的连接池
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=config.deepseek.base_url,
+            max_retries=0,
+            http_client=get_http_pool().get_client()
+        )
+
+    @traced('llm.generate')
+    def generate_content(self, system_prompt, user_prompt, model=None, temperature=None, on_token=None,
+                         bypass_cache=False, max_attempts=1, response_format=None, on_python_block=None):
+        """
+        生成内容
+
+        Args:
+            on_token: 可选回调 on_token(kind, text)；提供该回调或配置了 deepseek.stream 时使用流式输出
+            on_python_block: 可选回调 on_python_block(segment)，流式输出中每完成一个Python代码块就调用，
+                             提供时也使用流式输出；重试的尝试会从头重新报告
+            bypass_cache: 不读取缓存（如重试时不能复用之前失败的回答），新结果仍会写入缓存
+            max_attempts: 最多尝试次数，只有限流、超时、服务端错误和空响应会重试
+            response_format: 如 {"type": "json_object"}，要求模型输出JSON（推理模型不支持）
+        """
+        model = model or config.deepseek.model
+        temperature = temperature or config.deepseek.temperature
+        if on_token is None and config.deepseek.stream:
+            on_token = _print_token
+
+        # 准备请求数据用于日志记录
+        request_data, messages = self._build_request(system_prompt, user_prompt, model, temperature, response_format)
+
+        cache_key = self._cache_key(request_data)
+        cached = self._cache_get(cache_key, bypass_cache, model)
+        if cached is not None:
+            if on_token is not None:
+                on_token('content', cached)
+            if on_python_block is not None:
+                _report_python_blocks(cached, on_python_block)
+            return cached
+
+        estimated_tokens = self._estimate_tokens(request_data)
+        for attempt in range(max_attempts):
+            current_span().set(attempts=attempt + 1)
+            started = None
+            try:
+                self.scheduler.acquire(estimated_tokens)
+                started = time.perf_counter()
+                if on_token is not None or on_python_block is not None:
+                    blocks = FenceTokenizer(on_python_block) if on_python_block is not None else None
+                    response_content, response_data = self._generate_streaming(messages, model, temperature, on_token,
+                                                                               self._request_options(request_data),
+                                                                               blocks)
+                    if on_token is _print_token:
+                        print()
+                else:
+                    response = self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        stream=False,
+                        **self._request_options(request_data)
+                    )
+
+                    response_content = response.choices[0].message.content
+                    response_data = {
+                        "content": response_content,
+                        "model": response.model,
+                        "usage": self._usage_to_dict(response.usage)
+                    }
+                if not response_content:
+                    raise EmptyResponseError("API返回了空内容")
+
+            except Exception as e:
+                # 记录失败的API调用，按错误类型决定是否重试
+                latency = time.perf_counter() - started if started is not None else None
+                kind, retry_after = self._record_failure(request_data, e, latency)
+                delay = self._retry_delay(e, kind, retry_after, attempt, max_attempts)
+                if delay is None:
+                    return None
+                time.sleep(delay)
+                continue
+
+            # 记录成功的API调用
+            usage = response_data["usage"]
+            self.scheduler.record_success(estimated_tokens, usage["total_tokens"] if usage else None)
+            self._log_api_call(request_data, response_data, latency=time.perf_counter() - started)
+            self._cache_put(cache_key, response_content, response_data["model"])
+            return response_content
+        return None
+
+    def _generate_streaming(self, messages, model, temperature, on_token, options, blocks=None):
+        """流式生成，每收到一个增量就回调on_token，正文增量同时送入blocks分词器"""
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options
+        )
+        accumulator = _StreamAccumulator()
+        for chunk in stream:
+            for kind, text in accumulator.feed(chunk):
+                if on_token is not None:
+                    on_token(kind, text)
+                if blocks is not None and kind == 'content':
+                    blocks.feed(text)
+        if blocks is not None:
+            blocks.close()
+
+        response_data = {
+            "content": accumulator.content,
+            "model": accumulator.model,
+            "usage": self._usage_to_dict(accumulator.usage)
+        }
+        return accumulator.content, response_data
+
+    def generate_with_retry(self, system_prompt, user_prompt, max_retries=3, bypass_cache=False, model=None,
+                            response_format=None, on_python_block=None):
+        """带重试的内容生成 - 按错误类型指数退避，参数错误等不可恢复的错误不重试"""
+        return self.generate_content(system_prompt, user_prompt, model=model, bypass_cache=bypass_cache,
+                                     max_attempts=max_retries, response_format=response_format,
+                                     on_python_block=on_python_block)
+
+
+class AsyncDeepSeekClient(_DeepSeekClientBase):
+    """基于asyncio的DeepSeek API客户端 - 支持流式输出和并发请求"""
+    def __init__(self, api_key=None):
+        super().__init__(api_key)
+
+        # 连接绑定在事件循环上，与连接池一样每个事件循环一个客户端：事件循环 -> (客户端, 使用的HTTP客户端)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        """当前事件循环的客户端，首次在该事件循环中使用时才创建；连接池换了HTTP客户端时重新创建"""
+        loop = asyncio.get_running_loop()
+        http_client = get_http_pool().get_async_client()
+        client, used = self._async_clients.get(loop, (None, None))
+        if client is None or used is not http_client:
+            client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=config.deepseek.base_url,
+                max_retries=0,
+                http_client=http_client
+            )
+            self._async_clients[loop] = (client, http_client)
+        return client
+
+    async def stream_content(self, system_prompt, user_prompt, model=None, temperature=None, bypass_cache=False,
+                             response_format=None):
+        """
+        以异步迭代器的形式流式生成内容
+
+        Yields:
+            tuple: (kind, text)，kind为 'reasoning'（推理模型的思考过程）或 'content'；
+                   命中缓存时只产生一个包含完整内容的 'content'
+        """
+        model = model or config.deepseek.model
+        temperature = temperature or config.deepseek.temperature
+        request_data, messages = self._build_request(system_prompt, user_prompt, model, temperature, response_format)
+
+        cache_key = self._cache_key(request_data)
+        cached = self._cache_get(cache_key, bypass_cache, model)
+        if cached is not None:
+            yield ('content', cached)
+            return
+
+        estimated_tokens = self._estimate_tokens(request_data)
+        accumulator = _StreamAccumulator()
+        started = None
         try:
-            response = self.client.chat.completions.create(
+            await self.scheduler.acquire_async(estimated_tokens)
+            started = time.perf_counter()
+            stream = await self.client.chat.completions.create(
                 model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
+                messages=messages,
                 temperature=temperature,
-                stream=False
+                stream=True,
+                stream_options={"include_usage": True},
+                **self._request_options(request_data)
             )
-            
-            response_content = response.choices[0].message.content
-            
-            # 记录成功的API调用
-            response_data = {
-                "content": response_content,
-                "model": response.model,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                } if response.usage else None
-            }
-            
-            self._log_api_call(request_data, response_data)
-            return response_content
-            
+            async for chunk in stream:
+                for delta in accumulator.feed(chunk):
+                    yield delta
+            if not accumulator.content:
+                raise EmptyResponseError("API返回了空内容")
         except Exception as e:
-            # 记录失败的API调用
-            self._log_api_call(request_data, None, error=str(e))
-            print(f"DeepSeek API调用失败: {e}")
-            return None
+            self._record_failure(request_data, e, time.perf_counter() - started if started is not None else None)
+            raise
+
+        usage = self._usage_to_dict(accumulator.usage)
+        self.scheduler.record_success(estimated_tokens, usage["total_tokens"] if usage else None)
+        self._log_api_call(request_data, {
+            "content": accumulator.content,
+            "model": accumulator.model,
+            "usage": usage
+        }, latency=time.perf_counter() - started)
+        self._cache_put(cache_key, accumulator.content, accumulator.model)
+
+    @traced('llm.generate')
+    async def generate_content(self, system_prompt, user_prompt, model=None, temperature=None, on_token=None,
+                               bypass_cache=False, max_attempts=1, response_format=None, on_python_block=None):
+        """
+        生成内容，失败时返回None
+
+        Args:
+            on_token: 可选回调 on_token(kind, text)，可以是普通函数或协程函数
+            on_python_block: 可选回调 on_python_block(segment)，每完成一个Python代码块就调用（普通函数）；
+                             重试的尝试会从头重新报告
+            max_attempts: 最多尝试次数，只有限流、超时、服务端错误和空响应会重试
+            response_format: 如 {"type": "json_object"}，要求模型输出JSON（推理模型不支持）
+        """
+        for attempt in range(max_attempts):
+            current_span().set(attempts=attempt + 1)
+            parts = []
+            blocks = FenceTokenizer(on_python_block) if on_python_block is not None else None
+            try:
+                async for kind, text in self.stream_content(system_prompt, user_prompt, model, temperature,
+                                                            bypass_cache, response_format):
+                    if kind == 'content':
+                        parts.append(text)
+                        if blocks is not None:
+                            blocks.feed(text)
+                    if on_token is not None:
+                        result = on_token(kind, text)
+                        if inspect.isawaitable(result):
+                            await result
+                if blocks is not None:
+                    blocks.close()
+            except Exception as e:
+                kind, retry_after = classify_error(e)
+                delay = self._retry_delay(e, kind, retry_after, attempt, max_attempts)
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+                continue
+            return "".join(parts)
+        return None
+
+    async def generate_with_retry(self, system_prompt, user_prompt, max_retries=3, on_token=None, bypass_cache=False,
+                                  model=None, response_format=None, on_python_block=None):
+        """带重试的内容生成 - 按错误类型指数退避，参数错误等不可恢复的错误不重试"""
+        return await self.generate_content(system_prompt, user_prompt, model=model, on_token=on_token,
+                                           bypass_cache=bypass_cache, max_attempts=max_retries,
+                                           response_format=response_format, on_python_block=on_python_block)
+
+    async def aclose(self):
+        """释放客户端；底层连接属于共享连接池，不在这里关闭"""
+        self._async_clients = weakref.WeakKeyDictionary()
+
+
+def _report_python_blocks(content, on_python_block):
+    """缓存命中时一次性报告完整内容中的Python代码块"""
+    blocks = FenceTokenizer(on_python_block)
+    blocks.feed(content)
+    blocks.close()
+
 
-    def generate_with_retry(self, system_prompt, user_prompt, max_retries=3):
-        """带重试的内容生成"""
-        for attempt in range(max_retries):
-            content = self.generate_content(system_prompt, user_prompt)
-            if content:
-                return content
-            print(f"生成失败，第 {attempt + 1} 次重试...")
-            time.sleep(2)
-        return None
\ No newline at end of file
+def _print_token(kind, text):
+    """命令行实时显示生成进度"""
+    print(text, end='', flush=True)
@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import nbformat as nbf
+from typing import Dict, Any, List, Optional
+from .config import config
+
+# 代码中的字符串字面量，存在的文件路径作为输入文件计入指纹
+_STRING_LITERAL = re.compile(r'''(['"])([^'"\n]{1,260})\1''')
+_MAX_INPUT_FILES = 50
+
+class ExecutionCache:
+    """Cell执行结果缓存 - 以cell代码和上游指纹为键，保存输出和可选的命名空间快照，按大小做LRU淘汰"""
+
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or config.executor.cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else config.executor.cache_max_mb * 1024 * 1024
+        self.snapshot_dir = os.path.join(self.directory, "snapshots")
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.directory, "executions.sqlite"),
+                                     check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS executions ("
+            " key TEXT PRIMARY KEY,"
+            " outputs TEXT NOT NULL,"
+            " execution_count INTEGER,"
+            " size INTEGER NOT NULL,"
+            " snapshot TEXT,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_executions_last_access ON executions(last_access)")
+
+    @staticmethod
+    def make_key(upstream_key: str, source: str, cwd: str) -> str:
+        """
+        计算cell的缓存键：上游cell的键 + 本cell代码 + 代码中引用的输入文件的修改时间和大小
+
+        上游键按顺序链接了前面所有cell的代码和输入文件，任何前序cell变化都会使后续cell的键变化
+        """
+        h = hashlib.sha256((upstream_key or '').encode('utf-8'))
+        h.update(source.encode('utf-8'))
+        for path in _input_files(source, cwd):
+            stat = os.stat(path)
+            h.update(f"\0{path}\0{stat.st_mtime_ns}\0{stat.st_size}".encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查找缓存，返回 outputs 和 execution_count；未命中返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT outputs, execution_count FROM executions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE executions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return {
+            'outputs': [nbf.from_dict(output) for output in json.loads(row[0])],
+            'execution_count': row[1]
+        }
+
+    def put(self, key: str, outputs: List, execution_count: Optional[int]):
+        """保存一次成功执行的输出"""
+        data = json.dumps(outputs, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._remove_snapshot(key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO executions (key, outputs, execution_count, size, snapshot, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                (key, data, execution_count, len(data.encode('utf-8')), now, now)
+            )
+            self._evict()
+
+    def snapshot_path(self, key: str) -> str:
+        return os.path.join(self.snapshot_dir, f"{key}.pkl")
+
+    def attach_snapshot(self, key: str, info: Dict[str, Any]):
+        """记录已写入snapshot_path(key)的命名空间快照，计入缓存大小"""
+        path = self.snapshot_path(key)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE executions SET snapshot = ?, size = size + ? WHERE key = ?",
+                (json.dumps(info), size, key)
+            )
+            self._evict()
+
+    def get_snapshot(self, key: str) -> Optional[Dict[str, Any]]:
+        """返回可完整恢复的快照元数据（含path），没有快照或有变量无法序列化时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT snapshot FROM executions WHERE key = ?", (key,)).fetchone()
+        if row is None or not row[0]:
+            return None
+        info = json.loads(row[0])
+        path = self.snapshot_path(key)
+        if info.get('skipped') or not os.path.exists(path):
+            return None
+        return dict(info, path=path)
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM executions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        stale_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM executions ORDER BY last_access ASC"):
+            stale_keys.append(key)
+            freed += size
+            if freed >= excess:
+                break
+        self._delete(stale_keys)
+
+    def _delete(self, keys: List[str]):
+        for key in keys:
+            self._remove_snapshot(key)
+        self._conn.executemany("DELETE FROM executions WHERE key = ?", [(key,) for key in keys])
+
+    def _remove_snapshot(self, key: str):
+        path = self.snapshot_path(key)
+        for name in (path, path + '.json'):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def invalidate(self, keys: List[str]):
+        """删除指定的缓存条目"""
+        with self._lock:
+            self._delete(list(keys))
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute("SELECT key FROM executions")]
+            self._delete(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中统计和占用空间"""
+        with self._lock:
+            entries, total, snapshots = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(snapshot) FROM executions"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'snapshots': snapshots,
+            'bytes': total
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _input_files(source: str, cwd: str) -> List[str]:
+    """代码中以字符串字面量出现、且实际存在的文件"""
+    files = []
+    seen = set()
+    for match in _STRING_LITERAL.finditer(source):
+        literal = match.group(2)
+        path = os.path.normpath(os.path.join(cwd, os.path.expanduser(literal)))
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            if os.path.isfile(path):
+                files.append(path)
+        except (OSError, ValueError):
+            continue
+        if len(files) >= _MAX_INPUT_FILES:
+            break
+    return files
@@ -2,27 +2,389 @@ import time
 import nbformat as nbf
 import subprocess
 import tempfile
+import shutil
 import os
 import json
 import sys
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from .config import config
 from .notebook_manager import NotebookManager
 from .notebook_exporter import NotebookExporter
+from .kernel_session import KernelSession
+from .exec_cache import ExecutionCache
+from .tracing import traced, span, current_span
 
 class NotebookExecutor:
-    """Notebook执行器 - 直接执行整个notebook保持上下文一致性"""
+    """Notebook执行器 - 默认使用常驻内核增量执行，nbconvert全量重放作为后备"""
     
-    def __init__(self, notebook_manager: NotebookManager):
+    def __init__(self, notebook_manager: NotebookManager, workdir: str = None):
         self.manager = notebook_manager
-        self.timeout = 600  # 10分钟超时
+        self.workdir = workdir  # 内核工作目录，默认为notebook所在目录
+        self.timeout = config.executor.timeout
+        self.mode = config.executor.mode
+        self.session = None  # 常驻内核会话
+        self._executed_cells = set()  # 已在当前内核中执行过的cell
+        # 执行结果缓存，只用于内核模式；命中的cell不在内核中执行，后续cell需要其状态时恢复命名空间快照
+        self.cache = None
+        if config.executor.cache_enabled and self.mode == 'kernel':
+            if not config.executor.cache_snapshots:
+                raise ValueError("executor.cache_enabled 需要同时开启 executor.cache_snapshots："
+                                 "没有命名空间快照时，命中缓存的cell只能在之后全部重放")
+            self.cache = ExecutionCache()
+        # 成功执行后的命名空间检查点；失败的cell可能改坏了内核状态，下次执行前回滚到最近的检查点
+        self._checkpoints = []  # [{'path', 'serializer', 'executed', 'bytes'}]，按时间排序
+        self._checkpoint_dir = None
+        self._needs_rollback = False
     
-    def execute_single_cell(self, code: str, cell_index: int, timeout: int = None) -> Dict[str, Any]:
-        """执行单个cell - 通过执行整个notebook来保持上下文"""
+    @traced('executor.execute')
+    def execute_single_cell(self, code: str, cell_index: int, timeout: int = None, nb=None) -> Dict[str, Any]:
+        """执行单个cell"""
+        if self.mode == 'replay':
+            result = self.execute_by_replay(code, cell_index, timeout)
+        else:
+            result = self._execute_in_kernel(code, cell_index, timeout, nb)
+        current_span().set(mode=self.mode, cell=cell_index, success=result.get('success'),
+                           cached=result.get('cached', False))
+        return result
+    
+    def _execute_in_kernel(self, code: str, cell_index: int, timeout: int = None, nb=None) -> Dict[str, Any]:
+        """在常驻内核中只执行新增的cell，并把输出写回内存中的notebook"""
+        timeout = timeout or self.timeout
+        nb = nb if nb is not None else self.manager.load_notebook()
+        
+        if cell_index >= len(nb.cells) or nb.cells[cell_index].cell_type != 'code':
+            return {
+                'success': False,
+                'error': f'cell {cell_index} 不是代码cell',
+                'output': '',
+                'stdout': '',
+                'stderr': '',
+                'execution_count': None
+            }
+        cell = nb.cells[cell_index]
+        
+        cache_keys = self._cache_keys(nb, cell_index) if self.cache is not None else {}
+        cache_key = cache_keys.get(cell_index)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            # 没有快照的条目不使用，否则之后的cell需要它的状态时只能重放
+            if cached is not None and self.cache.get_snapshot(cache_key) is not None:
+                return self._restore_cached(nb, cell, cached)
+        
+        try:
+            session = self._ensure_session()
+            if self._needs_rollback:
+                self._rollback()
+            self._sync_kernel_state(nb, cell_index, cache_keys)
+            with span('kernel.execute'):
+                result = session.execute(
+                    code, timeout,
+                    cpu_limit=config.executor.cpu_time_limit,
+                    memory_limit=config.executor.memory_limit_mb * 1024 * 1024,
+                    max_output_bytes=config.executor.max_output_bytes
+                )
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f"内核执行失败: {str(e)}",
+                'output': '',
+                'stdout': '',
+                'stderr': str(e),
+                'execution_count': None
+            }
+        
+        outputs = result['outputs']
+        if result['limit_exceeded']:
+            # 放在中断产生的KeyboardInterrupt之前，作为这个cell的错误原因
+            limit_error = self._make_limit_error(result['limit_exceeded'])
+            first_error = next((i for i, o in enumerate(outputs) if o.output_type == 'error'), len(outputs))
+            outputs.insert(first_error, limit_error)
+        if result['status'] == 'timeout':
+            outputs.append(self._make_error_output('TimeoutError', f'执行超时 ({timeout}秒)'))
+        elif result['status'] == 'dead':
+            outputs.append(self._make_error_output('DeadKernelError', '内核意外退出，下次执行将重启内核并重放之前的cell'))
+            self._executed_cells.clear()
+        
+        # 把输出写回内存中的notebook
+        cell.outputs = outputs
+        cell.execution_count = result['execution_count']
+        cell.metadata['resources'] = self._format_metrics(result['metrics'])
+        self._executed_cells.add(self._cell_key(cell))
+        self.manager.mark_dirty(nb, [cell])
+        
+        error_details = self._find_error(cell)
+        if error_details is None:
+            if cache_key is not None:
+                self._store_in_cache(cache_key, cell)
+            if config.executor.checkpoints:
+                self._checkpoint()
+        elif config.executor.checkpoints:
+            self._needs_rollback = True
+        return {
+            'success': error_details is None,
+            'error': error_details,
+            'output': self._extract_cell_output(cell),
+            'stdout': result['stdout'],
+            'stderr': result['stderr'],
+            'execution_count': result['execution_count'],
+            'metrics': cell.metadata['resources']
+        }
+    
+    @staticmethod
+    def _format_metrics(metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """资源用量，写入cell元数据：wall_time/cpu_time(秒)、peak_rss/output_bytes(字节)"""
+        return {
+            'wall_time': round(metrics['wall_time'], 3),
+            'cpu_time': round(metrics['cpu_time'], 3) if metrics['cpu_time'] is not None else None,
+            'peak_rss': metrics['peak_rss'],
+            'output_bytes': metrics['output_bytes'],
+            'output_truncated': metrics['output_truncated']
+        }
+    
+    def _cache_keys(self, nb, upto: int) -> Dict[int, str]:
+        """计算前 upto+1 个cell中每个代码cell的缓存键，每个键都链接了前面所有代码cell"""
+        keys = {}
+        upstream = ''
+        cwd = self.kernel_cwd()
+        for index, cell in enumerate(nb.cells[:upto + 1]):
+            if cell.cell_type != 'code':
+                continue
+            upstream = ExecutionCache.make_key(upstream, cell.source, cwd)
+            keys[index] = upstream
+        return keys
+    
+    def _restore_cached(self, nb, cell, cached: Dict[str, Any]) -> Dict[str, Any]:
+        """把缓存的输出写回cell；cell不计入已执行，后续cell需要它的状态时再恢复"""
+        print("命中执行缓存，跳过执行")
+        cell.outputs = cached['outputs']
+        cell.execution_count = cached['execution_count']
+        self.manager.mark_dirty(nb, [cell])
+        output = self._extract_cell_output(cell)
+        stdout = "".join(o.text for o in cell.outputs if o.output_type == 'stream' and o.name == 'stdout')
+        stderr = "".join(o.text for o in cell.outputs if o.output_type == 'stream' and o.name == 'stderr')
+        return {
+            'success': True,
+            'error': None,
+            'output': output,
+            'stdout': stdout,
+            'stderr': stderr,
+            'execution_count': cell.execution_count,
+            'cached': True
+        }
+    
+    def _store_in_cache(self, key: str, cell):
+        """缓存输出和命名空间快照，快照无法完整保存时不缓存这个cell"""
+        self.cache.put(key, cell.outputs, cell.execution_count)
+        path = self.cache.snapshot_path(key)
+        info = self.session.save_namespace(path)
+        if info is None or info['skipped'] \
+                or os.path.getsize(path) > config.executor.cache_snapshot_max_mb * 1024 * 1024:
+            self.cache.invalidate([key])
+            return
+        self.cache.attach_snapshot(key, info)
+    
+    @traced('executor.checkpoint')
+    def _checkpoint(self):
+        """保存当前内核命名空间作为检查点，超出数量或大小限制时淘汰最旧的检查点"""
+        if self._checkpoint_dir is None:
+            self._checkpoint_dir = tempfile.mkdtemp(prefix="agentnote_checkpoints_")
+        path = os.path.join(self._checkpoint_dir, f"checkpoint_{self.session.execution_count}_{len(self._checkpoints)}.pkl")
+        info = self.session.save_namespace(path)
+        if info is None:
+            return
+        if info['skipped']:
+            # 不完整的检查点无法用于回滚，回滚时使用更早的检查点并重放其后的cell
+            print(f"变量 {', '.join(info['skipped'])} 无法序列化，本次不保存检查点")
+            self._remove_checkpoint_files(path)
+            return
+        self._checkpoints.append({
+            'path': path,
+            'serializer': info['serializer'],
+            'executed': set(self._executed_cells),
+            'bytes': os.path.getsize(path)
+        })
+        current_span().set(bytes=self._checkpoints[-1]['bytes'])
+        
+        max_count = config.executor.checkpoint_max_count
+        max_bytes = config.executor.checkpoint_max_mb * 1024 * 1024
+        while self._checkpoints and (len(self._checkpoints) > max_count
+                                     or sum(c['bytes'] for c in self._checkpoints) > max_bytes):
+            self._remove_checkpoint_files(self._checkpoints.pop(0)['path'])
+    
+    @traced('executor.rollback')
+    def _rollback(self):
+        """清空内核命名空间并恢复最近的检查点；没有检查点时由_sync_kernel_state重放前序cell"""
+        self._needs_rollback = False
+        start = time.time()
+        if self.session.execute("%reset -f", silent=True)['status'] != 'ok':
+            return
+        self._executed_cells.clear()
+        checkpoint = self._checkpoints[-1] if self._checkpoints else None
+        if checkpoint is None:
+            print("没有可用的检查点，已清空内核状态，将重放之前成功的cell")
+            return
+        if not self.session.load_namespace(checkpoint['path'], checkpoint['serializer']):
+            print("恢复检查点失败，将重放之前成功的cell")
+            return
+        self._executed_cells = set(checkpoint['executed'])
+        print(f"内核状态已回滚到最近的检查点 ({(time.time() - start) * 1000:.0f}毫秒)")
+    
+    def _clear_checkpoints(self):
+        self._checkpoints = []
+        self._needs_rollback = False
+        if self._checkpoint_dir is not None:
+            shutil.rmtree(self._checkpoint_dir, ignore_errors=True)
+            self._checkpoint_dir = None
+    
+    @staticmethod
+    def _remove_checkpoint_files(path: str):
+        for name in (path, path + '.json'):
+            if os.path.exists(name):
+                os.remove(name)
+    
+    def invalidate_cache(self, nb=None, cell_index: int = None):
+        """
+        使执行缓存失效
+
+        Args:
+            nb: 要失效的notebook，不提供时清空整个缓存
+            cell_index: 从该cell开始（含）失效其后所有代码cell，默认为整个notebook
+        """
+        if self.cache is None:
+            return
+        if nb is None:
+            self.cache.clear()
+            return
+        keys = self._cache_keys(nb, len(nb.cells) - 1)
+        start = cell_index or 0
+        self.cache.invalidate([key for index, key in keys.items() if index >= start])
+    
+    @traced('executor.ensure_session')
+    def _ensure_session(self) -> KernelSession:
+        """获取存活的内核会话，必要时启动新内核"""
+        if self.session is None or not self.session.is_alive():
+            if self.session is not None:
+                print("内核已退出，重新启动内核...")
+                self.session.shutdown()
+            self.session = KernelSession(cwd=self.kernel_cwd()).start()
+            self.session.set_memory_limit(config.executor.address_space_limit_mb * 1024 * 1024)
+            self._executed_cells.clear()
+        return self.session
+    
+    def attach_session(self, session: KernelSession):
+        """使用外部（如内核池）分配的内核"""
+        if self.session is not None and self.session is not session:
+            self.session.shutdown()
+        self.session = session
+        self._executed_cells.clear()
+        self._clear_checkpoints()
+        session.chdir(self.kernel_cwd())
+        session.set_memory_limit(config.executor.address_space_limit_mb * 1024 * 1024)
+    
+    def detach_session(self) -> Optional[KernelSession]:
+        """交还当前内核，不关闭它"""
+        session = self.session
+        self.session = None
+        self._executed_cells.clear()
+        self._clear_checkpoints()
+        return session
+    
+    def kernel_cwd(self) -> str:
+        """cell执行时的工作目录"""
+        return self.workdir or os.path.dirname(os.path.abspath(self.manager.notebook_path))
+    
+    @traced('executor.sync_state')
+    def _sync_kernel_state(self, nb, cell_index: int, cache_keys: Dict[int, str] = None):
+        """内核中缺少的前序cell（如新内核、已有notebook或命中缓存的cell）按顺序重放，执行出错的cell跳过"""
+        pending = [
+            index for index, cell in enumerate(nb.cells[:cell_index])
+            if cell.cell_type == 'code'
+            and self._cell_key(cell) not in self._executed_cells
+            and self._find_error(cell) is None
+        ]
+        if not pending:
+            return
+        
+        # 有命名空间快照时直接恢复到最近的快照，只重放其后的cell
+        restored = self._restore_snapshot(nb, pending, cache_keys or {})
+        if restored is not None:
+            pending = [index for index in pending if index > restored]
+        pending = [nb.cells[index] for index in pending]
+        if not pending:
+            return
+        
+        print(f"在内核中重放 {len(pending)} 个前序代码cell...")
+        for cell in pending:
+            self.session.execute(cell.source, self.timeout)
+            self._executed_cells.add(self._cell_key(cell))
+    
+    def _restore_snapshot(self, nb, pending: List[int], cache_keys: Dict[int, str]) -> Optional[int]:
+        """恢复最近一个有完整快照的前序cell的命名空间，返回该cell的序号；没有可用快照时返回None"""
+        if self.cache is None:
+            return None
+        for index in reversed(pending):
+            snapshot = self.cache.get_snapshot(cache_keys[index]) if index in cache_keys else None
+            if snapshot is None:
+                continue
+            if not self.session.load_namespace(snapshot['path'], snapshot['serializer']):
+                print("恢复命名空间快照失败，改为重放前序cell")
+                return None
+            print(f"从执行缓存恢复 Cell {index + 1} 之后的命名空间")
+            for cell in nb.cells[:index + 1]:
+                if cell.cell_type == 'code':
+                    self._executed_cells.add(self._cell_key(cell))
+            return index
+        return None
+    
+    def shutdown(self):
+        """关闭常驻内核"""
+        if self.session is not None:
+            self.session.shutdown()
+            self.session = None
+        self._executed_cells.clear()
+        self._clear_checkpoints()
+    
+    @staticmethod
+    def _cell_key(cell):
+        return cell.get('id') or id(cell)
+    
+    @staticmethod
+    def _make_error_output(ename: str, evalue: str):
+        return nbf.v4.new_output(
+            output_type="error",
+            ename=ename,
+            evalue=evalue,
+            traceback=[f"{ename}: {evalue}"]
+        )
+    
+    @staticmethod
+    def _make_limit_error(kind: str):
+        if kind == 'cpu':
+            message = f'CPU时间超过限制 ({config.executor.cpu_time_limit}秒)，已中断'
+        else:
+            message = f'内存超过限制 ({config.executor.memory_limit_mb}MB)，已中断'
+        return NotebookExecutor._make_error_output('ResourceLimitError', message)
+    
+    @staticmethod
+    def _find_error(cell) -> Optional[str]:
+        """返回cell中的错误信息，没有错误时返回None"""
+        for output in cell.get('outputs', []):
+            if output.output_type == 'error':
+                error_details = f"{output.ename}: {output.evalue}"
+                if hasattr(output, 'traceback') and output.traceback:
+                    error_details += f"\n追踪: {' | '.join(output.traceback)}"
+                return error_details
+        return None
+    
+    def execute_by_replay(self, code: str, cell_index: int, timeout: int = None) -> Dict[str, Any]:
+        """干净重放 - 通过nbconvert执行整个notebook来保持上下文"""
         timeout = timeout or self.timeout
         notebook_path = self.manager.notebook_path
         
         try:
+            # nbconvert读取的是磁盘文件，先写出未落盘的修改
+            self.manager.flush()
+            
             # 确保notebook存在
             if not os.path.exists(notebook_path):
                 return {
@@ -38,8 +400,8 @@ class NotebookExecutor:
             result = self._execute_entire_notebook(notebook_path, timeout)
             
             if result and result.get('success'):
-                # 重新加载notebook获取最新状态
-                nb = self.manager.load_notebook()
+                # 把nbconvert写到磁盘上的输出合并进内存中的notebook
+                nb = self.manager.merge_outputs_from_disk()
                 
                 # 找到对应的cell（应该是最后一个代码cell）
                 code_cells = [i for i, cell in enumerate(nb.cells) if cell.cell_type == 'code']
@@ -100,6 +462,7 @@ class NotebookExecutor:
                 'execution_count': None
             }
     
+    @traced('executor.nbconvert')
     def _execute_entire_notebook(self, notebook_path: str, timeout: int = None) -> Dict[str, Any]:
         """执行整个notebook文件"""
         timeout = timeout or self.timeout
@@ -107,6 +470,7 @@ class NotebookExecutor:
         try:
             # 使用jupyter命令行工具执行整个notebook，允许错误继续执行
             cmd = ['jupyter', 'nbconvert', '--execute', '--inplace', '--allow-errors', '--to', 'notebook', notebook_path]
+            cmd += _kernel_limit_arguments()
             
             result = subprocess.run(
                 cmd,
@@ -161,4 +525,19 @@ class NotebookExecutor:
                     error_msg += f"\n追踪: {' | '.join(output.traceback)}"
                 output_text.append(error_msg)
         
-        return "\n".join(output_text)
\ No newline at end of file
+        return "\n".join(output_text)
+
+
+def _kernel_limit_arguments() -> List[str]:
+    """
+    nbconvert的命令行参数：由它启动的内核在执行cell前设置地址空间上限
+
+    上限只作用于内核进程，nbconvert本身（以及它加载的模块）不受限制
+    """
+    if not config.executor.address_space_limit_mb or os.name != 'posix':
+        return []
+    limit = config.executor.address_space_limit_mb * 1024 * 1024
+    line = ("import resource as _agentnote_resource; _agentnote_resource.setrlimit(_agentnote_resource.RLIMIT_AS, "
+            f"({limit}, _agentnote_resource.getrlimit(_agentnote_resource.RLIMIT_AS)[1])); del _agentnote_resource")
+    kernel_arguments = ['--IPKernelApp.exec_lines=' + json.dumps([line])]
+    return ['--ExecutePreprocessor.extra_arguments=' + json.dumps(kernel_arguments)]
\ No newline at end of file
@@ -0,0 +1,149 @@
+import atexit
+import asyncio
+import importlib
+import threading
+import weakref
+from typing import Dict, Any
+from openai import DefaultHttpxClient, DefaultAsyncHttpxClient
+from .config import config
+
+
+def _http_library():
+    """openai所用的HTTP库（httpx，部分发行版中为httpx2），Timeout和Limits必须与客户端来自同一个库"""
+    base = next(cls for cls in DefaultHttpxClient.__mro__ if not cls.__module__.startswith('openai'))
+    return importlib.import_module(base.__module__.split('.')[0])
+
+
+_http = _http_library()
+
+class HttpConnectionPool:
+    """进程内共享的HTTP连接池 - 所有API客户端复用同一组keep-alive连接，避免重复握手"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        # 异步连接绑定在事件循环上，每个事件循环一个客户端
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.stats = {'requests': 0, 'responses': 0, 'errors': 0,
+                      'new_connections': 0, 'tls_handshakes': 0}
+        self.http2 = config.deepseek.http2 and _h2_available()
+
+    @staticmethod
+    def _timeout():
+        cfg = config.deepseek
+        return _http.Timeout(connect=cfg.connect_timeout, read=cfg.read_timeout,
+                             write=cfg.write_timeout, pool=cfg.pool_timeout)
+
+    @staticmethod
+    def _limits():
+        cfg = config.deepseek
+        return _http.Limits(max_connections=cfg.http_max_connections,
+                            max_keepalive_connections=cfg.http_max_keepalive,
+                            keepalive_expiry=cfg.http_keepalive_expiry)
+
+    def get_client(self) -> DefaultHttpxClient:
+        """获取共享的同步HTTP客户端"""
+        with self._lock:
+            if self._client is None or self._client.is_closed:
+                self._client = DefaultHttpxClient(
+                    timeout=self._timeout(),
+                    limits=self._limits(),
+                    http2=self.http2,
+                    event_hooks={'request': [self._on_request], 'response': [self._on_response]}
+                )
+            return self._client
+
+    def get_async_client(self) -> DefaultAsyncHttpxClient:
+        """获取当前事件循环共享的异步HTTP客户端"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None or client.is_closed:
+                client = DefaultAsyncHttpxClient(
+                    timeout=self._timeout(),
+                    limits=self._limits(),
+                    http2=self.http2,
+                    event_hooks={'request': [self._on_request_async], 'response': [self._on_response_async]}
+                )
+                self._async_clients[loop] = client
+            return client
+
+    def _on_request(self, request):
+        self._count('requests')
+        request.extensions['trace'] = self._trace
+
+    def _on_response(self, response):
+        self._count('responses' if response.status_code < 400 else 'errors')
+
+    async def _on_request_async(self, request):
+        self._count('requests')
+        request.extensions['trace'] = self._trace_async
+
+    async def _on_response_async(self, response):
+        self._count('responses' if response.status_code < 400 else 'errors')
+
+    def _trace(self, event: str, info: Dict[str, Any]):
+        # 只有新建连接时才会出现connect/TLS事件，复用keep-alive连接时没有
+        if event == 'connection.connect_tcp.complete':
+            self._count('new_connections')
+        elif event == 'connection.start_tls.complete':
+            self._count('tls_handshakes')
+
+    async def _trace_async(self, event: str, info: Dict[str, Any]):
+        self._trace(event, info)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池统计：请求数、新建连接数、当前打开和空闲的连接数"""
+        with self._lock:
+            stats = dict(self.stats)
+            clients = [self._client] if self._client is not None else []
+            clients += list(self._async_clients.values())
+        open_connections = idle_connections = 0
+        for client in clients:
+            # httpx未公开连接池状态，从底层httpcore连接池读取
+            pool = getattr(getattr(client, '_transport', None), '_pool', None)
+            for connection in getattr(pool, 'connections', []):
+                open_connections += 1
+                if connection.is_idle():
+                    idle_connections += 1
+        stats.update(
+            open_connections=open_connections,
+            idle_connections=idle_connections,
+            reused_requests=max(0, stats['requests'] - stats['new_connections']),
+            http2=self.http2,
+            max_connections=config.deepseek.http_max_connections
+        )
+        return stats
+
+    def close(self):
+        """关闭同步客户端；异步客户端随事件循环结束由垃圾回收释放"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("未安装h2，HTTP/2不可用，改用HTTP/1.1（pip install httpx[http2]）")
+        return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_http_pool() -> HttpConnectionPool:
+    """获取进程内共享的HTTP连接池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HttpConnectionPool()
+            atexit.register(_pool.close)
+        return _pool
@@ -1,21 +1,57 @@
 import sys  # 新增导入
 
 from .config import config
-from .deepseek_client import DeepSeekClient
-from .content_parser import ContentParser
+from .deepseek_client import DeepSeekClient, AsyncDeepSeekClient
+from .content_parser import ContentParser, FenceTokenizer
+from .llm_cache import LLMResponseCache
+from .api_logger import ApiCallLogger
+from .request_scheduler import RequestScheduler
+from .http_pool import HttpConnectionPool
 from .notebook_generator import NotebookGenerator
 from .notebook_exporter import NotebookExporter
 from .notebook_manager import NotebookManager
+from .output_store import OutputStore
+from .context_builder import NotebookContextBuilder
 from .executor import NotebookExecutor
+from .exec_cache import ExecutionCache
+from .preflight import PreflightAnalyzer
+from .tracing import Tracer, get_tracer
+from .metrics import MetricsRegistry, BudgetExceededError, get_metrics
+from .plan_dag import PlanDAG
+from .plan_schema import parse_plan_json, PlanValidationError
+from .plan_store import PlanStore
+from .kernel_session import KernelSession
+from .kernel_pool import KernelPool
 from .state_manager import StateManager
 
 __all__ = [
     'config',
     'DeepSeekClient', 
+    'AsyncDeepSeekClient',
     'ContentParser',
+    'FenceTokenizer',
+    'LLMResponseCache',
+    'ApiCallLogger',
+    'RequestScheduler',
+    'HttpConnectionPool',
     'NotebookGenerator',
     'NotebookExporter',
     'NotebookManager',
+    'OutputStore',
+    'NotebookContextBuilder',
     'NotebookExecutor',
+    'ExecutionCache',
+    'PreflightAnalyzer',
+    'Tracer',
+    'get_tracer',
+    'MetricsRegistry',
+    'BudgetExceededError',
+    'get_metrics',
+    'PlanDAG',
+    'parse_plan_json',
+    'PlanValidationError',
+    'PlanStore',
+    'KernelSession',
+    'KernelPool',
     'StateManager'
 ]
\ No newline at end of file
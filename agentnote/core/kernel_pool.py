@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, Any, List
+from .config import config
+from .kernel_session import KernelSession
+
+class KernelPool:
+    """内核池 - 维护若干预热好的空闲内核，任务开始时直接分配"""
+
+    def __init__(self, size: int = None, idle_ttl: int = None, warm_imports: List[str] = None,
+                 kernel_name: str = None, cwd: str = None):
+        self.size = config.executor.pool_size if size is None else size
+        self.idle_ttl = config.executor.idle_ttl if idle_ttl is None else idle_ttl
+        self.warm_imports = list(config.executor.warm_imports if warm_imports is None else warm_imports)
+        self.kernel_name = kernel_name or config.executor.kernel_name
+        self.cwd = cwd or os.getcwd()
+
+        self._idle = deque()
+        self._starting = 0
+        self._in_use = 0
+        self._last_acquire = time.time()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._maintain, name="kernel-pool", daemon=True)
+
+        self.stats = {'hits': 0, 'cold_starts': 0, 'recycled': 0, 'killed': 0, 'expired': 0}
+
+    def start(self):
+        """启动后台线程，开始预热内核"""
+        self._thread.start()
+        return self
+
+    def acquire(self) -> KernelSession:
+        """分配一个内核，池为空时同步冷启动"""
+        session = None
+        with self._cond:
+            self._last_acquire = time.time()
+            while self._idle:
+                candidate = self._idle.pop()
+                if candidate.is_alive():
+                    session = candidate
+                    break
+            self._in_use += 1
+            self._cond.notify_all()  # 唤醒后台线程补充空闲内核
+
+        if session is not None:
+            self.stats['hits'] += 1
+        else:
+            self.stats['cold_starts'] += 1
+            try:
+                session = self._spawn()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                raise
+
+        session.uses += 1
+        return session
+
+    def release(self, session: KernelSession):
+        """归还内核：按配置重置后放回池中，或直接关闭"""
+        if session is None:
+            return
+        with self._cond:
+            self._in_use -= 1
+
+        reusable = (
+            not self._closed
+            and config.executor.recycle == 'reset'
+            and session.uses < config.executor.max_kernel_uses
+            and session.is_alive()
+            and session.reset(self.warm_imports)
+        )
+
+        with self._cond:
+            if reusable and not self._closed and len(self._idle) < self.size:
+                session.last_used = time.time()
+                self._idle.append(session)
+                self.stats['recycled'] += 1
+                self._cond.notify_all()
+                return
+
+        self.stats['killed'] += 1
+        threading.Thread(target=session.shutdown, daemon=True).start()
+
+    def close(self):
+        """关闭内核池及所有空闲内核"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for session in idle:
+            session.shutdown()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取内核池统计信息"""
+        with self._cond:
+            return dict(self.stats, idle=len(self._idle), starting=self._starting, in_use=self._in_use)
+
+    def _spawn(self) -> KernelSession:
+        session = KernelSession(kernel_name=self.kernel_name, cwd=self.cwd).start()
+        session.warm_up(self.warm_imports)
+        return session
+
+    def _maintain(self):
+        """后台线程：回收超过idle_ttl的空闲内核，并补足预热内核数量"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                expired = self._reap_expired()
+                # 长时间没有任务时不再补充，避免空占资源；下一次acquire后恢复预热
+                active = time.time() - self._last_acquire < self.idle_ttl
+                need_spawn = active and len(self._idle) + self._starting < self.size
+                if need_spawn:
+                    self._starting += 1
+
+            for session in expired:
+                session.shutdown()
+
+            if need_spawn:
+                session = None
+                try:
+                    session = self._spawn()
+                except Exception as e:
+                    print(f"预热内核失败: {e}")
+                with self._cond:
+                    self._starting -= 1
+                    if session is not None and not self._closed and len(self._idle) < self.size:
+                        self._idle.append(session)
+                        continue
+                if session is not None:
+                    # 池已关闭，或预热期间已有归还的内核补满了空闲位置
+                    session.shutdown()
+                    continue
+                # 启动失败时等待一段时间后再试
+
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(timeout=min(max(self.idle_ttl / 4, 1), 30))
+
+    def _reap_expired(self) -> List[KernelSession]:
+        now = time.time()
+        expired = [s for s in self._idle if now - s.last_used > self.idle_ttl or not s.is_alive()]
+        for session in expired:
+            self._idle.remove(session)
+        self.stats['expired'] += len(expired)
+        return expired
@@ -0,0 +1,378 @@
+import os
+import json
+import time
+import queue
+import nbformat as nbf
+from typing import Dict, Any, List, Optional
+from jupyter_client.manager import KernelManager
+from .config import config
+from .resource_monitor import ResourceMonitor
+
+_POLL_INTERVAL = 0.5  # 等待输出时检查内核状态的间隔(秒)
+_MEMORY_KILL_GRACE = 3  # 内存超限中断后等待内存回落的时间(秒)
+
+class KernelSession:
+    """常驻Jupyter内核会话 - 保持内核存活，逐个执行新增cell"""
+
+    def __init__(self, kernel_name: str = None, cwd: str = None):
+        self.kernel_name = kernel_name or config.executor.kernel_name
+        self.cwd = cwd or os.getcwd()
+        self.km = None
+        self.kc = None
+        self.started_at = None
+        self.last_used = None
+        self.execution_count = 0
+        self.uses = 0  # 被分配给任务的次数（内核池使用）
+
+    def start(self, startup_timeout: int = None):
+        """启动内核并等待就绪"""
+        if self.is_alive():
+            return self
+
+        startup_timeout = startup_timeout or config.executor.startup_timeout
+        self.km = KernelManager(kernel_name=self.kernel_name)
+        self.km.start_kernel(cwd=self.cwd)
+        self.kc = self.km.client()
+        self.kc.start_channels()
+        try:
+            self.kc.wait_for_ready(timeout=startup_timeout)
+        except RuntimeError:
+            self.shutdown()
+            raise
+
+        self.started_at = time.time()
+        self.last_used = self.started_at
+        self.execution_count = 0
+        return self
+
+    def is_alive(self) -> bool:
+        """内核是否仍在运行"""
+        return self.km is not None and self.km.is_alive()
+
+    def execute(self, code: str, timeout: int = None, silent: bool = False, cpu_limit: float = 0,
+                memory_limit: int = 0, max_output_bytes: int = 0) -> Dict[str, Any]:
+        """
+        在内核中执行一段代码
+
+        Args:
+            cpu_limit: CPU时间上限(秒)，超出时中断执行
+            memory_limit: 内核进程（含子进程）RSS上限(字节)，超出时中断，仍未回落则杀掉内核
+            max_output_bytes: 保留的输出上限，超出部分在接收时丢弃
+
+        Returns:
+            dict: status ('ok' / 'error' / 'timeout' / 'dead'), outputs (nbformat输出列表),
+                  execution_count, stdout, stderr, limit_exceeded ('cpu' / 'memory' / None),
+                  metrics (wall_time, cpu_time, peak_rss, output_bytes, output_truncated)
+        """
+        timeout = timeout or config.executor.timeout
+        if not self.is_alive():
+            return self._result('dead', [], None)
+
+        collector = _OutputCollector(max_output_bytes)
+        # 内部的静默执行（切换目录、保存命名空间等）不需要资源采样，不启动监控线程
+        monitor = None
+        if not silent:
+            monitor = ResourceMonitor(self.pid, config.executor.monitor_interval, cpu_limit, memory_limit,
+                                      on_limit=lambda kind: self.interrupt()).start()
+        start = time.monotonic()
+        try:
+            status, reply = self._execute_and_wait(code, timeout, silent, collector, monitor)
+        finally:
+            self.last_used = time.time()
+            metrics = monitor.stop() if monitor is not None else {}
+
+        metrics.update(
+            wall_time=time.monotonic() - start,
+            output_bytes=collector.output_bytes,
+            output_truncated=collector.truncated
+        )
+        content = reply.get('content', {}) if reply else {}
+        if status == 'ok':
+            self.execution_count = content.get('execution_count') or self.execution_count
+            status = 'ok' if content.get('status') == 'ok' else 'error'
+        result = self._result(status, collector.outputs, content.get('execution_count'))
+        result['limit_exceeded'] = monitor.exceeded if monitor is not None else None
+        result['metrics'] = metrics
+        return result
+
+    def _execute_and_wait(self, code: str, timeout: float, silent: bool, collector, monitor):
+        """发送执行请求并收集输出直到内核空闲；与execute_interactive相同，但能及时发现内核退出"""
+        msg_id = self.kc.execute(code, silent=silent, store_history=not silent, allow_stdin=False)
+        deadline = time.monotonic() + timeout
+        exceeded_at = None
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # 中断正在运行的代码，内核本身保留
+                self.interrupt()
+                return 'timeout', None
+            try:
+                msg = self.kc.get_iopub_msg(timeout=min(remaining, _POLL_INTERVAL))
+            except queue.Empty:
+                if not self.is_alive():
+                    return 'dead', None
+                if monitor is not None and monitor.exceeded == 'memory':
+                    # 中断后内存仍未回落（如卡在C扩展中），杀掉内核保护所在节点
+                    exceeded_at = exceeded_at or time.monotonic()
+                    if time.monotonic() - exceeded_at > _MEMORY_KILL_GRACE:
+                        print("内核内存超过限制且无法中断，强制关闭内核")
+                        self.shutdown()
+                        return 'dead', None
+                continue
+            if msg['parent_header'].get('msg_id') != msg_id:
+                continue
+            collector.handle(msg)
+            if msg['header']['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+                break
+
+        while True:
+            remaining = max(deadline - time.monotonic(), _POLL_INTERVAL)
+            try:
+                reply = self.kc.get_shell_msg(timeout=remaining)
+            except queue.Empty:
+                return ('dead' if not self.is_alive() else 'timeout'), None
+            if reply['parent_header'].get('msg_id') == msg_id:
+                return 'ok', reply
+
+    @property
+    def pid(self) -> Optional[int]:
+        """内核进程号"""
+        provisioner = getattr(self.km, 'provisioner', None)
+        return getattr(provisioner, 'pid', None)
+
+    def set_memory_limit(self, limit_bytes: int):
+        """在内核进程内设置地址空间上限(RLIMIT_AS)，超出时分配内存抛出MemoryError；不支持的平台忽略"""
+        if not limit_bytes:
+            return
+        code = (
+            "try:\n"
+            "    import resource as _agentnote_resource\n"
+            "    _agentnote_resource.setrlimit(_agentnote_resource.RLIMIT_AS,\n"
+            f"        ({int(limit_bytes)}, _agentnote_resource.getrlimit(_agentnote_resource.RLIMIT_AS)[1]))\n"
+            "    del _agentnote_resource\n"
+            "except (ImportError, ValueError, OSError):\n"
+            "    pass"
+        )
+        self.execute(code, silent=True)
+
+    def warm_up(self, modules: List[str]):
+        """预先导入模块到sys.modules，不污染用户命名空间"""
+        if not modules:
+            return
+        code = (
+            f"for _agentnote_mod in {list(modules)!r}:\n"
+            "    try:\n"
+            "        __import__('importlib').import_module(_agentnote_mod)\n"
+            "    except Exception:\n"
+            "        pass\n"
+            "del _agentnote_mod"
+        )
+        self.execute(code, silent=True)
+
+    def chdir(self, cwd: str):
+        """切换内核的工作目录"""
+        self.execute(f"__import__('os').chdir({cwd!r})", silent=True)
+        self.cwd = cwd
+
+    def reset(self, warm_imports: List[str] = None) -> bool:
+        """清空用户命名空间以便复用内核，已导入的模块保留在sys.modules中"""
+        result = self.execute("%reset -f", silent=True)
+        if result['status'] != 'ok':
+            return False
+        self.warm_up(warm_imports)
+        return True
+
+    def save_namespace(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        把用户命名空间序列化到文件（有dill时使用dill），模块只记录名称
+
+        Returns:
+            dict: serializer, variables, skipped（无法序列化的变量名）；失败时返回None
+        """
+        result = self.execute(_SAVE_NAMESPACE_CODE.replace('__PATH__', repr(path)), silent=True)
+        if result['status'] != 'ok' or not os.path.exists(path + '.json'):
+            return None
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_namespace(self, path: str, serializer: str = 'pickle') -> bool:
+        """从save_namespace生成的文件恢复用户命名空间"""
+        code = _LOAD_NAMESPACE_CODE.replace('__PATH__', repr(path)).replace('__SERIALIZER__', repr(serializer))
+        return self.execute(code, silent=True)['status'] == 'ok'
+
+    def interrupt(self):
+        """中断当前执行"""
+        if self.km is not None:
+            try:
+                self.km.interrupt_kernel()
+            except Exception as e:
+                print(f"中断内核失败: {e}")
+
+    def restart(self):
+        """重启内核，清空所有状态"""
+        if self.km is None:
+            return self.start()
+        self.km.restart_kernel(now=True)
+        self.kc.wait_for_ready(timeout=config.executor.startup_timeout)
+        self.started_at = time.time()
+        self.last_used = self.started_at
+        self.execution_count = 0
+        return self
+
+    def shutdown(self):
+        """关闭内核"""
+        if self.kc is not None:
+            try:
+                self.kc.stop_channels()
+            except Exception:
+                pass
+        if self.km is not None:
+            try:
+                self.km.shutdown_kernel(now=True)
+            except Exception as e:
+                print(f"关闭内核失败: {e}")
+        self.km = None
+        self.kc = None
+
+    @staticmethod
+    def _result(status: str, outputs: List, execution_count: Optional[int]) -> Dict[str, Any]:
+        stdout = "".join(o.text for o in outputs if o.output_type == 'stream' and o.name == 'stdout')
+        stderr = "".join(o.text for o in outputs if o.output_type == 'stream' and o.name == 'stderr')
+        return {
+            'status': status,
+            'outputs': outputs,
+            'execution_count': execution_count,
+            'stdout': stdout,
+            'stderr': stderr,
+            'limit_exceeded': None,
+            'metrics': None
+        }
+
+
+# 在内核中执行的命名空间序列化代码；没有dill时，__main__中定义的函数和类无法可靠恢复，记为跳过
+_SAVE_NAMESPACE_CODE = """
+def _agentnote_save(path):
+    import re, json, types
+    # 只排除IPython的输入输出历史（_、__、___、_5、_i、_ii、_iii、_i5、_ih、_oh、_dh）、
+    # 模块级的双下划线属性和本函数自身；以下划线开头的用户变量照常保存，无法保存时计入skipped
+    history = re.compile(r'_{1,3}|_\\d+|_i{1,3}|_i\\d+|_ih|_oh|_dh|__\\w+__|_agentnote_\\w+')
+    try:
+        import dill as serializer
+        name = 'dill'
+    except ImportError:
+        import pickle as serializer
+        name = 'pickle'
+    ip = get_ipython()
+    hidden = set(ip.user_ns_hidden)
+    modules, values, skipped = {}, {}, []
+    for key, value in list(ip.user_ns.items()):
+        if history.fullmatch(key) or key in hidden or key in ('In', 'Out', 'exit', 'quit', 'get_ipython'):
+            continue
+        if isinstance(value, types.ModuleType):
+            modules[key] = value.__name__
+            continue
+        if name == 'pickle' and getattr(value, '__module__', None) == '__main__':
+            skipped.append(key)
+            continue
+        try:
+            values[key] = serializer.dumps(value)
+        except Exception:
+            skipped.append(key)
+    with open(path, 'wb') as f:
+        serializer.dump({'modules': modules, 'values': values}, f)
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump({'serializer': name, 'variables': len(values), 'modules': len(modules), 'skipped': skipped}, f)
+_agentnote_save(__PATH__)
+del _agentnote_save
+"""
+
+_LOAD_NAMESPACE_CODE = """
+def _agentnote_load(path, name):
+    import importlib
+    if name == 'dill':
+        import dill as serializer
+    else:
+        import pickle as serializer
+    with open(path, 'rb') as f:
+        data = serializer.load(f)
+    ns = get_ipython().user_ns
+    for key, module in data['modules'].items():
+        ns[key] = importlib.import_module(module)
+    for key, blob in data['values'].items():
+        ns[key] = serializer.loads(blob)
+_agentnote_load(__PATH__, __SERIALIZER__)
+del _agentnote_load
+"""
+
+
+class _OutputCollector:
+    """收集iopub消息并转换为nbformat输出，行为与nbclient一致"""
+
+    def __init__(self, max_bytes: int = 0):
+        self.outputs = []
+        self.max_bytes = max_bytes
+        self.output_bytes = 0  # 收到的全部输出大小，包括被丢弃的部分
+        self.truncated = False
+        self._kept_bytes = 0
+        self._clear_before_next = False
+
+    def handle(self, msg):
+        msg_type = msg['header']['msg_type']
+        content = msg['content']
+
+        if msg_type == 'clear_output':
+            if content.get('wait'):
+                self._clear_before_next = True
+            else:
+                self.outputs = []
+                self._kept_bytes = 0
+            return
+
+        if msg_type not in ('stream', 'display_data', 'execute_result', 'error'):
+            return
+
+        if self._clear_before_next:
+            self.outputs = []
+            self._kept_bytes = 0
+            self._clear_before_next = False
+
+        output = nbf.v4.output_from_msg(msg)
+        size = _output_size(output)
+        self.output_bytes += size
+        if self.max_bytes and output.output_type != 'error':
+            # 错误信息总是保留；其他输出超出上限后丢弃，stream保留能放下的开头部分
+            if self._kept_bytes + size > self.max_bytes:
+                output = self._truncate(output)
+                if output is None:
+                    return
+                size = _output_size(output)
+            self._kept_bytes += size
+
+        # 合并连续的同名stream输出
+        if (output.output_type == 'stream' and self.outputs
+                and self.outputs[-1].output_type == 'stream'
+                and self.outputs[-1].name == output.name):
+            self.outputs[-1].text += output.text
+            return
+
+        self.outputs.append(output)
+
+    def _truncate(self, output):
+        notice = f"\n...[输出超过 {self.max_bytes} 字节，之后的输出已丢弃]\n"
+        if self.truncated:
+            return None
+        self.truncated = True
+        if output.output_type == 'stream':
+            room = max(self.max_bytes - self._kept_bytes, 0)
+            output.text = output.text.encode('utf-8')[:room].decode('utf-8', errors='ignore') + notice
+            return output
+        return nbf.v4.new_output('stream', name='stderr', text=notice)
+
+
+def _output_size(output) -> int:
+    if output.output_type == 'stream':
+        return len(output.text.encode('utf-8'))
+    if output.output_type == 'error':
+        return sum(len(line) for line in output.get('traceback', []))
+    return sum(len(value) if isinstance(value, str) else len(json.dumps(value))
+               for value in output.get('data', {}).values())
@@ -0,0 +1,381 @@
+import os
+import time
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional
+from .config import config
+
+# 当前步骤的标签（plan、1、2...），API调用按它归入步骤
+_current_step = contextvars.ContextVar('agentnote_metrics_step', default=None)
+
+_NO_LABEL = '-'
+_TOKEN_TYPES = ('prompt_tokens', 'completion_tokens', 'reasoning_tokens')
+
+
+class BudgetExceededError(Exception):
+    """任务超出了令牌或耗时预算"""
+
+
+class MetricsRegistry:
+    """
+    进程内的用量统计 - 按任务、步骤和模型累计请求数、令牌数（含推理令牌）、费用、缓存命中和请求耗时分布
+
+    按任务的明细只保留最近 metrics.max_tasks 个任务；导出的Prometheus计数器按 (步骤, 模型) 累计，不带任务标签，
+    长时间运行的进程中序列数不会随任务数增长。任务的令牌和耗时预算也在这里检查，超出后降级到更便宜的模型或中止任务
+    """
+
+    def __init__(self):
+        cfg = config.metrics
+        self.buckets = sorted(cfg.latency_buckets)
+        self.current_task = None  # 当前任务的id，其他线程中的API调用也归入该任务
+        self._lock = threading.Lock()
+        self._series: Dict[tuple, Dict[str, Any]] = {}  # (任务, 步骤, 模型) -> 计数，只含保留的任务
+        self._totals: Dict[tuple, Dict[str, Any]] = {}  # (步骤, 模型) -> 进程内累计计数，用于导出
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._task_count = 0
+        self._server = None
+
+    @contextmanager
+    def task(self, description: str):
+        """统计一个任务的用量，结束后按配置写出Prometheus文件"""
+        with self._lock:
+            self._task_count += 1
+            task_id = f"t{self._task_count}"
+            self._tasks[task_id] = {
+                'id': task_id, 'task': description, 'start': time.time(), 'end': None,
+                'requests': 0, 'tokens': 0, 'cost': 0.0, 'downgraded_to': None, 'aborted': None
+            }
+            self._prune_tasks()
+        previous, self.current_task = self.current_task, task_id
+        try:
+            yield task_id
+        finally:
+            self.current_task = previous
+            with self._lock:
+                self._tasks[task_id]['end'] = time.time()
+            if config.metrics.prometheus_file:
+                self.write_prometheus(config.metrics.prometheus_file)
+
+    @contextmanager
+    def step(self, label):
+        """期间（同一线程中）的API调用归入该步骤"""
+        token = _current_step.set(str(label))
+        try:
+            yield
+        finally:
+            _current_step.reset(token)
+
+    def _prune_tasks(self):
+        """只保留最近的任务的明细，进行中的任务不删除"""
+        finished = [task_id for task_id, task in self._tasks.items() if task['end'] is not None]
+        for task_id in finished[:max(0, len(self._tasks) - max(1, config.metrics.max_tasks))]:
+            del self._tasks[task_id]
+            for key in [key for key in self._series if key[0] == task_id]:
+                del self._series[key]
+
+    def _get_series(self, model: str) -> List[Dict[str, Any]]:
+        """当前 (任务, 步骤, 模型) 的明细和 (步骤, 模型) 的累计计数"""
+        step, model = _current_step.get() or _NO_LABEL, model or _NO_LABEL
+        return [self._counters(self._series, (self.current_task or _NO_LABEL, step, model)),
+                self._counters(self._totals, (step, model))]
+
+    def _counters(self, table: Dict[tuple, Dict[str, Any]], key: tuple) -> Dict[str, Any]:
+        series = table.get(key)
+        if series is None:
+            series = table[key] = {
+                'requests': 0, 'failed': 0, 'cache_hits': 0, 'cost': 0.0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'reasoning_tokens': 0,
+                'latency_sum': 0.0, 'latency_counts': [0] * (len(self.buckets) + 1)
+            }
+        return series
+
+    def record_request(self, model: str, usage: Dict[str, int] = None, latency: float = None, failed: bool = False):
+        """记录一次API调用；推理令牌已包含在completion_tokens中，单独统计只用于展示"""
+        usage = usage or {}
+        cost = _cost(model, usage)
+        with self._lock:
+            for series in self._get_series(model):
+                series['requests'] += 1
+                if failed:
+                    series['failed'] += 1
+                for key in _TOKEN_TYPES:
+                    series[key] += usage.get(key) or 0
+                series['cost'] += cost
+                if latency is not None:
+                    series['latency_sum'] += latency
+                    series['latency_counts'][_bucket_index(self.buckets, latency)] += 1
+            task = self._tasks.get(self.current_task)
+            if task is not None:
+                task['requests'] += 1
+                task['tokens'] += usage.get('total_tokens') or 0
+                task['cost'] += cost
+
+    def record_cache_hit(self, model: str):
+        with self._lock:
+            for series in self._get_series(model):
+                series['cache_hits'] += 1
+
+    def enforce_budget(self) -> Optional[str]:
+        """
+        检查当前任务的预算，返回之后的请求应使用的模型（None表示默认模型）
+
+        超出预算时按 metrics.budget_action 降级或抛出BudgetExceededError；降级后超出两倍预算仍会中止，
+        没有配置 metrics.downgrade_model 时直接中止
+        """
+        cfg = config.metrics
+        with self._lock:
+            task = self._tasks.get(self.current_task)
+            if task is None:
+                return None
+            ratio, reason = _budget_ratio(task)
+            if ratio < 1:
+                return task['downgraded_to']
+            if cfg.budget_action == 'downgrade' and cfg.downgrade_model and ratio < 2:
+                if task['downgraded_to'] is None:
+                    task['downgraded_to'] = cfg.downgrade_model
+                    print(f"⚠️ {reason}，后续请求改用 {cfg.downgrade_model}")
+                return task['downgraded_to']
+            task['aborted'] = reason
+        raise BudgetExceededError(reason)
+
+    def task_usage(self, task_id: str = None) -> Optional[Dict[str, Any]]:
+        """一个任务（默认当前或最近的任务）的用量和预算，明细已被丢弃的任务返回None"""
+        with self._lock:
+            task_id = task_id or self.current_task or (f"t{self._task_count}" if self._task_count else None)
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            usage = {key: value for key, value in task.items() if key not in ('start', 'end')}
+            usage['elapsed'] = round((task['end'] or time.time()) - task['start'], 3)
+            usage['cost'] = round(task['cost'], 6)
+            for key in _TOKEN_TYPES + ('cache_hits', 'failed'):
+                usage[key] = sum(series[key] for (task_key, _, _), series in self._series.items()
+                                 if task_key == task_id)
+            usage['budget_used'] = round(_budget_ratio(task)[0], 3)
+            return usage
+
+    def get_stats(self, task_id: str = None) -> List[Dict[str, Any]]:
+        """按 (任务, 步骤, 模型) 返回统计行，耗时为毫秒，p95按分桶上界估算"""
+        with self._lock:
+            rows = []
+            for (task_key, step, model), series in self._series.items():
+                if task_id is not None and task_key != task_id:
+                    continue
+                timed = sum(series['latency_counts'])
+                row = {'task': task_key, 'step': step, 'model': model}
+                row.update({key: series[key] for key in ('requests', 'failed', 'cache_hits') + _TOKEN_TYPES})
+                row['cost'] = round(series['cost'], 6)
+                row['latency_avg_ms'] = round(series['latency_sum'] / timed * 1000, 1) if timed else None
+                row['latency_p95_ms'] = self._percentile_ms(series['latency_counts'], 0.95)
+                rows.append(row)
+        return sorted(rows, key=lambda row: (len(row['task']), row['task'], _step_order(row['step']), row['model']))
+
+    def _percentile_ms(self, counts: List[int], quantile: float) -> Optional[float]:
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= quantile * total:
+                return self.buckets[i] * 1000 if i < len(self.buckets) else float('inf')
+        return None
+
+    def format_stats(self, task_id: str = None) -> str:
+        """命令行展示的统计表"""
+        lines = []
+        with self._lock:
+            tasks = [task_id] if task_id else list(self._tasks)
+        for tid in tasks:
+            usage = self.task_usage(tid)
+            if usage is None:
+                continue
+            line = (f"任务 {tid}: {usage['task'][:60]} | 耗时 {usage['elapsed']:.1f}s | 请求 {usage['requests']} | "
+                    f"令牌 {usage['tokens']} (推理 {usage['reasoning_tokens']}) | 缓存命中 {usage['cache_hits']}")
+            if usage['cost']:
+                line += f" | 费用 {usage['cost']:.4f}"
+            if _has_budget():
+                line += f" | 预算已用 {usage['budget_used']:.0%}"
+            if usage['downgraded_to']:
+                line += f" | 已降级到 {usage['downgraded_to']}"
+            if usage['aborted']:
+                line += f" | 已中止: {usage['aborted']}"
+            lines.append(line)
+
+        rows = self.get_stats(task_id)
+        if not rows:
+            return "\n".join(lines + ["暂无API调用记录"])
+        lines.append(f"{'任务':<6}{'步骤':<6}{'模型':<22}{'请求':>6}{'失败':>6}{'缓存':>6}"
+                     f"{'提示令牌':>10}{'生成令牌':>10}{'推理令牌':>10}{'平均(ms)':>10}{'p95(ms)':>10}")
+        for row in rows:
+            lines.append(f"{row['task']:<8}{row['step']:<8}{row['model']:<24}{row['requests']:>8}{row['failed']:>8}"
+                         f"{row['cache_hits']:>8}{row['prompt_tokens']:>14}{row['completion_tokens']:>14}"
+                         f"{row['reasoning_tokens']:>14}{_format_ms(row['latency_avg_ms']):>12}"
+                         f"{_format_ms(row['latency_p95_ms']):>10}")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式；计数器按 (步骤, 模型) 累计，耗时分布只按模型汇总，任务指标只含保留的最近任务"""
+        with self._lock:
+            series_items = [(key, dict(series)) for key, series in self._totals.items()]
+            tasks = [dict(task) for task in self._tasks.values()]
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(value_)}"' for key, value_ in labels.items())
+                out.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        def per_series(key):
+            return [({'step': step, 'model': model}, series[key]) for (step, model), series in series_items]
+
+        metric('agentnote_llm_requests_total', 'counter', 'API请求数', per_series('requests'))
+        metric('agentnote_llm_failed_requests_total', 'counter', '失败的API请求数', per_series('failed'))
+        metric('agentnote_llm_cache_hits_total', 'counter', '命中响应缓存的请求数', per_series('cache_hits'))
+        metric('agentnote_llm_tokens_total', 'counter', '令牌数，推理令牌包含在completion中', [
+            ({'step': step, 'model': model, 'type': key.replace('_tokens', '')}, series[key])
+            for (step, model), series in series_items for key in _TOKEN_TYPES])
+        metric('agentnote_llm_cost_total', 'counter', '按配置单价估算的费用', per_series('cost'))
+
+        by_model: Dict[str, Dict[str, Any]] = {}
+        for (_, model), series in series_items:
+            merged = by_model.setdefault(model, {'sum': 0.0, 'counts': [0] * (len(self.buckets) + 1)})
+            merged['sum'] += series['latency_sum']
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], series['latency_counts'])]
+        samples = []
+        for model, merged in by_model.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float('inf')], merged['counts']):
+                cumulative += count
+                samples.append(({'model': model, 'le': '+Inf' if bound == float('inf') else f"{bound:g}"},
+                                cumulative))
+        out.append("# HELP agentnote_llm_latency_seconds API请求耗时")
+        out.append("# TYPE agentnote_llm_latency_seconds histogram")
+        for labels, value in samples:
+            out.append(f'agentnote_llm_latency_seconds_bucket{{model="{_escape_label(labels["model"])}",'
+                       f'le="{labels["le"]}"}} {value}')
+        for model, merged in by_model.items():
+            out.append(f'agentnote_llm_latency_seconds_sum{{model="{_escape_label(model)}"}} {merged["sum"]:.6f}')
+            out.append(f'agentnote_llm_latency_seconds_count{{model="{_escape_label(model)}"}} {sum(merged["counts"])}')
+
+        now = time.time()
+        metric('agentnote_task_duration_seconds', 'gauge', '任务耗时，进行中的任务为已用时间',
+               [({'task': task['id']}, round((task['end'] or now) - task['start'], 3)) for task in tasks])
+        metric('agentnote_task_budget_used_ratio', 'gauge', '已用预算比例（令牌和耗时中的较大者）',
+               [({'task': task['id']}, round(_budget_ratio(task)[0], 4)) for task in tasks])
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path: str):
+        """写出Prometheus文本文件（可供node_exporter的textfile收集器读取），先写临时文件再替换"""
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入指标文件失败: {e}")
+
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        """在后台线程中提供 http://host:port/metrics"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                payload = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"启动指标服务失败: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"指标服务已启动: http://{host}:{self._server.server_address[1]}/metrics")
+
+    def close(self):
+        if config.metrics.prometheus_file:
+            self.write_prometheus(config.metrics.prometheus_file)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _bucket_index(buckets: List[float], value: float) -> int:
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)
+
+
+def _cost(model: str, usage: Dict[str, int]) -> float:
+    """按 metrics.prices 中每百万令牌的 [输入, 输出] 单价估算费用，未配置单价时为0"""
+    price = config.metrics.prices.get(model or '')
+    if not price or not usage:
+        return 0.0
+    return ((usage.get('prompt_tokens') or 0) * price[0] + (usage.get('completion_tokens') or 0) * price[1]) / 1e6
+
+
+def _has_budget() -> bool:
+    return bool(config.metrics.task_token_budget or config.metrics.task_time_budget)
+
+
+def _budget_ratio(task: Dict[str, Any]):
+    """返回 (已用预算比例, 说明)，令牌和耗时取较大者，未设置预算时比例为0"""
+    cfg = config.metrics
+    ratio, reason = 0.0, ""
+    if cfg.task_token_budget:
+        ratio = task['tokens'] / cfg.task_token_budget
+        reason = f"任务已用 {task['tokens']} 令牌，超出预算 {cfg.task_token_budget}"
+    if cfg.task_time_budget:
+        elapsed = (task['end'] or time.time()) - task['start']
+        if elapsed / cfg.task_time_budget > ratio:
+            ratio = elapsed / cfg.task_time_budget
+            reason = f"任务已运行 {elapsed:.0f}秒，超出预算 {cfg.task_time_budget:g}秒"
+    return ratio, reason
+
+
+def _step_order(step: str):
+    return (0, 0) if step == 'plan' else (1, int(step)) if step.isdigit() else (2, 0)
+
+
+def _format_ms(value) -> str:
+    if value is None:
+        return '-'
+    return 'inf' if value == float('inf') else f"{value:.0f}"
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> MetricsRegistry:
+    """获取进程内共享的用量统计，按配置启动指标服务"""
+    global _metrics
+    if _metrics is not None:
+        return _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+            if config.metrics.prometheus_port:
+                _metrics.serve(config.metrics.prometheus_port)
+            atexit.register(_metrics.close)
+        return _metrics
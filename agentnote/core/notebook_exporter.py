@@ -1,11 +1,22 @@
 import json
 import os
+import hashlib
 from datetime import datetime
 import nbformat as nbf
+from typing import Optional, Set
 from .config import config
 
 class NotebookExporter:
-    """Notebook导出器"""
+    """Notebook导出器 - 支持整本导出，以及每个步骤结束后只追加新完成cell的增量导出"""
+    
+    def __init__(self, output_file: str = None, export_format: str = None):
+        self.output_file = output_file or config.notebook.export_file
+        self.export_format = export_format or config.notebook.export_format
+        if self.export_format == 'msgpack' and not _msgpack_available():
+            print("未安装msgpack或zstandard，增量导出改用JSONL格式")
+            self.export_format = 'jsonl'
+        self.index_file = self.output_file + ".index"
+        self._exported = None  # (notebook路径, cell id) -> 导出时的内容哈希
     
     @staticmethod
     def extract_cell_data(cell, cell_index: int):
@@ -28,8 +39,7 @@ class NotebookExporter:
                 
                 if output.output_type == "execute_result":
                     output_data["data"] = {
-                        k: str(v)[:500] + "..." if len(str(v)) > 500 else str(v) 
-                        for k, v in output.data.items()
+                        k: _truncate_value(v) for k, v in output.data.items()
                     } if hasattr(output, 'data') else {}
                     output_data["execution_count"] = output.get('execution_count', None)
                 
@@ -43,14 +53,108 @@ class NotebookExporter:
                 
                 elif output.output_type == "display_data":
                     output_data["data"] = {
-                        k: "[binary data]" if k.startswith('image/') else str(v)[:500] + "..." if len(str(v)) > 500 else str(v)
+                        k: "[binary data]" if k.startswith('image/') else _truncate_value(v)
                         for k, v in output.data.items()
                     } if hasattr(output, 'data') else {}
                 
+                offloaded = output.get('metadata', {}).get('agentnote_offloaded')
+                if offloaded:
+                    # 内容保存在notebook旁的文件中，只导出引用
+                    output_data["offloaded"] = offloaded['refs']
+                
                 cell_data["outputs"].append(output_data)
         
         return cell_data
     
+    def export_new_cells(self, nb, notebook_path: str, changed: Optional[Set[str]] = None) -> int:
+        """
+        增量导出：把上次导出之后新完成（或内容变化）的cell各追加一条记录，返回导出的cell数
+
+        未执行的代码cell视为尚未完成，留到执行后再导出；同一cell内容变化后会再追加一条，以最后一条为准
+
+        Args:
+            changed: 上次导出之后修改过的cell id（NotebookManager.take_changed_cells），只对这些cell计算哈希；
+                     None表示检查全部cell
+        """
+        if self._exported is None:
+            self._exported = self._load_index()
+            changed = None  # 索引重新加载（首次或上次写入失败）后全部检查一遍
+        
+        notebook_path = os.path.abspath(notebook_path)
+        export_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        records = []
+        index_lines = []
+        for i, cell in enumerate(nb.cells):
+            if changed is not None and cell.get('id') not in changed:
+                continue
+            if cell.cell_type == 'code' and cell.get('execution_count') is None and not cell.get('outputs'):
+                continue
+            key = (notebook_path, cell.get('id') or str(i))
+            digest = _cell_digest(cell)
+            if self._exported.get(key) == digest:
+                continue
+            record = self.extract_cell_data(cell, i)
+            record["cell_id"] = key[1]
+            record["notebook_path"] = notebook_path
+            record["export_time"] = export_time
+            records.append(record)
+            index_lines.append(json.dumps([key[0], key[1], digest], ensure_ascii=False) + '\n')
+            self._exported[key] = digest
+        
+        if not records:
+            return 0
+        try:
+            self._append_records(records)
+            # 记录写入成功后再更新索引；中途崩溃最多导致重复导出，不会漏导
+            with open(self.index_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(index_lines))
+        except Exception as e:
+            print(f"增量导出失败: {e}")
+            self._exported = None
+            return 0
+        return len(records)
+    
+    def _append_records(self, records):
+        if self.export_format == 'msgpack':
+            # 每批记录压缩为一个独立的zstd帧追加到文件末尾，读取时逐帧解压
+            import msgpack
+            import zstandard
+            payload = b''.join(msgpack.packb(record, use_bin_type=True) for record in records)
+            with open(self.output_file, 'ab') as f:
+                f.write(zstandard.ZstdCompressor().compress(payload))
+        else:
+            with open(self.output_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+    
+    def _load_index(self):
+        exported = {}
+        if not os.path.exists(self.index_file):
+            return exported
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    notebook_path, cell_id, digest = json.loads(line)
+                except ValueError:
+                    continue
+                exported[(notebook_path, cell_id)] = digest
+        return exported
+    
+    @staticmethod
+    def read_records(path: str, export_format: str = None):
+        """逐条读取增量导出的记录（JSONL或msgpack+zstd），适合批量分析大量运行结果"""
+        export_format = export_format or config.notebook.export_format
+        if export_format == 'msgpack':
+            import msgpack
+            import zstandard
+            with open(path, 'rb') as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                yield from msgpack.Unpacker(reader, raw=False)
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    
     @staticmethod
     def export_notebook_to_json(notebook_path: str, output_file: str = None):
         """导出notebook的所有cell输入输出到JSON"""
@@ -93,4 +197,25 @@ class NotebookExporter:
             nbf.write(nb, f)
             f.flush()
             os.fsync(f.fileno())
-        print(f"Notebook已保存: {notebook_path}")
\ No newline at end of file
+        print(f"Notebook已保存: {notebook_path}")
+
+
+def _truncate_value(value, limit: int = 500) -> str:
+    text = str(value)
+    return text[:limit] + "..." if len(text) > limit else text
+
+
+def _cell_digest(cell) -> str:
+    """cell源码、执行序号和输出的哈希，用于判断导出后cell是否变化"""
+    payload = json.dumps([cell.source, cell.get('execution_count'), cell.get('outputs', [])],
+                         ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+        import zstandard  # noqa: F401
+        return True
+    except ImportError:
+        return False
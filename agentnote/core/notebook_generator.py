@@ -1,6 +1,14 @@
+import re
+import time
 import nbformat as nbf
 from .config import config
 
+# 智能体写入notebook的时间戳行都由timestamp_line生成，每次运行都不同；LLM响应缓存计算键时用TIMESTAMP_LINE_PATTERN忽略它们
+TIMESTAMP_LABELS = ('**规划时间**', '**执行时间**', '开始时间', '完成时间', '创建时间')
+TIMESTAMP_LINE_PATTERN = re.compile(
+    r'^((?:' + '|'.join(re.escape(label) for label in TIMESTAMP_LABELS) + r'): )\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$',
+    re.MULTILINE)
+
 class NotebookGenerator:
     """Notebook生成器"""
     
@@ -33,4 +41,11 @@ class NotebookGenerator:
     def add_cell_to_notebook(nb, cell):
         """添加cell到notebook"""
         nb.cells.append(cell)
-        return nb
\ No newline at end of file
+        return nb
+
+    @staticmethod
+    def timestamp_line(label: str) -> str:
+        """生成"标签: 当前时间"行，标签必须在TIMESTAMP_LABELS中"""
+        if label not in TIMESTAMP_LABELS:
+            raise ValueError(f"未知的时间戳标签: {label}")
+        return f"{label}: {time.strftime('%Y-%m-%d %H:%M:%S')}"
@@ -1,25 +1,49 @@
 import os
 import time
+import tempfile
 import nbformat as nbf
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Set
 from .config import config
 from .notebook_generator import NotebookGenerator
 from .notebook_exporter import NotebookExporter
+from .context_builder import NotebookContextBuilder
+from .output_store import OutputStore
+from .tracing import traced, current_span
 
 class NotebookManager:
     """Notebook管理器"""
 
-    def __init__(self):
+    def __init__(self, notebook_path: str = None):
         # 根据配置决定是否添加时间戳
-        if config.notebook.add_timestamp:
+        if notebook_path:
+            self.notebook_path = notebook_path
+        elif config.notebook.add_timestamp:
             base_name = config.notebook.notebook_name
             name, ext = os.path.splitext(base_name)
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             self.notebook_path = f"{name}_{timestamp}{ext}"
+            # 同一秒内创建的多个notebook追加序号，避免互相覆盖
+            suffix = 1
+            while os.path.exists(self.notebook_path):
+                self.notebook_path = f"{name}_{timestamp}_{suffix}{ext}"
+                suffix += 1
         else:
             self.notebook_path = config.notebook.notebook_name
             
         self._notebook_initialized = False  # 标记是否已初始化
+        
+        # 内存中的notebook是唯一权威副本，磁盘只作为持久化
+        self.nb = None
+        self.version = 0  # 每次修改递增，供缓存判断notebook是否变化
+        self._dirty = False  # 是否有尚未写入磁盘的修改（写回缓存）
+        self._changed_cells = None  # 上次取走之后修改过的cell id，None表示无法确定，需要检查全部cell
+        self._disk_signature = None  # 最近一次读写后文件的 (mtime_ns, size)
+        
+        self.context_builder = NotebookContextBuilder()
+        self._context_cache = None  # (version, context)
+        
+        # 图片等大输出保存到notebook旁的文件中，notebook本身保持小巧
+        self.output_store = OutputStore(self.notebook_path) if config.notebook.offload_outputs else None
     
     def initialize_notebook(self):
         """初始化notebook - 只在程序启动时调用一次"""
@@ -30,8 +54,9 @@ class NotebookManager:
         if not os.path.exists(self.notebook_path):
             nb = NotebookGenerator.create_notebook()
             # 添加初始标记
-            initial_markdown = f"# AgentNote 生成的 Notebook\n\n创建时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n---\n"
+            initial_markdown = f"# AgentNote 生成的 Notebook\n\n{NotebookGenerator.timestamp_line('创建时间')}\n\n---\n"
             self.add_markdown_cell(nb, initial_markdown)
+            self.flush()
             print(f"创建新的Notebook: {self.notebook_path}")
         else:
             # 加载现有notebook
@@ -42,31 +67,169 @@ class NotebookManager:
         return nb
     
     def load_notebook(self):
-        """加载现有的notebook"""
-        if not os.path.exists(self.notebook_path):
-            # 如果文件不存在，创建一个新的
-            nb = NotebookGenerator.create_notebook()
-            self.save_notebook(nb)
-            return nb
+        """获取notebook - 直接返回内存中的实例，只有文件被外部修改过才重新读取磁盘"""
+        if self.nb is not None:
+            signature = self._stat_signature()
+            if signature is None:
+                # 文件被删除，用内存中的版本重建
+                self.save_notebook(self.nb)
+                return self.nb
+            if signature == self._disk_signature:
+                return self.nb
+            if self._dirty:
+                print("Notebook文件被外部修改，但内存中有未保存的修改，保留内存中的版本")
+                return self.nb
+            print("检测到Notebook文件被外部修改，重新加载")
+        
+        nb = self._read_from_disk()
+        if nb is None:
+            # 文件不存在或无法解析
+            if self.nb is None:
+                self.nb = NotebookGenerator.create_notebook()
+                self.version += 1
+            self.save_notebook(self.nb)
+            return self.nb
+        
+        if self.nb is None:
+            self.nb = nb
+        else:
+            # 原地替换内容，保持外部持有的引用有效
+            self.nb.clear()
+            self.nb.update(nb)
+        self.version += 1
+        self._changed_cells = None
+        return self.nb
+    
+    def merge_outputs_from_disk(self):
+        """把磁盘上（如nbconvert执行后）的执行结果合并进内存中的notebook，而不替换整个实例"""
+        disk_nb = self._read_from_disk()
+        if disk_nb is None or self.nb is None:
+            return self.load_notebook()
         
+        disk_cells = {cell.get('id'): cell for cell in disk_nb.cells if cell.get('id')}
+        for i, cell in enumerate(self.nb.cells):
+            if cell.cell_type != 'code':
+                continue
+            source_cell = disk_cells.get(cell.get('id'))
+            if source_cell is None and i < len(disk_nb.cells):
+                source_cell = disk_nb.cells[i]
+            if source_cell is None or source_cell.cell_type != 'code':
+                continue
+            cell.outputs = source_cell.get('outputs', [])
+            cell.execution_count = source_cell.get('execution_count')
+            if 'execution' in source_cell.metadata:
+                cell.metadata['execution'] = source_cell.metadata['execution']
+        
+        self.nb.metadata.update(disk_nb.metadata)
+        self.version += 1
+        self._changed_cells = None
+        return self.nb
+    
+    @traced('notebook.save')
+    def save_notebook(self, nb):
+        """立即保存notebook"""
+        self.nb = nb
+        try:
+            if self.output_store is not None:
+                self.output_store.offload_notebook(nb)
+            self._write_atomic(nb)
+            self._dirty = False
+            self._disk_signature = self._stat_signature()
+            if self._disk_signature is not None:
+                current_span().set(bytes=self._disk_signature[1], cells=len(nb.cells))
+        except Exception as e:
+            print(f"保存notebook失败: {e}")
+    
+    def mark_dirty(self, nb, cells=None):
+        """
+        标记notebook已修改，写入推迟到下一个检查点(flush)合并完成
+
+        Args:
+            cells: 内容有变化的cell（只删除cell时传空列表），不提供时视为所有cell都可能变化
+        """
+        self.nb = nb
+        self.version += 1
+        self._dirty = True
+        if cells is None:
+            self._changed_cells = None
+        elif self._changed_cells is not None:
+            for cell in cells:
+                if not cell.get('id'):
+                    self._changed_cells = None
+                    break
+                self._changed_cells.add(cell['id'])
+        if not config.notebook.write_behind:
+            self.flush()
+    
+    def take_changed_cells(self) -> Optional[Set[str]]:
+        """取出上次调用之后内容有变化的cell id，返回None时需要检查全部cell"""
+        changed, self._changed_cells = self._changed_cells, set()
+        return changed
+    
+    def is_dirty(self) -> bool:
+        """是否有尚未写入磁盘的修改"""
+        return self._dirty
+    
+    def flush(self) -> bool:
+        """检查点：把合并后的修改一次性写入磁盘，没有修改时不做任何事"""
+        if not self._dirty or self.nb is None:
+            return False
+        self.save_notebook(self.nb)
+        return not self._dirty
+    
+    def _stat_signature(self):
         try:
+            st = os.stat(self.notebook_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
+    @traced('notebook.load')
+    def _read_from_disk(self):
+        """从磁盘解析notebook，文件不存在或解析失败时返回None"""
+        if not os.path.exists(self.notebook_path):
+            return None
+        try:
+            signature = self._stat_signature()
             with open(self.notebook_path, 'r', encoding='utf-8') as f:
-                return nbf.read(f, as_version=4)
+                nb = nbf.read(f, as_version=4)
+            self._disk_signature = signature
+            if signature is not None:
+                current_span().set(bytes=signature[1])
+            return nb
         except Exception as e:
             print(f"加载notebook失败: {e}，创建新的notebook")
-            nb = NotebookGenerator.create_notebook()
-            self.save_notebook(nb)
-            return nb
+            return None
     
-    def save_notebook(self, nb):
-        """保存notebook"""
+    def _write_atomic(self, nb):
+        """先写临时文件再rename，保证磁盘上的notebook始终完整"""
+        durability = config.notebook.durability
+        path = os.path.abspath(self.notebook_path)
+        directory = os.path.dirname(path)
+        mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644
+        
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
         try:
-            with open(self.notebook_path, 'w', encoding='utf-8') as f:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
                 nbf.write(nb, f)
-                f.flush()
-                os.fsync(f.fileno())
-        except Exception as e:
-            print(f"保存notebook失败: {e}")
+                if durability in ('flush', 'fsync'):
+                    f.flush()
+                if durability == 'fsync':
+                    os.fsync(f.fileno())
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        if durability == 'fsync' and os.name == 'posix':
+            # 同步目录项，确保rename本身在崩溃后也能保留
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
     
     def add_markdown_cell(self, nb, markdown_text: str):
         """添加markdown cell"""
@@ -75,7 +238,7 @@ class NotebookManager:
             tags=[config.notebook.markdown_cell_tag]
         )
         nb.cells.append(cell)
-        self.save_notebook(nb)
+        self.mark_dirty(nb, [cell])
         return cell
     
     def add_code_cell(self, nb, code_text: str):
@@ -85,9 +248,17 @@ class NotebookManager:
             tags=[config.notebook.code_cell_tag]
         )
         nb.cells.append(cell)
-        self.save_notebook(nb)
+        self.mark_dirty(nb, [cell])
         return cell
     
+    def export_standalone(self, output_path: str):
+        """导出包含全部输出内容的独立notebook（外部文件中的输出会被读回），用于分发或转换为HTML"""
+        nb = self.load_notebook()
+        if self.output_store is not None:
+            nb = self.output_store.rehydrate_notebook(nb)
+        NotebookExporter.save_notebook(nb, output_path)
+        return output_path
+    
     def get_cell_count(self, nb):
         """获取cell数量"""
         return len(nb.cells)
@@ -99,7 +270,10 @@ class NotebookManager:
         
         # 只保留最近的cell
         nb.cells = nb.cells[-config.notebook.max_cells:]
-        self.save_notebook(nb)
+        self.mark_dirty(nb, [])
+        if self.output_store is not None:
+            self.flush()
+            self.output_store.remove_unreferenced(nb)
         print(f"已清理cell，当前数量: {len(nb.cells)}")
         return nb
     
@@ -115,9 +289,9 @@ class NotebookManager:
         cell_data = NotebookExporter.extract_cell_data(last_cell, len(nb.cells)-1)
         return cell_data
     
-    def execute_cell_safely(self, executor, code: str, cell_index: int) -> Dict[str, Any]:
+    def execute_cell_safely(self, executor, code: str, cell_index: int, nb=None) -> Dict[str, Any]:
         """安全执行单个cell代码"""
-        return executor.execute_single_cell(code, cell_index)
+        return executor.execute_single_cell(code, cell_index, nb=nb)
     
     def add_error_cell(self, nb, code: str, error_info: str):
         """添加包含错误信息的代码cell"""
@@ -134,52 +308,24 @@ class NotebookManager:
                 traceback=[error_info]
             )
             cell.outputs.append(error_output)
-            
-            # 保存notebook
-            self.save_notebook(nb)
+            self.mark_dirty(nb, [cell])
         except Exception as e:
             print(f"添加错误输出失败: {e}")
         
         return cell
     
     def get_notebook_context(self, nb) -> str:
-        """获取notebook的上下文内容（包括所有执行过的代码，无论对错）"""
-        if not nb.cells:
-            return "Notebook目前为空"
-        
-        # 从配置中获取参数
-        max_cells = config.notebook.context_max_cells
-        include_code = config.notebook.include_code_in_context
-        include_markdown = config.notebook.include_markdown_in_context
-        include_outputs = config.notebook.include_outputs_in_context
-        
-        context = "## 已生成的Notebook内容（包括执行成功和失败的代码）:\n\n"
-        
-        # 获取最近的cell，基于配置的数量限制
-        recent_cells = nb.cells[-max_cells:] if len(nb.cells) > max_cells else nb.cells
-        
-        for i, cell in enumerate(recent_cells, start=len(nb.cells)-len(recent_cells)+1):
-            if cell.cell_type == 'markdown' and include_markdown:
-                context += f"### Markdown Cell {i}:\n{cell.source}\n\n"
-            elif cell.cell_type == 'code' and include_code:
-                context += f"### Code Cell {i}:\n```python\n{cell.source}\n```\n"
-                
-                # 如果有执行结果且配置为包含输出，也包含进来
-                if include_outputs and hasattr(cell, 'outputs') and cell.outputs:
-                    context += "#### 执行结果:\n"
-                    for output in cell.outputs:
-                        if output.output_type == 'stream':
-                            context += f"输出: {output.text}\n"
-                        elif output.output_type == 'execute_result' and 'text/plain' in output.data:
-                            context += f"结果: {output.data['text/plain']}\n"
-                        elif output.output_type == 'error':
-                            # 特别包含错误信息
-                            context += f"❌ 执行错误: {output.ename}: {output.evalue}\n"
-                            if hasattr(output, 'traceback') and output.traceback:
-                                context += f"错误追踪: {' | '.join(output.traceback)}\n"
-                    context += "\n"
-        
-        print("********************Notebook Context******************************")
-        print(context)
-        print("*******************************************************************")
+        """获取notebook的上下文内容（包括所有执行过的代码，无论对错），受token预算限制"""
+        # notebook没有变化时直接复用上一次的结果
+        if nb is self.nb and self._context_cache is not None and self._context_cache[0] == self.version:
+            context = self._context_cache[1]
+        else:
+            context = self.context_builder.build(nb)
+            if nb is self.nb:
+                self._context_cache = (self.version, context)
+        
+        if config.notebook.print_context:
+            print("********************Notebook Context******************************")
+            print(context)
+            print("*******************************************************************")
         return context
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import re
+import copy
+import json
+import base64
+import hashlib
+import tempfile
+from typing import Dict, Any, Optional
+from .config import config
+
+# 以base64字符串保存在notebook中的二进制输出类型
+_BINARY_MIME_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/bmp', 'image/webp', 'application/pdf'}
+_EXTENSIONS = {
+    'image/png': '.png', 'image/jpeg': '.jpg', 'image/gif': '.gif', 'image/bmp': '.bmp',
+    'image/webp': '.webp', 'application/pdf': '.pdf', 'image/svg+xml': '.svg',
+    'text/html': '.html', 'text/latex': '.tex', 'text/markdown': '.md', 'application/json': '.json'
+}
+# 存储写入的文件名：内容的sha256加扩展名，清理时只删除这样命名的文件
+_STORED_NAME = re.compile(r'[0-9a-f]{64}(?:' + '|'.join(
+    re.escape(extension) for extension in sorted(set(_EXTENSIONS.values()) | {'.bin'})) + r')')
+
+class OutputStore:
+    """大输出存储 - 把超过阈值的输出内容移到notebook旁的内容寻址文件中，cell里只保留引用"""
+
+    METADATA_KEY = 'agentnote_offloaded'
+
+    def __init__(self, notebook_path: str, threshold: int = None):
+        path = os.path.abspath(notebook_path)
+        self.base_dir = os.path.dirname(path)
+        self.directory = os.path.splitext(path)[0] + "_outputs"
+        self.threshold = threshold if threshold is not None else config.notebook.offload_threshold_bytes
+        self._loaded = {}  # sha256 -> 内容，避免同一个导出过程中重复读取
+
+    def offload_notebook(self, nb) -> int:
+        """把notebook中超过阈值的输出移到外部文件（原地修改），返回移出的输出数量"""
+        count = 0
+        for cell in nb.cells:
+            if cell.cell_type != 'code':
+                continue
+            for output in cell.get('outputs', []):
+                if output.output_type in ('display_data', 'execute_result') and self._offload_output(output):
+                    count += 1
+        return count
+
+    def _offload_output(self, output) -> bool:
+        refs = {}
+        for mime, value in list(output.get('data', {}).items()):
+            if mime == 'text/plain':
+                continue
+            text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+            if len(text) < self.threshold:
+                continue
+            refs[mime] = self._write(mime, value)
+            del output.data[mime]
+        if not refs:
+            return False
+
+        offloaded = output.metadata.setdefault(self.METADATA_KEY, {'refs': {}})
+        offloaded['refs'].update(refs)
+        # 图片在notebook查看器中以相对路径的链接显示
+        image = next((mime for mime in refs if mime.startswith('image/')), None)
+        if image and 'text/markdown' not in output.data and 'text/html' not in output.data:
+            output.data['text/markdown'] = f"![{image}]({refs[image]['path']})"
+            offloaded['display_link'] = True
+        return True
+
+    def _write(self, mime: str, value) -> Dict[str, Any]:
+        if mime in _BINARY_MIME_TYPES:
+            content = base64.b64decode(value)
+            encoding = 'base64'
+        elif isinstance(value, str):
+            content = value.encode('utf-8')
+            encoding = 'text'
+        else:
+            content = json.dumps(value, ensure_ascii=False).encode('utf-8')
+            encoding = 'json'
+
+        digest = hashlib.sha256(content).hexdigest()
+        filename = digest + _EXTENSIONS.get(mime, '.bin')
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            # 内容寻址：相同内容只写一次
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        return {
+            'path': os.path.relpath(path, self.base_dir).replace(os.sep, '/'),
+            'sha256': digest,
+            'bytes': len(content),
+            'encoding': encoding
+        }
+
+    @classmethod
+    def is_offloaded(cls, output) -> bool:
+        return cls.METADATA_KEY in output.get('metadata', {})
+
+    def load(self, ref: Dict[str, Any]) -> Optional[Any]:
+        """读取一个引用指向的内容，恢复成notebook中的格式；文件缺失时返回None"""
+        if ref['sha256'] in self._loaded:
+            return self._loaded[ref['sha256']]
+        path = os.path.join(self.base_dir, ref['path'])
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            content = f.read()
+        if ref['encoding'] == 'base64':
+            value = base64.b64encode(content).decode('ascii')
+        elif ref['encoding'] == 'json':
+            value = json.loads(content.decode('utf-8'))
+        else:
+            value = content.decode('utf-8')
+        self._loaded[ref['sha256']] = value
+        return value
+
+    def rehydrate_output(self, output):
+        """返回内容已恢复的输出副本，原输出不变"""
+        if not self.is_offloaded(output):
+            return output
+        output = copy.deepcopy(output)
+        offloaded = output.metadata.pop(self.METADATA_KEY)
+        if offloaded.get('display_link'):
+            output.data.pop('text/markdown', None)
+        for mime, ref in offloaded['refs'].items():
+            value = self.load(ref)
+            if value is not None:
+                output.data[mime] = value
+        return output
+
+    def rehydrate_notebook(self, nb):
+        """返回所有输出都已恢复的notebook副本，可单独分发或转换为HTML"""
+        nb = copy.deepcopy(nb)
+        for cell in nb.cells:
+            if cell.cell_type == 'code':
+                cell.outputs = [self.rehydrate_output(output) for output in cell.get('outputs', [])]
+        self._loaded.clear()
+        return nb
+
+    def remove_unreferenced(self, nb) -> int:
+        """删除notebook中已不再引用的外部文件，返回删除的文件数；目录中用户自己放入的文件不受影响"""
+        if not os.path.isdir(self.directory):
+            return 0
+        referenced = set()
+        for cell in nb.cells:
+            for output in cell.get('outputs', []):
+                if self.is_offloaded(output):
+                    for ref in output.metadata[self.METADATA_KEY]['refs'].values():
+                        referenced.add(os.path.basename(ref['path']))
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name not in referenced and _STORED_NAME.fullmatch(name):
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+        return removed
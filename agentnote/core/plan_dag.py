@@ -0,0 +1,39 @@
+from typing import Dict, Any, List
+
+class PlanDAG:
+    """执行计划的依赖图 - 把步骤按依赖关系分层，同一层的步骤互不依赖"""
+
+    def __init__(self, steps: List[Dict[str, Any]]):
+        self.steps = steps
+        self.dependencies = []
+        for i, step in enumerate(steps):
+            declared = step.get('depends_on')
+            if declared is None:
+                # 没有声明依赖时保守处理：依赖前一个步骤，即顺序执行
+                deps = {i - 1} if i > 0 else set()
+            else:
+                # 只接受指向前面步骤的依赖，保证无环
+                deps = {d for d in declared if 0 <= d < i}
+            self.dependencies.append(deps)
+
+        self.levels = self._build_levels()
+
+    def _build_levels(self) -> List[List[int]]:
+        """按最长依赖路径分层，层内按步骤序号排序，得到确定的拓扑顺序"""
+        depth = []
+        for deps in self.dependencies:
+            depth.append(max((depth[d] + 1 for d in deps), default=0))
+
+        levels = [[] for _ in range(max(depth, default=-1) + 1)]
+        for i, d in enumerate(depth):
+            levels[d].append(i)
+        return levels
+
+    @property
+    def width(self) -> int:
+        """最宽一层的步骤数，即最大可并行度"""
+        return max((len(level) for level in self.levels), default=0)
+
+    def topological_order(self) -> List[int]:
+        """写入notebook的步骤顺序"""
+        return [i for level in self.levels for i in level]
@@ -0,0 +1,111 @@
+import re
+import json
+from typing import Dict, Any, List
+
+# 要求模型直接输出JSON对象（DeepSeek的JSON模式，推理模型不支持）
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+COST_LEVELS = ('low', 'medium', 'high')
+# 模型常用的其他写法
+_COST_ALIASES = {'低': 'low', '中': 'medium', '中等': 'medium', '高': 'high', 'med': 'medium', 'mid': 'medium'}
+
+_FENCED_JSON = re.compile(r'```(?:json)?\s*\n(.*?)\n?```', re.DOTALL)
+
+
+class PlanValidationError(ValueError):
+    """规划结果不是合法的JSON或不符合步骤格式"""
+
+
+def supports_json_mode(model: str) -> bool:
+    """推理模型不支持response_format，只能在提示词中要求JSON"""
+    return 'reasoner' not in (model or '')
+
+
+def parse_plan_json(content: str) -> List[Dict[str, Any]]:
+    """
+    解析并校验JSON格式的规划，返回与Markdown解析结果相同结构的步骤列表
+
+    接受 {"steps": [...]} 或直接的步骤数组，也接受包在```json代码块中的输出（推理模型不使用JSON模式时常见）。
+    每个步骤需要非空的name和description；expected_output可省略；dependencies是从1开始的前序步骤编号，
+    转换为从0开始的depends_on，指向自身或后面步骤的编号以及不是编号的值（如"无"）被忽略，省略时与Markdown规划一样
+    视为依赖前一步骤；estimated_cost规范为low/medium/high之一，无法识别的值（如"medium-high"）被忽略。
+    这两个字段只是辅助信息，写得不规范不会使整个规划被拒绝
+    """
+    data = _load_json(content)
+    steps = data.get('steps') if isinstance(data, dict) else data
+    if not isinstance(steps, list) or not steps:
+        raise PlanValidationError("缺少非空的steps数组")
+
+    parsed = []
+    for number, item in enumerate(steps, 1):
+        if not isinstance(item, dict):
+            raise PlanValidationError(f"步骤{number}不是对象")
+        step = {
+            'name': _required_text(item, 'name', number),
+            'description': _required_text(item, 'description', number),
+            'expected_output': _optional_text(item, 'expected_output', number),
+        }
+
+        dependencies = item.get('dependencies')
+        if dependencies is None:
+            parsed.append(_with_cost(step, item))
+            continue
+        if not isinstance(dependencies, list):
+            # 单个编号或 "1, 2" 这样的写法
+            dependencies = re.findall(r'\d+', dependencies) if isinstance(dependencies, str) else [dependencies]
+        depends_on = []
+        for dep in dependencies:
+            # 允许模型写成 "步骤1" 或 "1"，其他值（如 "无"）不是依赖
+            if isinstance(dep, str) and re.fullmatch(r'\D*(\d+)', dep.strip()):
+                dep = int(re.fullmatch(r'\D*(\d+)', dep.strip()).group(1))
+            if isinstance(dep, float) and dep.is_integer():
+                dep = int(dep)
+            if isinstance(dep, bool) or not isinstance(dep, int):
+                continue
+            if 1 <= dep < number and dep - 1 not in depends_on:
+                depends_on.append(dep - 1)
+        step['depends_on'] = depends_on
+        parsed.append(_with_cost(step, item))
+    return parsed
+
+
+def _with_cost(step: Dict[str, Any], item: Dict[str, Any]) -> Dict[str, Any]:
+    cost = item.get('estimated_cost')
+    if isinstance(cost, str):
+        cost = cost.strip().lower()
+        cost = _COST_ALIASES.get(cost, cost)
+        if cost in COST_LEVELS:
+            step['estimated_cost'] = cost
+    return step
+
+
+def _load_json(content: str):
+    text = (content or '').strip()
+    fenced = _FENCED_JSON.search(text)
+    if fenced and not text.startswith(('{', '[')):
+        text = fenced.group(1).strip()
+    start = min((i for i in (text.find('{'), text.find('[')) if i >= 0), default=-1)
+    if start < 0:
+        raise PlanValidationError("输出中没有JSON")
+    try:
+        # 只解析第一个JSON值，忽略前后的说明文字
+        data, _ = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError as e:
+        raise PlanValidationError(f"JSON解析失败: {e}")
+    return data
+
+
+def _required_text(item: Dict[str, Any], key: str, number: int) -> str:
+    value = _optional_text(item, key, number)
+    if not value:
+        raise PlanValidationError(f"步骤{number}缺少{key}")
+    return value
+
+
+def _optional_text(item: Dict[str, Any], key: str, number: int) -> str:
+    value = item.get(key)
+    if value is None:
+        return ''
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        raise PlanValidationError(f"步骤{number}的{key}应为字符串")
+    return str(value).strip()
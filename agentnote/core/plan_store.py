@@ -0,0 +1,252 @@
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+from .config import config
+
+# 任务描述中的ASCII词，只有像文件名、路径或含数字的才是可替换的标识符，其余词必须完全相同
+_TOKEN = re.compile(r'[A-Za-z0-9_](?:[A-Za-z0-9_.\-/]*[A-Za-z0-9_/])?')
+_FILE_EXTENSION = re.compile(r'\.[A-Za-z0-9]+$')
+_TRAILING_PUNCTUATION = '。.!！?？；;，, '
+# 中文前后的空格不影响含义
+_SPACE_AROUND_CJK = re.compile(r'\s*([\u2e80-\u9fff])\s*')
+_NON_WORD = re.compile(r'[\W_]+')
+_WORDS_AND_SLOTS = re.compile(r'[\w\x00]+')
+
+# 匹配方式
+EXACT = 'exact'          # 规范化后的任务描述相同，复用规划和代码
+TEMPLATE = 'template'    # 只有文件名等标识符不同，替换后复用规划和代码
+SIMILAR = 'similar'      # 字符n-gram的TF-IDF相似度达到阈值，只复用规划，代码重新生成
+
+
+@dataclass
+class PlanMatch:
+    key: str  # 缓存条目的键，复用失败时据此删除
+    kind: str
+    task: str  # 缓存中的原任务描述
+    steps: List[Dict[str, Any]]
+    codes: Optional[List[Optional[str]]]  # 每个步骤可直接复用的代码，None表示需要重新生成
+    similarity: float = 1.0
+
+
+class PlanStore:
+    """
+    执行计划存储 - 保存成功任务的规划、每个步骤最终执行成功的代码和运行结果，以规范化的任务描述为键
+
+    查找顺序：完全相同 -> 只有标识符不同的模板匹配（均为索引查询）-> 本地TF-IDF相似度
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None, similarity_threshold: float = None):
+        cfg = config.agent
+        self.path = path or cfg.plan_cache_path
+        self.max_entries = max_entries if max_entries is not None else cfg.plan_cache_max_entries
+        self.similarity_threshold = (similarity_threshold if similarity_threshold is not None
+                                     else cfg.plan_cache_similarity)
+        self.stats = {EXACT: 0, TEMPLATE: 0, SIMILAR: 0, 'misses': 0, 'saved': 0}
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS plans ("
+            " key TEXT PRIMARY KEY,"
+            " template_key TEXT NOT NULL,"
+            " task TEXT NOT NULL,"
+            " normalized TEXT NOT NULL,"
+            " steps TEXT NOT NULL,"
+            " codes TEXT NOT NULL,"
+            " outcome TEXT,"
+            " uses INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_plans_template ON plans(template_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_plans_last_used ON plans(last_used)")
+
+    def lookup(self, task: str) -> Optional[PlanMatch]:
+        """查找可复用的规划，未找到时返回None"""
+        normalized = normalize_task(task)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, task, steps, codes FROM plans WHERE key = ?", (_hash(normalized),)
+            ).fetchone()
+            kind, similarity = EXACT, 1.0
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT key, task, steps, codes FROM plans WHERE template_key = ?"
+                    " ORDER BY last_used DESC LIMIT 1", (_hash(_template(normalized)),)
+                ).fetchone()
+                kind = TEMPLATE
+            if row is None and self.similarity_threshold:
+                row, similarity = self._most_similar(normalized)
+                kind = SIMILAR
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute("UPDATE plans SET uses = uses + 1, last_used = ? WHERE key = ?", (time.time(), row[0]))
+            self.stats[kind] += 1
+
+        cached_task, steps, codes = row[1], json.loads(row[2]), json.loads(row[3])
+        substitutions = token_substitutions(cached_task, task)
+        if substitutions:
+            steps = [{key: _substitute(value, substitutions) if isinstance(value, str) else value
+                      for key, value in step.items()} for step in steps]
+        # 只有标识符不同、且替换的都不是纯数字时，代码才能直接复用；数字可能在代码中有别的含义
+        reusable = kind == EXACT or (kind == TEMPLATE and substitutions is not None
+                                     and all(re.search(r'[A-Za-z]', old) for old in substitutions))
+        if reusable and config.agent.plan_cache_reuse_code:
+            codes = [_substitute(code, substitutions) if code else None for code in codes]
+        else:
+            codes = None
+        return PlanMatch(row[0], kind, cached_task, steps, codes, round(similarity, 3))
+
+    def _most_similar(self, normalized: str):
+        """字符2/3-gram的TF-IDF余弦相似度，返回 (最相似的行, 相似度)，低于阈值时行为None"""
+        rows = self._conn.execute("SELECT key, normalized FROM plans").fetchall()
+        if not rows:
+            return None, 0.0
+        documents = [_ngrams(text) for _, text in rows]
+        query = _ngrams(normalized)
+        document_frequency = Counter(gram for document in documents for gram in document)
+        count = len(documents)
+
+        def weights(grams: Counter) -> Dict[str, float]:
+            return {gram: tf * (math.log((count + 1) / (document_frequency.get(gram, 0) + 1)) + 1)
+                    for gram, tf in grams.items()}
+
+        query_weights = weights(query)
+        query_norm = math.sqrt(sum(w * w for w in query_weights.values())) or 1.0
+        best_key, best = None, 0.0
+        for (key, _), document in zip(rows, documents):
+            document_weights = weights(document)
+            dot = sum(w * document_weights.get(gram, 0.0) for gram, w in query_weights.items())
+            norm = math.sqrt(sum(w * w for w in document_weights.values())) or 1.0
+            score = dot / (query_norm * norm)
+            if score > best:
+                best_key, best = key, score
+        if best_key is None or best < self.similarity_threshold:
+            return None, best
+        row = self._conn.execute("SELECT key, task, steps, codes FROM plans WHERE key = ?", (best_key,)).fetchone()
+        return row, best
+
+    def save(self, task: str, steps: List[Dict[str, Any]], codes: List[Optional[str]], outcome: Dict[str, Any] = None):
+        """保存成功任务的规划和每个步骤的代码，同一任务只保留最近一次"""
+        normalized = normalize_task(task)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO plans (key, template_key, task, normalized, steps, codes, outcome, uses,"
+                " created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET task = excluded.task, steps = excluded.steps,"
+                " codes = excluded.codes, outcome = excluded.outcome, last_used = excluded.last_used",
+                (_hash(normalized), _hash(_template(normalized)), task, normalized,
+                 json.dumps(steps, ensure_ascii=False), json.dumps(codes, ensure_ascii=False),
+                 json.dumps(outcome or {}, ensure_ascii=False), now, now)
+            )
+            self.stats['saved'] += 1
+            self._evict()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self._conn.execute(
+            "DELETE FROM plans WHERE key IN (SELECT key FROM plans ORDER BY last_used ASC LIMIT ?)",
+            (count - self.max_entries,)
+        )
+
+    def invalidate(self, key: str):
+        """删除一条规划（PlanMatch.key），如复用后执行失败"""
+        with self._lock:
+            self._conn.execute("DELETE FROM plans WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM plans")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中统计和条目数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+        lookups = sum(self.stats[kind] for kind in (EXACT, TEMPLATE, SIMILAR)) + self.stats['misses']
+        hits = lookups - self.stats['misses']
+        return dict(self.stats, hit_rate=hits / lookups if lookups else 0.0, entries=entries)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def normalize_task(task: str) -> str:
+    """统一全角半角、大小写和空白，去掉结尾的标点"""
+    text = unicodedata.normalize('NFKC', task or '').lower()
+    text = _SPACE_AROUND_CJK.sub(r'\1', ' '.join(text.split()))
+    return text.strip(_TRAILING_PUNCTUATION)
+
+
+def token_substitutions(cached_task: str, task: str) -> Optional[Dict[str, str]]:
+    """
+    两个任务只有标识符不同时，返回 {原标识符: 新标识符}（完全相同时为空字典）；结构不同时返回None
+
+    标识符从保留大小写的原文中提取，替换后的代码中文件名大小写保持正确
+    """
+    cached_text = unicodedata.normalize('NFKC', cached_task)
+    text = unicodedata.normalize('NFKC', task)
+    if _template(normalize_task(cached_text)) != _template(normalize_task(text)):
+        return None
+    substitutions = {}
+    for old, new in zip(_slots(cached_text.strip(_TRAILING_PUNCTUATION)),
+                        _slots(text.strip(_TRAILING_PUNCTUATION))):
+        if old == new:
+            continue
+        if substitutions.setdefault(old, new) != new:
+            # 同一个标识符对应了不同的新值，无法确定替换
+            return None
+    return substitutions
+
+
+def _is_slot(token: str) -> bool:
+    """文件名（带扩展名）、路径或含数字的词可以替换，普通单词不行"""
+    return '/' in token or any(c.isdigit() for c in token) or bool(_FILE_EXTENSION.search(token))
+
+
+def _slots(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text) if _is_slot(token)]
+
+
+def _template(normalized: str) -> str:
+    """标识符换成占位符，并忽略空白和标点"""
+    slotted = _TOKEN.sub(lambda match: '\x00' if _is_slot(match.group(0)) else match.group(0), normalized)
+    return ' '.join(_WORDS_AND_SLOTS.findall(slotted))
+
+
+def _substitute(text: str, substitutions: Optional[Dict[str, str]]) -> str:
+    if not substitutions or not text:
+        return text
+    pattern = re.compile(r'(?<![A-Za-z0-9_])(' + '|'.join(
+        re.escape(old) for old in sorted(substitutions, key=len, reverse=True)) + r')(?![A-Za-z0-9_])')
+    return pattern.sub(lambda match: substitutions[match.group(1)], text)
+
+
+def _ngrams(text: str) -> Counter:
+    """相似度只看文字本身，忽略空白和标点"""
+    text = _NON_WORD.sub('', text)
+    grams = Counter()
+    for n in (2, 3):
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
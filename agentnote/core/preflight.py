@@ -0,0 +1,403 @@
+import os
+import re
+import ast
+import sys
+import json
+import time
+import shutil
+import builtins
+import tempfile
+import threading
+import subprocess
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, Iterable, List, Optional, Set
+from .config import config
+
+# 执行前检查发现的问题类型
+SYNTAX_ERROR = 'syntax_error'
+MISSING_MODULE = 'missing_module'
+UNDEFINED_NAME = 'undefined_name'
+MISSING_FILE = 'missing_file'
+
+# IPython内核命名空间中预先存在的名称
+_KERNEL_NAMES = set(dir(builtins)) | {
+    'get_ipython', 'display', 'In', 'Out', 'exit', 'quit', '_', '__', '___',
+    '_i', '_ii', '_iii', '_ih', '_oh', '_dh', '__builtins__', '__class__'
+}
+# 出现这些用法时，前序cell定义了哪些名称无法静态确定，不检查未定义名称
+_DYNAMIC_NAMESPACE = re.compile(r'\b(exec|eval|globals|locals|vars|__import__)\s*\(|%run\b|%store\b|%load\b|%autoreload\b')
+# 单元内安装了包，导入检查以安装之后为准
+_INSTALL_COMMAND = re.compile(r'\b(pip|conda|mamba|uv)\b[^\n]*\binstall\b')
+
+# 读取文件的函数，第一个参数或以下关键字参数是文件路径
+_READ_FUNCTIONS = {'open', 'loadtxt', 'genfromtxt', 'load', 'imread', 'load_workbook', 'fromfile'}
+_READ_PREFIX = 'read_'
+_NOT_PATH_READERS = {'read_sql', 'read_sql_query', 'read_sql_table', 'read_clipboard', 'read_html', 'read_gbq'}
+_PATH_KEYWORDS = {'file', 'filename', 'fname', 'fp', 'path', 'filepath', 'filepath_or_buffer', 'path_or_buf', 'io'}
+
+# 在目标解释器中列出所有可导入的顶层模块，以及用于判断索引是否过期的路径修改时间；
+# pkgutil不列出没有__init__.py的命名空间包（如mpl_toolkits、google），sys.path中的目录都可以作为命名空间包导入
+_INDEX_SCRIPT = '''
+import sys, os, json, pkgutil
+modules = set(sys.builtin_module_names)
+modules.update(module.name for module in pkgutil.iter_modules())
+paths = {}
+for path in sys.path:
+    if path and os.path.isdir(path):
+        paths[os.path.abspath(path)] = os.stat(path).st_mtime_ns
+        for entry in os.scandir(path):
+            if entry.name.isidentifier() and entry.is_dir():
+                modules.add(entry.name)
+print(json.dumps({'modules': sorted(modules), 'paths': paths}))
+'''
+# 索引中没有的模块，报告前在目标解释器中确认一次（如.pth文件或导入钩子提供的模块）
+_FIND_SPEC_SCRIPT = '''
+import sys, importlib.util
+sys.exit(0 if importlib.util.find_spec(sys.argv[1]) is not None else 1)
+'''
+
+
+@dataclass
+class Diagnostic:
+    """执行前检查发现的一个问题"""
+    kind: str
+    message: str
+    line: Optional[int] = None
+    name: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class ModuleIndex:
+    """内核解释器中可导入的顶层模块索引 - 构建一次并缓存到磁盘，site-packages等目录变化时重建"""
+
+    def __init__(self, python: str, cache_file: str = None):
+        self.python = python
+        self.cache_file = cache_file or config.agent.preflight_index_file
+        self._lock = threading.Lock()
+        self._modules: Optional[Set[str]] = None
+        self._paths: Dict[str, int] = {}
+        self._unavailable = False  # 无法建立索引时不做导入检查
+        self._confirmed_missing: Set[str] = set()  # find_spec也找不到的模块
+
+    def contains(self, module: str) -> bool:
+        """模块是否可以导入；不在索引中时先检查索引是否过期（如期间安装了包）"""
+        with self._lock:
+            if self._modules is None and not self._unavailable:
+                self._load()
+            if self._unavailable or module in self._modules:
+                return True
+            if self._is_stale():
+                self._build()
+            if module in self._modules:
+                return True
+            if module not in self._confirmed_missing:
+                if self._find_spec(module):
+                    self._modules.add(module)
+                    return True
+                self._confirmed_missing.add(module)
+            return False
+
+    def _find_spec(self, module: str) -> bool:
+        try:
+            result = subprocess.run([self.python, '-c', _FIND_SPEC_SCRIPT, module], capture_output=True, timeout=30)
+        except Exception:
+            # 无法确认时按可导入处理，不阻止执行
+            return True
+        return result.returncode == 0
+
+    def invalidate(self):
+        with self._lock:
+            self._modules = None
+            self._confirmed_missing.clear()
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('python') == self.python:
+                self._modules = set(data['modules'])
+                self._paths = data['paths']
+                if not self._is_stale():
+                    return
+        except (OSError, ValueError, KeyError):
+            pass
+        self._build()
+
+    def _is_stale(self) -> bool:
+        for path, mtime in self._paths.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _build(self):
+        start = time.time()
+        try:
+            # 在内核使用的解释器中扫描，不导入任何模块
+            result = subprocess.run([self.python, '-c', _INDEX_SCRIPT], capture_output=True,
+                                    text=True, timeout=60, check=True)
+            data = json.loads(result.stdout)
+        except Exception as e:
+            print(f"建立模块索引失败，跳过导入检查: {e}")
+            self._unavailable = True
+            return
+        self._modules = set(data['modules'])
+        self._paths = data['paths']
+        print(f"模块索引: {len(self._modules)} 个模块 ({(time.time() - start) * 1000:.0f}ms)")
+        self._save()
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'python': self.python, 'modules': sorted(self._modules), 'paths': self._paths}, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            print(f"保存模块索引失败: {e}")
+
+
+class PreflightAnalyzer:
+    """
+    执行前静态检查 - 只解析一次代码，检查未安装的模块、前序cell中没有定义的名称和不存在的输入文件
+
+    只报告确定会失败的问题；无法静态判断时（动态命名空间、单元内安装包、切换工作目录等）跳过对应检查
+    """
+
+    def __init__(self, kernel_name: str = None):
+        self.module_index = get_module_index(_kernel_python(kernel_name or config.executor.kernel_name))
+        self._symbols: Dict[str, Optional[Set[str]]] = {}  # cell源码 -> 定义的名称，None表示无法确定
+
+    def analyze(self, code: str, previous_cells: Iterable[str] = (), cwd: str = None) -> List[Diagnostic]:
+        """检查一段即将执行的代码，previous_cells为内核中已执行过的cell源码"""
+        if code.lstrip().startswith('%%'):
+            # 单元魔法（%%bash、%%time等）的内容不一定是Python
+            return []
+        try:
+            tree = ast.parse(_transform_cell(code))
+        except SyntaxError as e:
+            return [Diagnostic(SYNTAX_ERROR, f"语法错误: {e.msg}", e.lineno)]
+
+        diagnostics = []
+        diagnostics += self._check_imports(tree, code, cwd)
+        previous_cells = list(previous_cells)
+        diagnostics += self._check_names(tree, code, previous_cells)
+        if cwd is not None and not any('chdir' in source for source in previous_cells + [code]):
+            diagnostics += self._check_files(tree, cwd)
+        return sorted(diagnostics, key=lambda diagnostic: diagnostic.line or 0)
+
+    def _check_imports(self, tree, code: str, cwd: str) -> List[Diagnostic]:
+        if _INSTALL_COMMAND.search(code):
+            self.module_index.invalidate()
+            return []
+        guarded = _import_guarded_nodes(tree)
+        diagnostics = []
+        reported = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                modules = [node.module]
+            else:
+                continue
+            if node in guarded:
+                continue
+            for module in modules:
+                top = module.split('.')[0]
+                if top in reported or self.module_index.contains(top) or _is_local_module(top, cwd):
+                    continue
+                reported.add(top)
+                diagnostics.append(Diagnostic(MISSING_MODULE, f"模块 '{top}' 未安装，无法导入 {module}",
+                                              node.lineno, top))
+        return diagnostics
+
+    def _check_names(self, tree, code: str, previous_cells: List[str]) -> List[Diagnostic]:
+        known = set(_KERNEL_NAMES)
+        for source in previous_cells:
+            symbols = self._cell_symbols(source)
+            if symbols is None:
+                return []
+            known |= symbols
+        if _DYNAMIC_NAMESPACE.search(code):
+            return []
+        bound = _bound_names(tree)
+        if bound is None:
+            return []
+        known |= bound
+
+        diagnostics = []
+        reported = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+                if node.id in known or node.id in reported:
+                    continue
+                reported.add(node.id)
+                diagnostics.append(Diagnostic(UNDEFINED_NAME, f"名称 '{node.id}' 未定义，前面的cell和本cell中都没有给它赋值",
+                                              node.lineno, node.id))
+        return diagnostics
+
+    def _cell_symbols(self, source: str) -> Optional[Set[str]]:
+        """已执行cell定义的名称；源码不变时复用之前的结果"""
+        if source in self._symbols:
+            return self._symbols[source]
+        if _DYNAMIC_NAMESPACE.search(source) or source.lstrip().startswith('%%'):
+            # 单元魔法（如%%capture）也可能定义名称
+            symbols = None
+        else:
+            try:
+                symbols = _bound_names(ast.parse(_transform_cell(source)))
+            except SyntaxError:
+                # 执行失败的cell没有定义任何名称
+                symbols = set()
+        if len(self._symbols) > 2000:
+            self._symbols.clear()
+        self._symbols[source] = symbols
+        return symbols
+
+    def _check_files(self, tree, cwd: str) -> List[Diagnostic]:
+        reads = []
+        others = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            path_node = _read_path_argument(node)
+            for arg in list(node.args) + [keyword.value for keyword in node.keywords]:
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str) and arg is not path_node:
+                    others.add(arg.value)
+            if path_node is not None:
+                reads.append(path_node)
+
+        diagnostics = []
+        reported = set()
+        for node in reads:
+            path = node.value
+            # 同一个路径在本cell中还被其他调用使用（如先下载或写入再读取），不检查
+            if path in others or path in reported or not _looks_like_path(path):
+                continue
+            if not os.path.exists(os.path.join(cwd, os.path.expanduser(path))):
+                reported.add(path)
+                diagnostics.append(Diagnostic(MISSING_FILE, f"文件 '{path}' 不存在（工作目录: {cwd}）",
+                                              node.lineno, path))
+        return diagnostics
+
+
+def format_diagnostics(diagnostics: List[Diagnostic]) -> str:
+    """把检查结果整理为可直接提供给模型的错误说明"""
+    lines = ["执行前检查发现以下问题（代码尚未执行）:"]
+    for diagnostic in diagnostics:
+        location = f"第{diagnostic.line}行: " if diagnostic.line else ""
+        lines.append(f"- {location}{diagnostic.message}")
+    return "\n".join(lines)
+
+
+def _transform_cell(code: str) -> str:
+    """把IPython语法（%魔法命令、!shell命令）转换为普通Python代码，行号不变"""
+    try:
+        from IPython.core.inputtransformer2 import TransformerManager
+    except ImportError:
+        return '\n'.join('' if line.lstrip()[:1] in ('%', '!') else line for line in code.split('\n'))
+    return TransformerManager().transform_cell(code)
+
+
+def _bound_names(tree) -> Optional[Set[str]]:
+    """代码在任意位置绑定的名称（不区分作用域，宁可漏报）；有 from x import * 时返回None"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == '*':
+                    return None
+                names.add(alias.asname or alias.name.split('.')[0])
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _import_guarded_nodes(tree) -> Set[ast.AST]:
+    """try块中的导入（通常有ImportError的备选方案），不检查"""
+    guarded = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Try) and node.handlers:
+            for statement in node.body:
+                guarded.update(ast.walk(statement))
+    return guarded
+
+
+def _read_path_argument(call: ast.Call) -> Optional[ast.Constant]:
+    """读取文件的调用中作为路径的字符串字面量"""
+    func = call.func
+    name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+    if name is None:
+        return None
+    if name not in _READ_FUNCTIONS and not (name.startswith(_READ_PREFIX) and name not in _NOT_PATH_READERS):
+        return None
+    if name == 'open' and not _is_read_mode(call):
+        return None
+    candidates = call.args[:1] + [keyword.value for keyword in call.keywords if keyword.arg in _PATH_KEYWORDS]
+    for arg in candidates:
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            return arg
+    return None
+
+
+def _is_read_mode(call: ast.Call) -> bool:
+    mode = call.args[1] if len(call.args) > 1 else next(
+        (keyword.value for keyword in call.keywords if keyword.arg == 'mode'), None)
+    if mode is None:
+        return True
+    return isinstance(mode, ast.Constant) and isinstance(mode.value, str) and not set(mode.value) & set('wax')
+
+
+def _looks_like_path(value: str) -> bool:
+    return (0 < len(value) < 260 and '\n' not in value and '://' not in value
+            and not set(value) & set('*?[{<'))
+
+
+def _is_local_module(name: str, cwd: Optional[str]) -> bool:
+    """内核工作目录下的模块或包"""
+    if cwd is None:
+        return False
+    return os.path.exists(os.path.join(cwd, name + '.py')) or os.path.isdir(os.path.join(cwd, name))
+
+
+def _kernel_python(kernel_name: str) -> str:
+    """内核使用的Python解释器；jupyter_client会把kernelspec中的python替换为当前解释器"""
+    try:
+        from jupyter_client.kernelspec import get_kernel_spec
+        command = get_kernel_spec(kernel_name).argv[0]
+    except Exception:
+        return sys.executable
+    if command in ('python', f'python{sys.version_info[0]}', f'python{sys.version_info[0]}.{sys.version_info[1]}'):
+        return sys.executable
+    return shutil.which(command) or command
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_module_index(python: str = None) -> ModuleIndex:
+    """获取进程内共享的模块索引，每个解释器一个"""
+    python = python or sys.executable
+    with _indexes_lock:
+        index = _indexes.get(python)
+        if index is None:
+            index = ModuleIndex(python)
+            _indexes[python] = index
+        return index
@@ -0,0 +1,223 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Tuple
+from .config import config
+
+# 错误类别
+RATE_LIMITED = 'rate_limited'  # 429，按Retry-After等待后重试
+TRANSIENT = 'transient'        # 超时、连接错误、5xx，退避后重试，计入熔断
+EMPTY = 'empty'                # 返回了空内容，退避后重试
+FATAL = 'fatal'                # 400/401/403/404等，重试也不会成功
+
+_RETRYABLE_STATUS = {408, 409, 425}
+
+
+class EmptyResponseError(Exception):
+    """API返回了空内容"""
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求被直接拒绝"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"连续失败过多，熔断中，{retry_after:.0f}秒后再试")
+        self.retry_after = retry_after
+
+
+def classify_error(error: Exception) -> Tuple[str, Optional[float]]:
+    """判断错误类别，返回 (类别, 服务端要求的等待秒数)"""
+    if isinstance(error, EmptyResponseError):
+        return EMPTY, None
+    if isinstance(error, CircuitOpenError):
+        return FATAL, error.retry_after
+
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        # openai的超时和连接错误没有状态码
+        name = type(error).__name__
+        if 'Timeout' in name or 'Connection' in name or isinstance(error, (TimeoutError, ConnectionError)):
+            return TRANSIENT, None
+        return FATAL, None
+
+    retry_after = _parse_retry_after(getattr(error, 'response', None))
+    if status == 429:
+        return RATE_LIMITED, retry_after
+    if status >= 500 or status in _RETRYABLE_STATUS:
+        return TRANSIENT, retry_after
+    return FATAL, None
+
+
+def _parse_retry_after(response) -> Optional[float]:
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """令牌桶 - 按每分钟额度匀速补充；允许预支，预支部分由后来者等待偿还"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """扣除额度，返回需要等待的秒数"""
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float, now: float):
+        """按实际用量修正预估值，amount为负表示实际用得更多"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RequestScheduler:
+    """请求调度器 - 进程内共享的限流（RPM/TPM）、指数退避和熔断"""
+
+    def __init__(self, rpm: int = None, tpm: int = None, failure_threshold: int = None,
+                 reset_timeout: float = None):
+        cfg = config.deepseek
+        rpm = cfg.rate_limit_rpm if rpm is None else rpm
+        tpm = cfg.rate_limit_tpm if tpm is None else tpm
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.failure_threshold = failure_threshold or cfg.circuit_failure_threshold
+        self.reset_timeout = reset_timeout or cfg.circuit_reset_timeout
+
+        self._lock = threading.Lock()
+        self._paused_until = 0.0  # 收到429后所有请求一起等待
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self.stats = {'requests': 0, 'throttled_seconds': 0.0, 'retries': 0,
+                      'rate_limited': 0, 'circuit_opened': 0, 'circuit_rejected': 0}
+
+    def reserve(self, estimated_tokens: int = 0) -> float:
+        """为一次请求预留额度，返回发送前需要等待的秒数；熔断时抛出CircuitOpenError"""
+        with self._lock:
+            now = time.monotonic()
+            self._check_circuit(now)
+            wait = max(0.0, self._paused_until - now)
+            if self.request_bucket is not None:
+                wait = max(wait, self.request_bucket.reserve(1, now))
+            if self.token_bucket is not None and estimated_tokens:
+                wait = max(wait, self.token_bucket.reserve(estimated_tokens, now))
+            self.stats['requests'] += 1
+            self.stats['throttled_seconds'] += wait
+            return wait
+
+    def acquire(self, estimated_tokens: int = 0):
+        """同步等待直到可以发送请求"""
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens: int = 0):
+        """异步等待直到可以发送请求"""
+        import asyncio
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _check_circuit(self, now: float):
+        if not self._open_until:
+            return
+        if now < self._open_until:
+            self.stats['circuit_rejected'] += 1
+            raise CircuitOpenError(self._open_until - now)
+        # 冷却结束，半开状态下只放行一个探测请求
+        if self._probe_in_flight:
+            self.stats['circuit_rejected'] += 1
+            raise CircuitOpenError(self.reset_timeout)
+        self._probe_in_flight = True
+
+    def record_success(self, estimated_tokens: int = 0, actual_tokens: int = None):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._open_until = 0.0
+            self._probe_in_flight = False
+            if self.token_bucket is not None and actual_tokens is not None:
+                self.token_bucket.refund(estimated_tokens - actual_tokens, time.monotonic())
+
+    def record_failure(self, kind: str, retry_after: float = None):
+        """记录失败；429暂停所有请求，连续的瞬时错误触发熔断"""
+        with self._lock:
+            now = time.monotonic()
+            if kind == RATE_LIMITED:
+                self.stats['rate_limited'] += 1
+                pause = retry_after if retry_after is not None else self.backoff_delay(0)
+                self._paused_until = max(self._paused_until, now + pause)
+            if kind != TRANSIENT:
+                self._probe_in_flight = False
+                return
+            self._consecutive_failures += 1
+            if self._probe_in_flight or self._consecutive_failures >= self.failure_threshold:
+                if not self._open_until or self._probe_in_flight:
+                    self.stats['circuit_opened'] += 1
+                    print(f"⚠️ API连续失败 {self._consecutive_failures} 次，暂停请求 {self.reset_timeout:.0f} 秒")
+                self._open_until = now + self.reset_timeout
+                self._probe_in_flight = False
+
+    def backoff_delay(self, attempt: int, retry_after: float = None) -> float:
+        """指数退避加随机抖动，服务端给出Retry-After时不早于该时间"""
+        base = config.agent.retry_delay
+        ceiling = min(config.deepseek.retry_max_delay, base * (2 ** attempt))
+        delay = random.uniform(ceiling / 2, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def note_retry(self):
+        with self._lock:
+            self.stats['retries'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            if not self._open_until:
+                state = 'closed'
+            elif now < self._open_until:
+                state = 'open'
+            else:
+                state = 'half_open'
+            return dict(self.stats, circuit=state, consecutive_failures=self._consecutive_failures)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_request_scheduler(base_url: str = None) -> RequestScheduler:
+    """获取进程内共享的调度器，访问同一个API地址的所有客户端共用限额"""
+    base_url = base_url or config.deepseek.base_url
+    with _schedulers_lock:
+        scheduler = _schedulers.get(base_url)
+        if scheduler is None:
+            scheduler = RequestScheduler()
+            _schedulers[base_url] = scheduler
+        return scheduler
@@ -0,0 +1,98 @@
+import threading
+from typing import Dict, Any, Callable, Optional
+
+class ResourceMonitor:
+    """执行期间在后台采样内核进程（含子进程）的CPU时间和内存，超出限制时回调"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.2, cpu_limit: float = 0,
+                 memory_limit: int = 0, on_limit: Callable[[str], None] = None):
+        self.interval = interval
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.on_limit = on_limit
+        self.cpu_time = None
+        self.peak_rss = None
+        self.exceeded = None  # 'cpu' / 'memory'
+        self._process = _get_process(pid)
+        self._cpu_start = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._process is None:
+            return self
+        sample = self._sample()
+        if sample is None:
+            return self
+        self._cpu_start, self.peak_rss = sample
+        self.cpu_time = 0.0
+        self._thread = threading.Thread(target=self._run, name="resource-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict[str, Any]:
+        """停止采样，返回 cpu_time(秒) 和 peak_rss(字节)；无法采样时为None"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._update()
+        return {'cpu_time': self.cpu_time, 'peak_rss': self.peak_rss}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._update():
+                return
+            if self.exceeded is not None:
+                continue
+            if self.cpu_limit and self.cpu_time > self.cpu_limit:
+                self._exceed('cpu')
+            elif self.memory_limit and self.peak_rss > self.memory_limit:
+                self._exceed('memory')
+
+    def _exceed(self, kind: str):
+        self.exceeded = kind
+        if self.on_limit is not None:
+            self.on_limit(kind)
+
+    def _update(self) -> bool:
+        sample = self._sample()
+        if sample is None:
+            return False
+        cpu, rss = sample
+        self.cpu_time = cpu - self._cpu_start
+        self.peak_rss = max(self.peak_rss, rss)
+        return True
+
+    def _sample(self):
+        """返回 (累计CPU时间, 当前RSS)，进程已退出时返回None"""
+        import psutil
+        try:
+            processes = [self._process] + self._process.children(recursive=True)
+        except psutil.Error:
+            return None
+        cpu = 0.0
+        rss = 0
+        for process in processes:
+            try:
+                times = process.cpu_times()
+                cpu += times.user + times.system
+                if process is self._process:
+                    # 已结束并被回收的子进程的CPU时间
+                    cpu += times.children_user + times.children_system
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return cpu, rss
+
+
+def _get_process(pid: Optional[int]):
+    if pid is None:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        return psutil.Process(pid)
+    except psutil.Error:
+        return None
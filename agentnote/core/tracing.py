@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import atexit
+import inspect
+import functools
+import threading
+import contextvars
+from typing import Dict, Any, List
+from .config import config
+
+# 当前线程/协程中正在进行的span，用于确定父子关系
+_current_span = contextvars.ContextVar('agentnote_current_span', default=None)
+
+
+class _NoopSpan:
+    """关闭追踪时使用的空span，所有操作都不做任何事"""
+    recording = False
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """一段计时区间，可嵌套，attrs记录令牌数、写入字节数等附加信息"""
+    recording = True
+    __slots__ = ('tracer', 'name', 'attrs', 'id', 'parent', 'task', 'thread', 'start', 'duration', '_token')
+
+    def __init__(self, tracer: 'Tracer', name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.id = None
+        self.parent = None
+        self.task = None
+        self.thread = None
+        self.start = None
+        self.duration = None
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent = parent.id if parent is not None else None
+        self.task = parent.task if parent is not None else self.tracer.current_task
+        self.id = self.tracer._next_id()
+        self.thread = threading.get_ident()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer._finish(self)
+        return False
+
+
+class Tracer:
+    """
+    轻量的span追踪 - 记录嵌套的计时区间，写入JSONL或Chrome trace文件，任务结束时打印耗时统计
+
+    关闭时span()直接返回共享的空span，几乎没有开销
+    """
+
+    def __init__(self, enabled: bool = None, output_file: str = None, trace_format: str = None):
+        cfg = config.tracing
+        self.enabled = cfg.enabled if enabled is None else enabled
+        self.output_file = output_file or cfg.output_file
+        self.format = trace_format or cfg.format
+        self.current_task = None  # 当前任务根span的id，其他线程中的span也归入该任务
+        self._lock = threading.Lock()
+        self._ids = 0
+        self._pending: List[Span] = []  # 尚未写入文件的span
+        self._task_spans: List[Span] = []  # 当前任务的span，用于统计
+        # perf_counter只用于计时，换算成墙上时间写入文件
+        self._epoch = time.time() - time.perf_counter()
+
+    def span(self, name: str, **attrs):
+        """开始一个span，用作上下文管理器"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def task(self, name: str, **attrs):
+        """任务的根span，结束时打印该任务的耗时统计"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _TaskSpan(self, name, attrs)
+
+    def _next_id(self) -> int:
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self._pending.append(span)
+            if span.task is not None:
+                self._task_spans.append(span)
+        if span.parent is None:
+            self.flush()
+
+    def flush(self):
+        """把已结束的span追加写入追踪文件"""
+        with self._lock:
+            spans, self._pending = self._pending, []
+        if not spans:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.output_file))
+            os.makedirs(directory, exist_ok=True)
+            if self.format == 'chrome':
+                self._write_chrome(spans)
+            else:
+                with open(self.output_file, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(self._to_record(span), ensure_ascii=False, default=str) + '\n'
+                                    for span in spans))
+        except OSError as e:
+            print(f"写入追踪文件失败: {e}")
+
+    def _to_record(self, span: Span) -> Dict[str, Any]:
+        return {
+            'name': span.name,
+            'id': span.id,
+            'parent': span.parent,
+            'task': span.task,
+            'thread': span.thread,
+            'start': round(self._epoch + span.start, 6),
+            'duration_ms': round(span.duration * 1000, 3),
+            'attrs': span.attrs
+        }
+
+    def _write_chrome(self, spans: List[Span]):
+        # Chrome trace的JSON数组格式允许省略结尾的]，因此可以一直追加事件
+        pid = os.getpid()
+        events = ''.join(json.dumps({
+            'name': span.name,
+            'cat': 'agentnote',
+            'ph': 'X',
+            'ts': round((self._epoch + span.start) * 1e6),
+            'dur': round(span.duration * 1e6),
+            'pid': pid,
+            'tid': span.thread,
+            'args': dict(span.attrs, id=span.id, parent=span.parent)
+        }, ensure_ascii=False, default=str) + ',\n' for span in spans)
+        new_file = not os.path.exists(self.output_file) or os.path.getsize(self.output_file) == 0
+        with open(self.output_file, 'a', encoding='utf-8') as f:
+            f.write(('[\n' if new_file else '') + events)
+
+    def summarize(self, task_id: int) -> List[Dict[str, Any]]:
+        """按span名称汇总一个任务的耗时：次数、总耗时、平均和最大耗时、令牌数和写入字节数"""
+        with self._lock:
+            spans = [span for span in self._task_spans if span.task == task_id]
+        rows = {}
+        for span in spans:
+            row = rows.setdefault(span.name, {'name': span.name, 'calls': 0, 'total': 0.0, 'max': 0.0,
+                                              'tokens': 0, 'bytes': 0})
+            row['calls'] += 1
+            row['total'] += span.duration
+            row['max'] = max(row['max'], span.duration)
+            row['tokens'] += span.attrs.get('tokens') or 0
+            row['bytes'] += span.attrs.get('bytes') or 0
+        return sorted(rows.values(), key=lambda row: row['total'], reverse=True)
+
+    def print_summary(self, task_span: Span):
+        rows = self.summarize(task_span.id)
+        total = task_span.duration or 1e-9
+        print("\n" + "=" * 96)
+        print(f"任务耗时统计 (总计 {task_span.duration:.2f}s，嵌套的阶段会重复计时)")
+        print("=" * 96)
+        print(f"{'阶段':<28}{'次数':>6}{'总耗时(s)':>12}{'平均(ms)':>12}{'最大(ms)':>12}{'占比':>8}{'令牌':>9}{'字节':>11}")
+        for row in rows:
+            print(f"{row['name']:<30}{row['calls']:>6}{row['total']:>12.3f}"
+                  f"{row['total'] / row['calls'] * 1000:>12.1f}{row['max'] * 1000:>12.1f}"
+                  f"{row['total'] / total:>9.1%}{row['tokens'] or '':>10}{row['bytes'] or '':>12}")
+        print("=" * 96 + "\n")
+
+
+class _TaskSpan(Span):
+    """任务根span：期间其他线程中没有父span的span也归入该任务"""
+    __slots__ = ('_previous_task',)
+
+    def __enter__(self):
+        super().__enter__()
+        self.task = self.id
+        self._previous_task = self.tracer.current_task
+        self.tracer.current_task = self.id
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        self.tracer.current_task = self._previous_task
+        if config.tracing.print_summary:
+            self.tracer.print_summary(self)
+        with self.tracer._lock:
+            self.tracer._task_spans = [span for span in self.tracer._task_spans if span.task != self.id]
+        return False
+
+
+def traced(name: str):
+    """把整个函数调用记录为一个span的装饰器，支持async函数"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                tracer = get_tracer()
+                if not tracer.enabled:
+                    return await func(*args, **kwargs)
+                with tracer.span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = get_tracer()
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def span(name: str, **attrs):
+    """在进程内共享的追踪器上开始一个span"""
+    return get_tracer().span(name, **attrs)
+
+
+def current_span():
+    """当前正在进行的span，用于补充附加信息；追踪关闭时返回空span"""
+    return _current_span.get() or _NOOP_SPAN
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+def get_tracer() -> Tracer:
+    """获取进程内共享的追踪器"""
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+            atexit.register(_tracer.flush)
+        return _tracer
@@ -5,11 +5,18 @@ AgentNote 主程序入口
 
 import os
 import sys
+import argparse
 from agentnote.agents.note_agent import NoteAgent
+from agentnote.agents.batch_runner import BatchRunner
+from agentnote.core.config import config
+from agentnote.core.kernel_pool import KernelPool
+from agentnote.core.metrics import get_metrics
 from agentnote.utils.config_loader import load_config_from_yaml
 
 def main():
     """主函数"""
+    args = parse_args()
+
     # 加载配置
     load_config_from_yaml("config.yaml")
     
@@ -19,12 +26,22 @@ def main():
         print("错误: 需要提供DeepSeek API密钥")
         return
     
+    if args.command == 'batch':
+        run_batch(args, api_key)
+        return
+    
+    # 创建内核池，提前预热内核
+    kernel_pool = None
+    if config.executor.mode == 'kernel' and config.executor.pool_size > 0:
+        kernel_pool = KernelPool().start()
+    
     # 创建智能体
-    agent = NoteAgent(api_key)
+    agent = NoteAgent(api_key, kernel_pool=kernel_pool)
     
     print("=== AgentNote 智能体系统 ===")
     print("输入 'quit' 或 'exit' 退出程序")
     print("输入 'status' 查看当前状态")
+    print("输入 'stats' 查看令牌用量和请求耗时")
     print("输入 'help' 查看帮助")
     print()
     
@@ -39,6 +56,9 @@ def main():
                 status = agent.get_status()
                 print(f"当前状态: {status}")
                 continue
+            elif user_input.lower() == 'stats':
+                print(get_metrics().format_stats())
+                continue
             elif user_input.lower() == 'help':
                 print_help()
                 continue
@@ -58,6 +78,40 @@ def main():
             break
         except Exception as e:
             print(f"发生错误: {e}")
+    
+    agent.close()
+    if kernel_pool is not None:
+        kernel_pool.close()
+
+def parse_args():
+    """解析命令行参数，不带子命令时进入交互模式"""
+    parser = argparse.ArgumentParser(description="AgentNote 智能体系统")
+    subparsers = parser.add_subparsers(dest='command')
+
+    batch = subparsers.add_parser('batch', help="批量运行JSONL任务文件中的任务")
+    batch.add_argument('tasks_file', help="任务文件，每行一个JSON对象，如 {\"id\": \"t1\", \"task\": \"...\"}")
+    batch.add_argument('--results', help="结果文件路径，已有结果的任务会被跳过")
+    batch.add_argument('--workers', type=int, help="并行运行的任务数")
+    batch.add_argument('--timeout', type=int, help="单个任务的超时秒数")
+    batch.add_argument('--output-dir', help="notebook和日志的输出目录")
+    batch.add_argument('--retry-failed', action='store_true', help="重新运行之前失败的任务")
+    return parser.parse_args()
+
+def run_batch(args, api_key: str):
+    """批量运行任务"""
+    runner = BatchRunner(
+        args.tasks_file,
+        api_key,
+        results_file=args.results,
+        workers=args.workers,
+        task_timeout=args.timeout,
+        output_dir=args.output_dir,
+        retry_failed=args.retry_failed
+    )
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        print("\n批处理被用户中断，重新运行同一命令可继续未完成的任务")
 
 def print_help():
     """打印帮助信息"""
@@ -65,6 +119,7 @@ def print_help():
 可用命令:
 - 直接输入任务描述: 执行自动化任务
 - status: 查看当前执行状态
+- stats: 按任务、步骤和模型查看令牌用量、缓存命中和请求耗时
 - help: 显示此帮助信息
 - quit/exit: 退出程序
 
@@ -43,6 +43,21 @@ def save_config_to_yaml(file_path: str = "config.yaml"):
                 'sleep_interval': config.notebook.sleep_interval,
                 'export_json': config.notebook.export_json,
                 'json_output_file': config.notebook.json_output_file,
+                'export_file': config.notebook.export_file,
+                'export_format': config.notebook.export_format,
+                'context_max_cells': config.notebook.context_max_cells,
+                'include_code_in_context': config.notebook.include_code_in_context,
+                'include_markdown_in_context': config.notebook.include_markdown_in_context,
+                'include_outputs_in_context': config.notebook.include_outputs_in_context,
+                'context_max_tokens': config.notebook.context_max_tokens,
+                'context_max_output_chars': config.notebook.context_max_output_chars,
+                'context_traceback_frames': config.notebook.context_traceback_frames,
+                'context_summarize_old': config.notebook.context_summarize_old,
+                'print_context': config.notebook.print_context,
+                'write_behind': config.notebook.write_behind,
+                'durability': config.notebook.durability,
+                'offload_outputs': config.notebook.offload_outputs,
+                'offload_threshold_bytes': config.notebook.offload_threshold_bytes,
             },
             'deepseek': {
                 'api_key': config.deepseek.api_key,
@@ -50,12 +65,97 @@ def save_config_to_yaml(file_path: str = "config.yaml"):
                 'model': config.deepseek.model,
                 'temperature': config.deepseek.temperature,
                 'max_tokens': config.deepseek.max_tokens,
+                'stream': config.deepseek.stream,
+                'cache_enabled': config.deepseek.cache_enabled,
+                'cache_path': config.deepseek.cache_path,
+                'cache_max_mb': config.deepseek.cache_max_mb,
+                'cache_ttl': config.deepseek.cache_ttl,
+                'cache_ignore_timestamps': config.deepseek.cache_ignore_timestamps,
+                'log_file': config.deepseek.log_file,
+                'log_async': config.deepseek.log_async,
+                'log_batch_size': config.deepseek.log_batch_size,
+                'log_flush_interval': config.deepseek.log_flush_interval,
+                'log_rotate_mb': config.deepseek.log_rotate_mb,
+                'log_rotate_interval': config.deepseek.log_rotate_interval,
+                'log_compression': config.deepseek.log_compression,
+                'log_hash_prompts': config.deepseek.log_hash_prompts,
+                'retry_max_delay': config.deepseek.retry_max_delay,
+                'rate_limit_rpm': config.deepseek.rate_limit_rpm,
+                'rate_limit_tpm': config.deepseek.rate_limit_tpm,
+                'circuit_failure_threshold': config.deepseek.circuit_failure_threshold,
+                'circuit_reset_timeout': config.deepseek.circuit_reset_timeout,
+                'http_max_connections': config.deepseek.http_max_connections,
+                'http_max_keepalive': config.deepseek.http_max_keepalive,
+                'http_keepalive_expiry': config.deepseek.http_keepalive_expiry,
+                'http2': config.deepseek.http2,
+                'connect_timeout': config.deepseek.connect_timeout,
+                'read_timeout': config.deepseek.read_timeout,
+                'write_timeout': config.deepseek.write_timeout,
+                'pool_timeout': config.deepseek.pool_timeout,
             },
             'agent': {
                 'max_retries': config.agent.max_retries,
                 'retry_delay': config.agent.retry_delay,
                 'enable_auto_fix': config.agent.enable_auto_fix,
                 'enable_execution': config.agent.enable_execution,
+                'parallel_steps': config.agent.parallel_steps,
+                'max_parallel_generations': config.agent.max_parallel_generations,
+                'speculative_prefetch': config.agent.speculative_prefetch,
+                'preflight_checks': config.agent.preflight_checks,
+                'preflight_index_file': config.agent.preflight_index_file,
+                'structured_planning': config.agent.structured_planning,
+                'plan_cache': config.agent.plan_cache,
+                'plan_cache_path': config.agent.plan_cache_path,
+                'plan_cache_similarity': config.agent.plan_cache_similarity,
+                'plan_cache_reuse_code': config.agent.plan_cache_reuse_code,
+                'plan_cache_max_entries': config.agent.plan_cache_max_entries,
+            },
+            'executor': {
+                'mode': config.executor.mode,
+                'kernel_name': config.executor.kernel_name,
+                'timeout': config.executor.timeout,
+                'startup_timeout': config.executor.startup_timeout,
+                'pool_size': config.executor.pool_size,
+                'idle_ttl': config.executor.idle_ttl,
+                'warm_imports': config.executor.warm_imports,
+                'recycle': config.executor.recycle,
+                'max_kernel_uses': config.executor.max_kernel_uses,
+                'cache_enabled': config.executor.cache_enabled,
+                'cache_dir': config.executor.cache_dir,
+                'cache_max_mb': config.executor.cache_max_mb,
+                'cache_snapshots': config.executor.cache_snapshots,
+                'cache_snapshot_max_mb': config.executor.cache_snapshot_max_mb,
+                'checkpoints': config.executor.checkpoints,
+                'checkpoint_max_count': config.executor.checkpoint_max_count,
+                'checkpoint_max_mb': config.executor.checkpoint_max_mb,
+                'cpu_time_limit': config.executor.cpu_time_limit,
+                'memory_limit_mb': config.executor.memory_limit_mb,
+                'address_space_limit_mb': config.executor.address_space_limit_mb,
+                'max_output_bytes': config.executor.max_output_bytes,
+                'monitor_interval': config.executor.monitor_interval,
+            },
+            'batch': {
+                'workers': config.batch.workers,
+                'task_timeout': config.batch.task_timeout,
+                'output_dir': config.batch.output_dir,
+                'results_file': config.batch.results_file,
+            },
+            'tracing': {
+                'enabled': config.tracing.enabled,
+                'output_file': config.tracing.output_file,
+                'format': config.tracing.format,
+                'print_summary': config.tracing.print_summary,
+            },
+            'metrics': {
+                'task_token_budget': config.metrics.task_token_budget,
+                'task_time_budget': config.metrics.task_time_budget,
+                'budget_action': config.metrics.budget_action,
+                'downgrade_model': config.metrics.downgrade_model,
+                'prices': config.metrics.prices,
+                'latency_buckets': config.metrics.latency_buckets,
+                'prometheus_file': config.metrics.prometheus_file,
+                'prometheus_port': config.metrics.prometheus_port,
+                'max_tasks': config.metrics.max_tasks,
             }
         }
         
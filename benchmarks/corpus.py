@@ -0,0 +1,143 @@
+"""
+基准测试的合成任务集
+
+每个场景是一个完整任务：规划结果和每个步骤的代码都是固定的，由模拟服务器按提示词返回，
+因此同一场景的每次运行执行完全相同的代码，耗时差异只来自AgentNote本身
+"""
+
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class Step:
+    name: str
+    description: str  # 在所有场景中唯一，模拟服务器据此找到对应的代码
+    code: str
+    failing_code: Optional[str] = None  # 第一次生成返回的会执行失败的代码，重试时返回code
+
+
+@dataclass
+class Scenario:
+    name: str
+    task: str
+    steps: List[Step] = field(default_factory=list)
+
+    def plan_markdown(self) -> str:
+        """按规划提示词要求的格式返回规划，步骤依次依赖前一步"""
+        lines = ["## 任务规划", ""]
+        for i, step in enumerate(self.steps, 1):
+            lines += [
+                f"### 步骤{i}: {step.name}",
+                f"- **描述**: {step.description}",
+                f"- **预期输出**: {step.name}的结果",
+                f"- **依赖**: {'无' if i == 1 else f'步骤{i - 1}'}",
+                ""
+            ]
+        return "\n".join(lines)
+
+    def plan_json(self) -> str:
+        """结构化规划（agent.structured_planning）要求的JSON格式"""
+        return json.dumps({'steps': [
+            {'name': step.name, 'description': step.description, 'expected_output': f"{step.name}的结果",
+             'dependencies': [] if i == 1 else [i - 1], 'estimated_cost': 'low'}
+            for i, step in enumerate(self.steps, 1)
+        ]}, ensure_ascii=False)
+
+
+def _code_response(step: Step, code: str) -> str:
+    return f"下面的代码完成「{step.name}」。\n\n```python\n{code}\n```\n\n代码会输出{step.name}的结果。"
+
+
+# 纯Python生成PNG，不依赖matplotlib；随机像素几乎无法压缩，大小接近真实图表的输出
+_PNG_HELPER = '''import base64, random, struct, zlib
+from IPython.display import display
+
+def _synthetic_png(seed, width=160, height=120):
+    rng = random.Random(seed)
+    raw = b''.join(b'\\x00' + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    png = b'\\x89PNG\\r\\n\\x1a\\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+    return base64.b64encode(png).decode('ascii')
+'''
+
+
+def _small() -> Scenario:
+    return Scenario('small', '[bench:small] 计算一组数字的统计量', [
+        Step('生成数据', 'small: 生成1到100的整数列表', "data = list(range(1, 101))\nprint(len(data))"),
+        Step('计算均值', 'small: 计算列表的均值', "mean = sum(data) / len(data)\nprint(mean)"),
+        Step('计算方差', 'small: 计算列表的方差',
+             "variance = sum((x - mean) ** 2 for x in data) / len(data)\nprint(round(variance, 2))"),
+    ])
+
+
+def _large(steps: int = 24) -> Scenario:
+    scenario = Scenario('large', '[bench:large] 逐步构建并汇总一个较大的数据表')
+    scenario.steps.append(Step('初始化', 'large: 初始化数据表', "table = {}\nprint('ready')"))
+    for i in range(1, steps):
+        # 每一步新增一列并打印约16KB的文本输出，notebook随步骤增长
+        code = (f"table['col_{i}'] = [(row * {i}) % 97 for row in range(2000)]\n"
+                f"for start in range(0, 2000, 10):\n"
+                f"    print(start, table['col_{i}'][start:start + 10])\n"
+                f"print('columns:', len(table))")
+        scenario.steps.append(Step(f'第{i}列', f'large: 计算第{i}列', code))
+    return scenario
+
+
+def _plot_heavy(steps: int = 6, images_per_step: int = 3) -> Scenario:
+    scenario = Scenario('plot_heavy', '[bench:plot_heavy] 为数据绘制多张图表')
+    scenario.steps.append(Step('准备绘图', 'plot_heavy: 准备绘图函数', _PNG_HELPER + "print('ok')"))
+    for i in range(1, steps):
+        code = (f"for k in range({images_per_step}):\n"
+                f"    display({{'image/png': _synthetic_png({i} * 100 + k)}}, raw=True)\n"
+                f"print('figures:', {images_per_step})")
+        scenario.steps.append(Step(f'图表组{i}', f'plot_heavy: 绘制第{i}组图表', code))
+    return scenario
+
+
+def _failing_retry() -> Scenario:
+    return Scenario('failing_retry', '[bench:failing_retry] 解析并汇总配置数据', [
+        Step('加载配置', 'failing_retry: 加载配置', "settings = {'size': '42', 'ratio': '0.5'}\nprint(settings)"),
+        Step('解析数值', 'failing_retry: 解析配置中的数值',
+             "size = int(settings['size'])\nratio = float(settings['ratio'])\nprint(size, ratio)",
+             failing_code="size = int(settings['ratio'])\nprint(size)"),
+        Step('计算结果', 'failing_retry: 用解析出的数值计算结果', "result = size * ratio\nprint(result)"),
+        Step('校验结果', 'failing_retry: 校验计算结果',
+             "assert result == 21.0\nprint('valid')",
+             failing_code="assert result == 20.0, f'unexpected {result}'\nprint('valid')"),
+    ])
+
+
+SCENARIOS: Dict[str, Scenario] = {scenario.name: scenario for scenario in
+                                  (_small(), _large(), _plot_heavy(), _failing_retry())}
+
+_STEP_DESCRIPTION = re.compile(r'步骤描述:\s*(.+)')
+
+
+class CorpusResponder:
+    """按提示词返回固定回答：规划请求按任务描述匹配场景，代码请求按步骤描述匹配步骤"""
+
+    def __init__(self, scenarios: Dict[str, Scenario] = None):
+        scenarios = scenarios or SCENARIOS
+        self.tasks = {scenario.task: scenario for scenario in scenarios.values()}
+        self.steps = {step.description: step for scenario in scenarios.values() for step in scenario.steps}
+
+    def __call__(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+        for task, scenario in self.tasks.items():
+            if task in user_prompt and '步骤描述' not in user_prompt:
+                return scenario.plan_json() if 'JSON' in system_prompt else scenario.plan_markdown()
+        match = _STEP_DESCRIPTION.search(user_prompt)
+        if match is None:
+            return None
+        step = self.steps.get(match.group(1).strip())
+        if step is None:
+            return None
+        # 重试时提示词中带有上次的错误信息
+        retrying = '之前的执行错误' in user_prompt
+        if step.failing_code is not None and not retrying:
+            return _code_response(step, step.failing_code)
+        return _code_response(step, step.code)
@@ -0,0 +1,144 @@
+"""
+本地的OpenAI兼容模拟服务器
+
+实现 /v1/chat/completions（普通和流式响应），按提示词返回预设回答并模拟固定延迟，
+基准测试无需网络和API密钥。也可以单独运行：
+
+    python -m benchmarks.mock_llm_server --port 8000 --latency 0.2
+"""
+
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Optional
+
+from benchmarks.corpus import CorpusResponder
+
+_STREAM_CHUNK_CHARS = 64
+
+
+class MockLLMServer:
+    """在后台线程中运行的模拟服务器，responder(system_prompt, user_prompt) 返回回答内容，None表示无法识别的请求"""
+
+    def __init__(self, responder: Callable[[str, str], Optional[str]] = None, latency: float = 0.05,
+                 chars_per_second: float = 0, host: str = '127.0.0.1', port: int = 0):
+        self.responder = responder or CorpusResponder()
+        self.latency = latency
+        self.chars_per_second = chars_per_second  # 大于0时按回答长度增加生成耗时
+        self.stats = {'requests': 0, 'stream_requests': 0, 'unmatched': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> 'MockLLMServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-llm-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive连接，与真实API一样可以被客户端连接池复用
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    return self._send_json(404, {'error': {'message': f'未知路径 {self.path}'}})
+                server._count('requests')
+
+                messages = body.get('messages', [])
+                system_prompt = next((m['content'] for m in messages if m['role'] == 'system'), '')
+                user_prompt = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+                content = server.responder(system_prompt, user_prompt)
+                if content is None:
+                    server._count('unmatched')
+                    return self._send_json(400, {'error': {'message': '模拟服务器无法识别该请求'}})
+
+                delay = server.latency
+                if server.chars_per_second > 0:
+                    delay += len(content) / server.chars_per_second
+                time.sleep(delay)
+
+                model = body.get('model', 'mock-model')
+                usage = {
+                    'prompt_tokens': (len(system_prompt) + len(user_prompt)) // 4,
+                    'completion_tokens': len(content) // 4,
+                }
+                usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+                if body.get('stream'):
+                    server._count('stream_requests')
+                    return self._send_stream(model, content, usage)
+                self._send_json(200, {
+                    'id': 'mock', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                    'usage': usage
+                })
+
+            def _send_stream(self, model: str, content: str, usage: dict):
+                def chunk(choices, **extra):
+                    data = {'id': 'mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                            'model': model, 'choices': choices, **extra}
+                    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+                events = [chunk([{'index': 0, 'delta': {'role': 'assistant', 'content': content[i:i + _STREAM_CHUNK_CHARS]},
+                                  'finish_reason': None}])
+                          for i in range(0, len(content), _STREAM_CHUNK_CHARS)]
+                events.append(chunk([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+                events.append(chunk([], usage=usage))
+                events.append("data: [DONE]\n\n")
+                self._send(200, ''.join(events).encode('utf-8'), 'text/event-stream')
+
+            def _send_json(self, status: int, data: dict):
+                self._send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+            def _send(self, status: int, payload: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AgentNote基准测试用的OpenAI兼容模拟服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求的固定延迟(秒)')
+    parser.add_argument('--chars-per-second', type=float, default=0, help='按回答长度增加的生成耗时，0表示不增加')
+    args = parser.parse_args()
+
+    server = MockLLMServer(latency=args.latency, chars_per_second=args.chars_per_second,
+                           host=args.host, port=args.port).start()
+    print(f"模拟服务器已启动: {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
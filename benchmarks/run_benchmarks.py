@@ -0,0 +1,347 @@
+"""
+AgentNote端到端基准测试
+
+对每个合成场景（benchmarks/corpus.py）在独立子进程中运行完整的NoteAgent任务，API请求发往本地模拟服务器，
+通过追踪记录统计各阶段耗时、每分钟完成的步骤数、内存峰值和notebook读写字节数，并与保存的基线比较。
+
+    python -m benchmarks.run_benchmarks                      # 运行全部场景并与基线比较
+    python -m benchmarks.run_benchmarks --save-baseline      # 把本次结果保存为基线
+    python -m benchmarks.run_benchmarks -s small,large --repeat 3 --set executor.mode=replay
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, List
+
+import yaml
+
+from benchmarks.corpus import SCENARIOS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# 与基线比较的指标：(名称, 越小越好, 变化小于该绝对值时不算退化)
+_COMPARED_METRICS = [
+    ('wall_time_s', True, 0.05),
+    ('steps_per_min', False, 1.0),
+    ('notebook_io_bytes', True, 4096),
+    ('agent_peak_rss_mb', True, 5.0),
+    ('kernel_peak_rss_mb', True, 5.0),
+]
+# 阶段耗时只比较执行器和持久化相关的部分，LLM延迟由模拟服务器决定
+_COMPARED_PHASES = ('executor.execute', 'kernel.execute', 'executor.sync_state', 'executor.nbconvert',
+                    'notebook.save', 'notebook.load', 'build_context', 'parse_content', 'preflight', 'export_cells')
+_PHASE_MIN_DELTA = 0.02
+
+
+def run_scenario(name: str, base_url: str, workdir: str, overrides: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """在当前进程中运行一个场景，返回指标（由子进程调用，保证各场景的全局状态和内存峰值互不影响）"""
+    from agentnote.core.config import config
+    scenario = SCENARIOS[name]
+
+    config.deepseek.base_url = base_url
+    config.deepseek.cache_enabled = False
+    config.deepseek.log_file = os.path.join(workdir, 'api_calls.jsonl')
+    config.notebook.sleep_interval = 0
+    config.notebook.export_file = os.path.join(workdir, 'cells.jsonl')
+    config.notebook.json_output_file = os.path.join(workdir, 'cells.json')
+    config.executor.cache_dir = os.path.join(workdir, 'exec_cache')
+    config.agent.preflight_index_file = os.path.join(os.path.dirname(workdir), 'module_index.json')
+    config.tracing.enabled = True
+    config.tracing.format = 'jsonl'
+    config.tracing.output_file = os.path.join(workdir, 'trace.jsonl')
+    config.tracing.print_summary = False
+    config.update_from_dict(overrides)
+
+    from agentnote.agents.note_agent import NoteAgent
+    from agentnote.core.kernel_pool import KernelPool
+    import nbformat as nbf
+
+    notebook_path = os.path.join(workdir, f'{name}.ipynb')
+    start = time.perf_counter()
+    pool = None
+    if config.executor.mode == 'kernel' and config.executor.pool_size > 0:
+        pool = KernelPool().start()
+    agent = NoteAgent('benchmark', kernel_pool=pool, notebook_path=notebook_path, workdir=workdir)
+    try:
+        success = agent.run_task(scenario.task)
+        completed = agent.current_step
+        usage = dict(agent.client.usage_totals)
+    finally:
+        agent.close()
+        if pool is not None:
+            pool.close()
+    wall_time = time.perf_counter() - start
+
+    phases = _aggregate_trace(config.tracing.output_file)
+    task_time = phases.get('run_task', {}).get('total_s', wall_time)
+    nb = nbf.read(notebook_path, as_version=4)
+    kernel_peaks = [cell.metadata.get('resources', {}).get('peak_rss') or 0
+                    for cell in nb.cells if cell.cell_type == 'code']
+    io_phases = [phases.get(phase, {}) for phase in ('notebook.save', 'notebook.load')]
+    return {
+        'success': bool(success),
+        'steps': len(scenario.steps),
+        'completed_steps': completed,
+        'wall_time_s': round(wall_time, 4),
+        'task_time_s': round(task_time, 4),
+        'steps_per_min': round(completed / task_time * 60, 2) if task_time else 0.0,
+        'llm_requests': usage['requests'],
+        'llm_tokens': usage['total_tokens'],
+        'failed_executions': phases.get('executor.execute', {}).get('failed', 0),
+        'notebook_writes': io_phases[0].get('calls', 0),
+        'notebook_io_bytes': sum(phase.get('bytes', 0) for phase in io_phases),
+        'notebook_bytes': os.path.getsize(notebook_path),
+        'agent_peak_rss_mb': round(_peak_rss_bytes() / 2 ** 20, 1),
+        'kernel_peak_rss_mb': round(max(kernel_peaks, default=0) / 2 ** 20, 1),
+        'phases': phases
+    }
+
+
+def _aggregate_trace(path: str) -> Dict[str, Dict[str, Any]]:
+    phases = {}
+    if not os.path.exists(path):
+        return phases
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            phase = phases.setdefault(record['name'], {'calls': 0, 'total_s': 0.0, 'bytes': 0, 'failed': 0})
+            phase['calls'] += 1
+            phase['total_s'] += record['duration_ms'] / 1000
+            phase['bytes'] += record['attrs'].get('bytes') or 0
+            if record['attrs'].get('success') is False:
+                phase['failed'] += 1
+    for phase in phases.values():
+        phase['total_s'] = round(phase['total_s'], 4)
+    return phases
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_suite(names: List[str], latency: float, repeat: int, overrides: Dict[str, Dict[str, Any]],
+              verbose: bool = False) -> Dict[str, Dict[str, Any]]:
+    """启动模拟服务器，逐个场景在子进程中运行repeat次，返回每个场景各项指标的中位数"""
+    from benchmarks.mock_llm_server import MockLLMServer
+
+    server = MockLLMServer(latency=latency).start()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix='agentnote_bench_') as root:
+            _build_module_index(root, overrides)
+            for name in names:
+                runs = []
+                for i in range(repeat):
+                    workdir = os.path.join(root, f'{name}_{i}')
+                    os.makedirs(workdir)
+                    print(f"运行场景 {name} ({i + 1}/{repeat})...", flush=True)
+                    runs.append(_run_worker(name, server.base_url, workdir, overrides, verbose))
+                results[name] = _median_result(runs)
+    finally:
+        server.stop()
+    return results
+
+
+def _build_module_index(root: str, overrides: Dict[str, Dict[str, Any]]):
+    """预先建立执行前检查用的模块索引，避免计入第一个场景的耗时"""
+    from agentnote.core.config import config
+    config.update_from_dict(overrides)
+    if not config.agent.preflight_checks:
+        return
+    from agentnote.core.preflight import PreflightAnalyzer
+    config.agent.preflight_index_file = os.path.join(root, 'module_index.json')
+    PreflightAnalyzer().module_index.contains('os')
+
+
+def _run_worker(name: str, base_url: str, workdir: str, overrides: Dict[str, Dict[str, Any]],
+                verbose: bool) -> Dict[str, Any]:
+    result_file = os.path.join(workdir, 'result.json')
+    command = [sys.executable, '-m', 'benchmarks.run_benchmarks', '--worker', name,
+               '--base-url', base_url, '--workdir', workdir, '--overrides-json', json.dumps(overrides)]
+    process = subprocess.run(command, cwd=ROOT, capture_output=not verbose, text=True)
+    if process.returncode != 0 or not os.path.exists(result_file):
+        output = (process.stdout or '') + (process.stderr or '')
+        print(f"场景 {name} 运行失败 (退出码 {process.returncode})\n{output[-3000:]}")
+        return {'success': False, 'error': f'exit code {process.returncode}'}
+    with open(result_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _median_result(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    valid = [run for run in runs if 'error' not in run]
+    if not valid:
+        return runs[0]
+    result = dict(valid[0])
+    result['success'] = all(run['success'] for run in runs)
+    result['runs'] = len(runs)
+    for key, value in valid[0].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[key] = statistics.median(run[key] for run in valid)
+    result['phases'] = {}
+    for phase in valid[0]['phases']:
+        samples = [run['phases'][phase] for run in valid if phase in run['phases']]
+        result['phases'][phase] = {key: statistics.median(sample[key] for sample in samples)
+                                   for key in samples[0]}
+    return result
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """与基线比较，返回变差超过tolerance（相对比例）且超过绝对阈值的指标"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None or 'error' in result:
+            continue
+        checks = [(metric, result.get(metric), base.get(metric), lower, min_delta)
+                  for metric, lower, min_delta in _COMPARED_METRICS]
+        checks += [(f'phase:{phase}', result['phases'].get(phase, {}).get('total_s'),
+                    base.get('phases', {}).get(phase, {}).get('total_s'), True, _PHASE_MIN_DELTA)
+                   for phase in _COMPARED_PHASES]
+        for metric, current, previous, lower_is_better, min_delta in checks:
+            if current is None or previous is None:
+                continue
+            worse = current - previous if lower_is_better else previous - current
+            if worse > min_delta and worse > abs(previous) * tolerance:
+                regressions.append({
+                    'scenario': name, 'metric': metric, 'baseline': previous, 'current': current,
+                    'change': (current - previous) / previous if previous else float('inf')
+                })
+    return regressions
+
+
+def print_report(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any] = None,
+                 regressions: List[Dict[str, Any]] = None):
+    print("\n" + "=" * 110)
+    print(f"{'场景':<14}{'成功':>4}{'步骤':>7}{'耗时(s)':>10}{'步骤/分钟':>10}{'LLM(s)':>9}{'执行(s)':>9}"
+          f"{'读写(s)':>9}{'读写(KB)':>10}{'notebook(KB)':>13}{'峰值MB':>8}{'内核MB':>8}")
+    print("-" * 110)
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<16}运行失败: {result['error']}")
+            continue
+        phases = result['phases']
+        io_time = sum(phases.get(phase, {}).get('total_s', 0) for phase in ('notebook.save', 'notebook.load'))
+        print(f"{name:<16}{'✓' if result['success'] else '✗':>4}"
+              f"{result['completed_steps']:>5}/{result['steps']:<3}{result['wall_time_s']:>9.2f}"
+              f"{result['steps_per_min']:>12.1f}{phases.get('llm.generate', {}).get('total_s', 0):>9.2f}"
+              f"{phases.get('executor.execute', {}).get('total_s', 0):>9.2f}{io_time:>9.3f}"
+              f"{result['notebook_io_bytes'] / 1024:>10.0f}{result['notebook_bytes'] / 1024:>13.0f}"
+              f"{result['agent_peak_rss_mb']:>10.1f}{result['kernel_peak_rss_mb']:>9.1f}")
+    print("=" * 110)
+
+    for name, result in results.items():
+        if 'error' in result:
+            continue
+        print(f"\n{name} 各阶段耗时:")
+        ranked = sorted(result['phases'].items(), key=lambda item: item[1]['total_s'], reverse=True)
+        for phase, stats in ranked[:12]:
+            base = ((baseline or {}).get('scenarios', {}).get(name, {}).get('phases', {})
+                    .get(phase, {}).get('total_s'))
+            change = f"  (基线 {base:.3f}s)" if base is not None else ""
+            print(f"  {phase:<26}{stats['calls']:>6} 次{stats['total_s']:>10.3f}s{change}")
+
+    if baseline is None:
+        return
+    if regressions:
+        print(f"\n⚠️ 与基线（{baseline.get('created', '?')}）相比发现 {len(regressions)} 项退化:")
+        for item in regressions:
+            print(f"  {item['scenario']:<14}{item['metric']:<30}{item['baseline']:>12} -> {item['current']:<12}"
+                  f"{item['change']:+.1%}")
+    else:
+        print(f"\n✅ 与基线（{baseline.get('created', '?')}）相比没有退化")
+
+
+def _parse_overrides(items: List[str]) -> Dict[str, Dict[str, Any]]:
+    """--set section.key=value，value按YAML解析"""
+    overrides = {}
+    for item in items or []:
+        key, _, value = item.partition('=')
+        section, _, field = key.partition('.')
+        if not field:
+            raise SystemExit(f"无效的配置覆盖: {item}（格式为 section.key=value）")
+        overrides.setdefault(section, {})[field] = yaml.safe_load(value)
+    return overrides
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="AgentNote端到端基准测试（使用本地模拟LLM服务器，无需网络）")
+    parser.add_argument('-s', '--scenarios', default=','.join(SCENARIOS),
+                        help=f"逗号分隔的场景名（可选: {', '.join(SCENARIOS)}）")
+    parser.add_argument('--latency', type=float, default=0.05, help='模拟API的每请求延迟(秒)')
+    parser.add_argument('--repeat', type=int, default=1, help='每个场景运行次数，取中位数')
+    parser.add_argument('--set', dest='overrides', action='append', metavar='SECTION.KEY=VALUE',
+                        help='覆盖配置项，如 executor.mode=replay，可重复')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对退化比例')
+    parser.add_argument('--output', help='把本次结果写入JSON文件')
+    parser.add_argument('-v', '--verbose', action='store_true', help='显示智能体的输出')
+    # 内部使用：子进程中运行单个场景
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--overrides-json', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        result = run_scenario(args.worker, args.base_url, args.workdir, json.loads(args.overrides_json or '{}'))
+        with open(os.path.join(args.workdir, 'result.json'), 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return 0
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"未知场景: {', '.join(unknown)}")
+        return 2
+    overrides = _parse_overrides(args.overrides)
+    results = run_suite(names, args.latency, max(1, args.repeat), overrides, args.verbose)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('latency') != args.latency or baseline.get('overrides', {}) != overrides:
+            print("⚠️ 基线的模拟延迟或配置覆盖与本次不同，比较结果仅供参考")
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    print_report(results, baseline, regressions)
+    if baseline is None and not args.save_baseline:
+        print("\n没有基线，使用 --save-baseline 保存本次结果作为基线")
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency': args.latency,
+        'overrides': overrides,
+        'scenarios': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(report, regressions=regressions), f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到: {args.baseline}")
+
+    failed = [name for name, result in results.items() if not result.get('success')]
+    return 1 if regressions or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
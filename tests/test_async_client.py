@@ -0,0 +1,33 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+from benchmarks.mock_llm_server import MockLLMServer
+from agentnote.core.config import config
+from agentnote.core.deepseek_client import AsyncDeepSeekClient
+
+
+class AsyncClientEventLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockLLMServer(responder=lambda system, user: "```python\nx = 1\n```", latency=0).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (config.deepseek.base_url, config.deepseek.cache_enabled, config.deepseek.log_file)
+        config.deepseek.base_url, config.deepseek.cache_enabled = self.server.base_url, False
+        config.deepseek.log_file = os.path.join(self.tmp.name, "api_log.jsonl")
+
+    def tearDown(self):
+        config.deepseek.base_url, config.deepseek.cache_enabled, config.deepseek.log_file = self.saved
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def test_client_can_be_used_from_successive_event_loops(self):
+        client = AsyncDeepSeekClient('test-key')
+        for _ in range(2):
+            content = asyncio.run(client.generate_content("system", "user"))
+            self.assertEqual(content, "```python\nx = 1\n```")
+        self.assertEqual(self.server.stats['requests'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
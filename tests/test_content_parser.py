@@ -0,0 +1,45 @@
+import unittest
+
+from agentnote.core.content_parser import ContentParser, FenceTokenizer
+
+
+class ExtractPythonCodeTest(unittest.TestCase):
+    def test_fence_after_text_on_the_same_line(self):
+        code, markdown = ContentParser.extract_python_code('说明 ```python\nx=1\n```')
+        self.assertEqual(code, 'x=1')
+        self.assertEqual(markdown, '说明')
+
+    def test_untagged_block_is_not_code_when_a_python_block_exists(self):
+        code, markdown = ContentParser.extract_python_code('```\nout\n```\n```python\ny=2\n```')
+        self.assertEqual(code, 'y=2')
+        self.assertIn('out', markdown)
+
+    def test_untagged_block_is_code_when_nothing_is_tagged(self):
+        code, _ = ContentParser.extract_python_code('```\nz=3\n```')
+        self.assertEqual(code, 'z=3')
+
+    def test_only_the_first_of_alternative_python_blocks_is_code(self):
+        code, markdown = ContentParser.extract_python_code('方法一\n```python\na=1\n```\n方法二\n```python\nb=2\n```')
+        self.assertEqual(code, 'a=1')
+        self.assertIn('b=2', markdown)
+
+    def test_inline_triple_backticks_in_text_do_not_open_a_block(self):
+        code, markdown = ContentParser.extract_python_code('用 ``` 包裹\n```python\nq=1\n```')
+        self.assertEqual(code, 'q=1')
+        self.assertEqual(markdown, '用 ``` 包裹')
+
+
+class FenceTokenizerTest(unittest.TestCase):
+    def test_blocks_are_reported_while_streaming(self):
+        blocks = []
+        tokenizer = FenceTokenizer(blocks.append)
+        content = '```\nout\n```\n说明 ```python\nx=1\n```\n'
+        for char in content:
+            tokenizer.feed(char)
+        tokenizer.close()
+        self.assertEqual([(block.language, block.text) for block in blocks], [('', 'out\n'), ('python', 'x=1\n')])
+        self.assertEqual(tokenizer.first_python_block.text, 'x=1\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
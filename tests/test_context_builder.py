@@ -0,0 +1,30 @@
+import unittest
+
+import nbformat
+
+from agentnote.core.config import config
+from agentnote.core.context_builder import NotebookContextBuilder
+
+
+class ContextSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (config.notebook.context_max_cells, config.notebook.context_summarize_old)
+        config.notebook.context_max_cells, config.notebook.context_summarize_old = 1, True
+
+    def tearDown(self):
+        config.notebook.context_max_cells, config.notebook.context_summarize_old = self.saved
+
+    def test_summary_status_follows_execution_count(self):
+        nb = nbformat.v4.new_notebook()
+        nb.cells.append(nbformat.v4.new_code_cell("x = 1"))
+        nb.cells.append(nbformat.v4.new_code_cell("y = 2"))
+        builder = NotebookContextBuilder()
+        self.assertIn("[未执行]: x = 1", builder.build(nb))
+
+        # 执行成功但没有输出，只有执行计数变化
+        nb.cells[0].execution_count = 1
+        self.assertIn("[成功]: x = 1", builder.build(nb))
+
+
+if __name__ == '__main__':
+    unittest.main()
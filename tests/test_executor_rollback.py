@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+import nbformat
+
+from agentnote.core.config import config
+from agentnote.core.executor import NotebookExecutor
+from agentnote.core.notebook_manager import NotebookManager
+
+
+class CheckpointRollbackTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (config.executor.mode, config.executor.checkpoints, config.executor.cache_enabled)
+        config.executor.mode, config.executor.checkpoints, config.executor.cache_enabled = 'kernel', True, False
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = NotebookManager(os.path.join(self.tmp.name, "rollback.ipynb"))
+        self.nb = nbformat.v4.new_notebook()
+        self.executor = NotebookExecutor(self.manager)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.executor._clear_checkpoints()
+        config.executor.mode, config.executor.checkpoints, config.executor.cache_enabled = self.saved
+        self.tmp.cleanup()
+
+    def _run(self, code):
+        self.manager.add_code_cell(self.nb, code)
+        return self.executor.execute_single_cell(code, len(self.nb.cells) - 1, nb=self.nb)
+
+    def test_underscore_names_survive_rollback(self):
+        self.assertTrue(self._run("_offset = 40\n_rows = [1, 2]")['success'])
+        failed = self._run("_offset = None\n_rows.clear()\nraise ValueError('失败')")
+        self.assertFalse(failed['success'])
+        retry = self._run("print(_offset + len(_rows))")
+        self.assertTrue(retry['success'], retry['error'])
+        self.assertEqual(retry['stdout'].strip(), '42')
+
+    def test_underscore_function_survives_rollback(self):
+        self.assertTrue(self._run("def _helper(value):\n    return value * 2")['success'])
+        self.assertTrue(self._run("x = 21")['success'])
+        self.assertFalse(self._run("x = None\nraise RuntimeError('失败')")['success'])
+        retry = self._run("print(_helper(x))")
+        self.assertTrue(retry['success'], retry['error'])
+        self.assertEqual(retry['stdout'].strip(), '42')
+
+
+if __name__ == '__main__':
+    unittest.main()
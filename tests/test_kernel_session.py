@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+from agentnote.core.kernel_session import KernelSession
+
+
+class NamespaceSnapshotTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.session = KernelSession(cwd=cls.tmp.name).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.shutdown()
+        cls.tmp.cleanup()
+
+    def _output(self, code):
+        result = self.session.execute(code)
+        self.assertEqual(result['status'], 'ok', result['stderr'])
+        return result['stdout'].strip()
+
+    def test_underscore_names_are_saved_and_restored(self):
+        self._output("_df = [1, 2, 3]\nclass _Config:\n    pass\n_config = _Config()\n1 + 1")
+        path = os.path.join(self.tmp.name, "snapshot.pkl")
+        info = self.session.save_namespace(path)
+        self.assertIsNotNone(info)
+        # 用pickle时__main__中定义的类的实例无法恢复，必须报告为skipped而不是悄悄丢掉
+        if info['serializer'] == 'pickle':
+            self.assertIn('_config', info['skipped'])
+        # IPython的输出历史（_、_2等）不是用户变量
+        self.assertFalse({'_', '__', '_2', '_i', '_ih'} & set(info['skipped']))
+
+        self.session.reset()
+        self.assertTrue(self.session.load_namespace(path, info['serializer']))
+        self.assertEqual(self._output("print(_df)"), '[1, 2, 3]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.mock_llm_server import MockLLMServer
+from benchmarks.run_benchmarks import run_scenario
+from agentnote.core.config import config
+
+
+class LLMCacheReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = config.to_dict()
+        self.server = MockLLMServer(latency=0).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.overrides = {
+            'deepseek': {'cache_enabled': True, 'cache_path': os.path.join(self.tmp.name, 'llm.sqlite')},
+            'agent': {'plan_cache': False},
+        }
+
+    def tearDown(self):
+        config.update_from_dict(self.saved)
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def _run(self, name):
+        workdir = os.path.join(self.tmp.name, name)
+        os.makedirs(workdir)
+        return run_scenario('small', self.server.base_url, workdir, self.overrides)
+
+    def test_replayed_task_sends_no_requests(self):
+        self.assertTrue(self._run('first')['success'])
+        first_requests = self.server.stats['requests']
+        self.assertGreater(first_requests, 0)
+        self.assertTrue(self._run('second')['success'])
+        self.assertEqual(self.server.stats['requests'], first_requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
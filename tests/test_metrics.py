@@ -0,0 +1,45 @@
+import unittest
+
+from agentnote.core.config import config
+from agentnote.core.metrics import MetricsRegistry, BudgetExceededError
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (config.metrics.max_tasks, config.metrics.task_token_budget,
+                      config.metrics.budget_action, config.metrics.downgrade_model)
+        self.metrics = MetricsRegistry()
+
+    def tearDown(self):
+        (config.metrics.max_tasks, config.metrics.task_token_budget,
+         config.metrics.budget_action, config.metrics.downgrade_model) = self.saved
+
+    def _run_task(self, description, tokens=15):
+        with self.metrics.task(description):
+            with self.metrics.step(1):
+                self.metrics.record_request('deepseek-chat', {'prompt_tokens': 10, 'completion_tokens': 5,
+                                                              'total_tokens': tokens}, 0.2)
+
+    def test_only_recent_tasks_are_kept_and_counters_have_no_task_label(self):
+        config.metrics.max_tasks = 2
+        for i in range(5):
+            self._run_task(f"任务 {i}")
+        self.assertIsNone(self.metrics.task_usage('t1'))
+        self.assertEqual(self.metrics.task_usage('t5')['requests'], 1)
+        text = self.metrics.render_prometheus()
+        self.assertIn('agentnote_llm_requests_total{step="1",model="deepseek-chat"} 5', text)
+        self.assertNotIn('description=', text)
+        self.assertNotIn('task="t1"', text)
+
+    def test_downgrade_without_model_aborts(self):
+        config.metrics.task_token_budget = 100
+        config.metrics.budget_action = 'downgrade'
+        config.metrics.downgrade_model = ''
+        with self.metrics.task("超出预算"):
+            self.metrics.record_request('deepseek-chat', {'total_tokens': 150})
+            with self.assertRaises(BudgetExceededError):
+                self.metrics.enforce_budget()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.mock_llm_server import MockLLMServer
+from agentnote.agents.note_agent import NoteAgent
+from agentnote.core.config import config
+from agentnote.core.metrics import get_metrics
+
+
+class GenerateCodeStepTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = config.to_dict()
+        self.server = MockLLMServer(responder=lambda system, user: "```python\nx = 1\n```", latency=0).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        config.deepseek.base_url, config.deepseek.cache_enabled = self.server.base_url, False
+        config.deepseek.log_file = os.path.join(self.tmp.name, "api_log.jsonl")
+        self.agent = NoteAgent('test-key', notebook_path=os.path.join(self.tmp.name, "steps.ipynb"),
+                               workdir=self.tmp.name)
+
+    def tearDown(self):
+        self.agent.close()
+        config.update_from_dict(self.saved)
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def test_identical_steps_are_attributed_to_their_own_index(self):
+        step = {'title': '打印', 'description': '打印x'}
+        self.agent.execution_plan = [dict(step), dict(step)]
+        metrics = get_metrics()
+        with metrics.task("相同的步骤") as task_id:
+            success, _, code = self.agent._generate_code(self.agent.execution_plan[1], 1, "", 0)
+        self.assertTrue(success)
+        self.assertEqual(code.strip(), "x = 1")
+        self.assertEqual([row['step'] for row in metrics.get_stats(task_id)], ['2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
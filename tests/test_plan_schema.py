@@ -0,0 +1,25 @@
+import unittest
+
+from agentnote.core.plan_schema import parse_plan_json, PlanValidationError
+
+
+class ParsePlanJsonTest(unittest.TestCase):
+    def test_unrecognized_cost_is_dropped_and_aliases_are_normalized(self):
+        steps = parse_plan_json('{"steps": [{"name": "读取", "description": "读取数据", "estimated_cost": "中"},'
+                                ' {"name": "建模", "description": "训练模型", "estimated_cost": "medium-high"}]}')
+        self.assertEqual(steps[0]['estimated_cost'], 'medium')
+        self.assertNotIn('estimated_cost', steps[1])
+
+    def test_non_numeric_dependencies_are_ignored(self):
+        steps = parse_plan_json('[{"name": "读取", "description": "读取数据", "dependencies": ["无"]},'
+                                ' {"name": "汇总", "description": "汇总结果", "dependencies": ["步骤1", "无"]}]')
+        self.assertEqual(steps[0]['depends_on'], [])
+        self.assertEqual(steps[1]['depends_on'], [0])
+
+    def test_missing_description_still_rejects_the_plan(self):
+        with self.assertRaises(PlanValidationError):
+            parse_plan_json('{"steps": [{"name": "读取"}]}')
+
+
+if __name__ == '__main__':
+    unittest.main()
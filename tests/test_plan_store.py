@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from agentnote.core.plan_store import PlanStore, token_substitutions, EXACT, TEMPLATE
+
+
+class PlanStoreTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = PlanStore(os.path.join(self.tmp.name, "plans.sqlite"), similarity_threshold=0)
+        self.steps = [{'name': '读取数据', 'description': '读取iris.csv', 'depends_on': []}]
+        self.codes = ["import pandas as pd\ndf = pd.read_csv('iris.csv')"]
+        self.store.save("Load iris.csv and plot histogram", self.steps, self.codes)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_unrelated_task_with_same_word_count_is_not_a_template_match(self):
+        self.assertIsNone(self.store.lookup("Delete all rows from database"))
+        self.assertIsNone(self.store.lookup("Load iris.csv and plot scatter"))
+
+    def test_file_name_is_substituted(self):
+        match = self.store.lookup("load wine.csv and plot histogram.")
+        self.assertEqual(match.kind, TEMPLATE)
+        self.assertEqual(match.codes, ["import pandas as pd\ndf = pd.read_csv('wine.csv')"])
+        self.assertEqual(match.steps[0]['description'], '读取wine.csv')
+
+    def test_plain_words_are_not_substituted(self):
+        self.assertEqual(token_substitutions("加载test.dot并用networkx可视化", "加载a.dot并用networkx可视化"),
+                         {'test.dot': 'a.dot'})
+        self.assertIsNone(token_substitutions("加载test.dot并用networkx可视化", "加载test.dot并用graphviz可视化"))
+
+    def test_invalidate_removes_the_matched_entry(self):
+        match = self.store.lookup("Load wine.csv and plot histogram")
+        self.store.invalidate(match.key)
+        self.assertIsNone(self.store.lookup("Load iris.csv and plot histogram"))
+
+    def test_exact_match_reuses_code(self):
+        match = self.store.lookup("  LOAD iris.csv and plot histogram ")
+        self.assertEqual(match.kind, EXACT)
+        self.assertEqual(match.codes, self.codes)
+
+
+if __name__ == '__main__':
+    unittest.main()